@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -81,12 +82,30 @@ WSGI_APPLICATION = "hermes.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# SQLite by default, PostgreSQL with N5_DB_ENGINE=postgresql and the N5_DB_*
+# connection variables. Connections are kept for N5_DB_CONN_MAX_AGE seconds,
+# the ingest workers reuse theirs between batches.
+
+if os.environ.get("N5_DB_ENGINE", "sqlite3") == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("N5_DB_NAME", "hermes"),
+            "USER": os.environ.get("N5_DB_USER", "hermes"),
+            "PASSWORD": os.environ.get("N5_DB_PASSWORD", ""),
+            "HOST": os.environ.get("N5_DB_HOST", "localhost"),
+            "PORT": os.environ.get("N5_DB_PORT", "5432"),
+        }
     }
-}
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("N5_DB_NAME", BASE_DIR / "db.sqlite3"),
+        }
+    }
+DATABASES["default"]["CONN_MAX_AGE"] = int(os.environ.get("N5_DB_CONN_MAX_AGE", 600))
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
 
 
 # Password validation
@@ -130,6 +149,64 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# N5 logger ingest, run with `manage.py run_ingest`
+N5_MQTT_HOST = "16.171.79.146"
+N5_MQTT_PORT = 1883
+N5_MQTT_TOPIC = "n5_msgs"
+# Ingest workers share the topic through this MQTT v5 shared subscription group
+N5_MQTT_SHARE_GROUP = "hermes_ingest"
+# Store message payloads undecoded at ingest, decode when first viewed/exported
+N5_LAZY_PAYLOAD_DECODE = True
+# Pack the accelerometer samples into TestSerialSamples at ingest, decoding
+# the payload even when its text is rendered later. Off, a message gets its
+# samples when its payload is decoded, or from `manage.py build_samples`.
+N5_INGEST_STORE_SAMPLES = False
+# Ingest inserts with COPY on PostgreSQL, bulk_create when turned off
+N5_INGEST_COPY = True
+# Messages saved per transaction by the ingest writer thread
+N5_INGEST_BATCH_SIZE = 500
+# Longest wait for a batch to fill before saving what has arrived
+N5_INGEST_FLUSH_MS = 200
+# Messages queued between the MQTT callback and the writer, the callback
+# blocks when it is full
+N5_INGEST_QUEUE_MAX = 10000
+# Processes the writer parses batches in, 0 parses in the writer thread. Only
+# worth it when payloads are decoded at ingest (N5_LAZY_PAYLOAD_DECODE = False
+# or N5_INGEST_STORE_SAMPLES = True): sending headers-only batches to a
+# process and back takes about as long as parsing them.
+N5_INGEST_PARSE_WORKERS = 0
+# Received messages are spooled here until saved, one directory per ingest
+# worker. None queues them in memory only.
+N5_INGEST_SPOOL_DIR = BASE_DIR / "spool"
+N5_INGEST_SPOOL_SEGMENT_BYTES = 16 * 1024 * 1024
+# Device serials kept in the ingest device id cache
+N5_DEVICE_CACHE_SIZE = 100000
+# Retransmits are dropped when among the last N5_DEDUP_WINDOW messages of the
+# N5_DEDUP_DEVICES most recently heard from devices
+N5_DEDUP_WINDOW = 1024
+N5_DEDUP_DEVICES = 10000
+# Ingest processes save their metrics here for /metrics to read, every
+# N5_METRICS_SAVE_SECONDS. Snapshots not saved for N5_METRICS_EXPIRE_SECONDS
+# were left by processes that died and are deleted.
+N5_METRICS_DIR = BASE_DIR / "metrics"
+N5_METRICS_SAVE_SECONDS = 10
+N5_METRICS_EXPIRE_SECONDS = 600
+# Addresses or networks /metrics is served to, anyone else gets a 403. Behind
+# a reverse proxy this is the proxy's address.
+N5_METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+# Data retention, applied by `manage.py apply_retention` (run it from cron).
+# TestSerialData rows older than N5_RETENTION_DAYS are deleted, None keeps
+# them. N5_RETENTION_DEVICE_DAYS overrides it per device serial, a None
+# value keeping that device's rows.
+N5_RETENTION_DAYS = None
+N5_RETENTION_DEVICE_DAYS = {}
+# Rows deleted per transaction, the database is unlocked between batches
+N5_RETENTION_BATCH_SIZE = 2000
+# Device exports are streamed in chunks of N5_EXPORT_CHUNK_SIZE rows, gzipped
+# for clients accepting it unless N5_EXPORT_GZIP is False
+N5_EXPORT_CHUNK_SIZE = 2000
+N5_EXPORT_GZIP = True
+
 # SECURE_BROWSER_XSS_FILTER = True
 # SECURE_CONTENT_TYPE_NOSNIFF = True
 # SECURE_SSL_REDIRECT = True
@@ -1,3 +0,0 @@
-from .lib import mqtt
-
-mqtt.client.loop_start()
@@ -1,5 +1,14 @@
 from django.contrib import admin
-from .models import TestDevice, TestSerialData
+from .models import (
+    DeviceSummary,
+    TestDevice,
+    TestSerialData,
+    TestSerialPayload,
+    TestSerialSamples,
+)
 
 admin.site.register(TestDevice)
 admin.site.register(TestSerialData)
+admin.site.register(TestSerialPayload)
+admin.site.register(TestSerialSamples)
+admin.site.register(DeviceSummary)
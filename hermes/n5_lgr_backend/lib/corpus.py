@@ -0,0 +1,171 @@
+import ctypes
+import itertools
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from . import parse_logger_msg
+
+# Synthetic N5 logger messages, in the serial log line format the parser
+# reads, for benchmarks and load generation
+
+DEVICE_IDS = ("HEWGHP", "TATPAJ", "PPP1ZW")
+LGR_MSG_TS_FORMAT = "%a %b %d %H:%M:%S %Y"
+# Logger time (seconds since 2000-01-01) around July 2024
+LOGGER_TS_START = 773_000_000
+
+# Every msg_type, trumi_st and buffer_link_type the header defines
+MSG_TYPES = range(len(parse_logger_msg.HEADER_FORMAT["msg_type"]["enum"]))
+TRUMI_STATES = range(len(parse_logger_msg.HEADER_FORMAT["trumi_st"]["enum"]))
+BUFFER_LINK_TYPES = range(
+    len(parse_logger_msg.HEADER_FORMAT["buffer_link_type"]["enum"])
+)
+HEADER_SIZE = parse_logger_msg.PAYLOAD_POS // 2
+
+
+# Accelerometer samples as an (n, 3) int16 array, the device at rest with
+# gravity on Z plus some noise
+def accel_samples(rng, count):
+    rest = [rng.gauss(-60, 20), rng.gauss(25, 20), rng.gauss(-950, 30)]
+    noise = np.random.default_rng(rng.getrandbits(32)).normal(0, 8, (count, 3))
+    return (noise + rest).astype("<i2")
+
+
+def rice_compress(raw_data):
+    dll = parse_logger_msg.load_rice_library()
+    # Rice_Compress needs an output buffer one byte larger than the input
+    output_buffer = ctypes.create_string_buffer(len(raw_data) + 1)
+    compressed_size = dll.Rice_Compress(
+        raw_data, output_buffer, len(raw_data), parse_logger_msg.RICE_FMT_INT16
+    )
+    return output_buffer.raw[:compressed_size]
+
+
+# Trumi motion payload, Rice compressed FIFOs of 32 samples each as
+# [compressed size:1][timestamp:4][compressed samples]
+def motion_payload(rng, logger_ts, fifo_count):
+    payload = b""
+    for fifo_num in range(fifo_count):
+        samples = accel_samples(rng, parse_logger_msg.RICE_FIFO_SIZE // 6).tobytes()
+        compressed = rice_compress(samples)
+        payload += (
+            bytes([len(compressed)])
+            + (logger_ts + fifo_num).to_bytes(4, "little")
+            + compressed
+        )
+    return payload
+
+
+# Buffered samples after a link loss, [timestamp:4][trumi state:2][xyz:6]
+def link_lost_payload(rng, logger_ts, sample_count):
+    frames = np.zeros(
+        sample_count, dtype=parse_logger_msg.PAYLOAD_FRAME_DTYPES["link_lost_mode"]
+    )
+    frames["timestamp"] = logger_ts + np.arange(sample_count)
+    frames["state"] = [rng.choice(TRUMI_STATES) for _ in range(sample_count)]
+    frames["xyz"] = accel_samples(rng, sample_count).reshape(-1, 1, 3)
+    return frames.tobytes()
+
+
+# Single samples, [timestamp:4][xyz:6]
+def sample_payload(rng, logger_ts, sample_count):
+    frames = np.zeros(sample_count, dtype=parse_logger_msg.PAYLOAD_FRAME_DTYPES[""])
+    frames["timestamp"] = logger_ts + np.arange(sample_count)
+    frames["xyz"] = accel_samples(rng, sample_count).reshape(-1, 1, 3)
+    return frames.tobytes()
+
+
+def boot_payload(rng):
+    version = f"v1.{rng.randrange(10)}.{rng.randrange(100)}"
+    return f"N5 boot fw {version} reset cause 0x{rng.randrange(256):02x}".encode()
+
+
+# Raw message bytes for the given header values, the rest are made up
+def build_message(
+    rng, device_id, msg_type, trumi_st, buffer_link_type, seq_num, logger_ts
+):
+    if msg_type == parse_logger_msg.MSG_TYPE_BOOT_INFO:
+        return device_id.encode() + bytes([msg_type]) + boot_payload(rng)
+
+    if buffer_link_type == parse_logger_msg.BUFFER_LINK_LOST:
+        payload = link_lost_payload(rng, logger_ts, rng.randrange(1, 20))
+    elif trumi_st == parse_logger_msg.TRUMI_ST_MOTION_DETECTION:
+        payload = motion_payload(rng, logger_ts, rng.randrange(1, 8))
+    else:
+        payload = sample_payload(rng, logger_ts, rng.randrange(1, 6))
+
+    header_values = {
+        "device_id": device_id.encode(),
+        "msg_type": msg_type,
+        "flags": rng.randrange(256),
+        "seq_num": seq_num,
+        "msg_gen_ts": logger_ts,
+        "cell_id": rng.randrange(2**32),
+        "cell_id_ts": rng.choice([0, logger_ts - rng.randrange(3600)]),
+        "actual_temp": rng.choice([255, rng.randrange(15, 40)]),
+        "trumi_st": trumi_st,
+        "trumi_st_upd_count": rng.randrange(65536),
+        "trumi_st_upd_ts": logger_ts - rng.randrange(600),
+        "trumi_st_trans_count": rng.randrange(65536),
+        "reloc_st_trans_count": rng.randrange(65536),
+        "stored_st_trans_count": rng.randrange(65536),
+        "wifi_aps": bytes(rng.randrange(256) for _ in range(18)),
+        "reserved_1": 0,
+        "pld_sz": len(payload),
+        "pld_crc": rng.randrange(65536),
+        "buffer_link_type": buffer_link_type,
+        "header_crc": rng.randrange(256),
+        "payload": 0,
+    }
+    header = parse_logger_msg.HEADER_STRUCT.pack(*header_values.values())
+    return header[:HEADER_SIZE] + payload
+
+
+def format_log_line(lgr_msg_ts, message):
+    return f"{lgr_msg_ts.strftime(LGR_MSG_TS_FORMAT)} : Msg: {message.hex()}"
+
+
+# `count` log lines cycling through every msg_type, trumi_st and
+# buffer_link_type combination, the same lines for the same seed
+def generate_messages(count, seed=0, device_ids=DEVICE_IDS):
+    return list(itertools.islice(message_stream(seed, device_ids), count))
+
+
+# Endless log lines cycling through the combinations, the devices taking turns
+# and each counting its own sequence numbers from 1. The logger and log line
+# clocks advance a second per message from the given start times.
+def message_stream(
+    seed=0,
+    device_ids=DEVICE_IDS,
+    logger_ts_start=LOGGER_TS_START,
+    lgr_msg_ts_start=datetime(2024, 7, 8, 15, 57, 5),
+):
+    rng = random.Random(seed)
+    combinations = [
+        (msg_type, trumi_st, buffer_link_type)
+        for msg_type in MSG_TYPES
+        for trumi_st in TRUMI_STATES
+        for buffer_link_type in BUFFER_LINK_TYPES
+    ]
+    seq_nums = dict.fromkeys(device_ids, 0)
+
+    for msg_num in itertools.count():
+        device_id = device_ids[msg_num % len(device_ids)]
+        msg_type, trumi_st, buffer_link_type = combinations[msg_num % len(combinations)]
+        seq_nums[device_id] += 1
+        message = build_message(
+            rng,
+            device_id,
+            msg_type,
+            trumi_st,
+            buffer_link_type,
+            seq_nums[device_id],
+            logger_ts_start + msg_num,
+        )
+        yield format_log_line(lgr_msg_ts_start + timedelta(seconds=msg_num), message)
+
+
+# `count` six character device serials
+def device_serials(count):
+    return tuple(f"LG{number:04d}" for number in range(count))
@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import parse_logger_msg
+
+# A message is identified by its device, sequence number and generation time,
+# read straight from the header hex so duplicates are dropped before they
+# are parsed. The generation time keeps a logger that restarts its sequence
+# numbers from being taken for a retransmit.
+MSG_MARKER = " : Msg: "
+DEVICE_ID_SPAN = tuple(i * 2 for i in parse_logger_msg.HEADER_OFFSETS["device_id"])
+SEQ_NUM_POS = parse_logger_msg.HEADER_OFFSETS["seq_num"][0] * 2
+MSG_GEN_TS_END = parse_logger_msg.HEADER_OFFSETS["msg_gen_ts"][1] * 2
+MSG_TYPE_SPAN = tuple(i * 2 for i in parse_logger_msg.HEADER_OFFSETS["msg_type"])
+BOOT_INFO_HEX = f"{parse_logger_msg.MSG_TYPE_BOOT_INFO:02x}"
+
+
+# (device hex, sequence number and generation time hex) of a raw message, None
+# for BOOT_INFO messages, which have neither, and messages the parser would
+# not take apart
+def message_key(message):
+    index = message.find(MSG_MARKER)
+    if index < 0:
+        return None
+
+    start = index + len(MSG_MARKER)
+    msg_data = message[start : start + MSG_GEN_TS_END].lower()
+    if (
+        len(msg_data) < MSG_GEN_TS_END
+        or msg_data[MSG_TYPE_SPAN[0] : MSG_TYPE_SPAN[1]] == BOOT_INFO_HEX
+    ):
+        return None
+
+    return (
+        msg_data[DEVICE_ID_SPAN[0] : DEVICE_ID_SPAN[1]],
+        msg_data[SEQ_NUM_POS:MSG_GEN_TS_END],
+    )
+
+
+class RecentMessages:
+    """Keys of the messages each device sent most recently.
+
+    Keeps the last `window` keys of up to `max_devices` devices, the least
+    recently heard from devices are forgotten first. Retransmits arrive soon
+    after the original, anything older is left to the database unique
+    constraint.
+    """
+
+    def __init__(self, window=None, max_devices=None):
+        if window is None:
+            window = getattr(settings, "N5_DEDUP_WINDOW", 1024)
+        if max_devices is None:
+            max_devices = getattr(settings, "N5_DEDUP_DEVICES", 10000)
+
+        self.window = window
+        self.max_devices = max_devices
+        self.devices = OrderedDict()
+        self.lock = threading.Lock()
+
+    # The messages not seen before, in order, with their keys and the number
+    # of duplicates dropped. Keys are only remembered once add() is called
+    # with them, after the messages are saved.
+    def filter(self, messages):
+        unique_messages = []
+        keys = []
+        batch_keys = set()
+        with self.lock:
+            for message in messages:
+                key = message_key(message)
+                if key is not None:
+                    device_id, seq = key
+                    if key in batch_keys or seq in self.devices.get(device_id, ()):
+                        continue
+                    batch_keys.add(key)
+                    keys.append(key)
+                unique_messages.append(message)
+
+        return unique_messages, keys, len(messages) - len(unique_messages)
+
+    def add(self, keys):
+        with self.lock:
+            for device_id, seq in keys:
+                seen = self.devices.get(device_id)
+                if seen is None:
+                    seen = self.devices[device_id] = OrderedDict()
+                    if len(self.devices) > self.max_devices:
+                        self.devices.popitem(last=False)
+                else:
+                    self.devices.move_to_end(device_id)
+
+                seen[seq] = None
+                if len(seen) > self.window:
+                    seen.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.devices.clear()
+
+
+recent_messages = RecentMessages()
@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class DeviceCache:
+    """Process-wide TestDevice serial -> pk cache.
+
+    Devices are looked up (and created) once, after that ingest needs no
+    device queries. The least recently used serials are evicted past
+    `max_size`, for very large fleets.
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = getattr(settings, "N5_DEVICE_CACHE_SIZE", 100000)
+
+        self.max_size = max_size
+        self.device_ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Load the most recently added devices
+    def warm(self):
+        from ..models import TestDevice
+
+        devices = list(
+            TestDevice.objects.order_by("-id").values_list("serial", "id")[
+                : self.max_size
+            ]
+        )
+        with self.lock:
+            self.device_ids.clear()
+            self.device_ids.update(reversed(devices))
+
+        return len(devices)
+
+    # serial -> pk for all the serials, creating the devices not seen before
+    # with one insert and one select
+    def get_ids(self, serials):
+        from ..models import TestDevice
+
+        device_ids = {}
+        missing = []
+        with self.lock:
+            for serial in set(serials):
+                device_id = self.device_ids.get(serial)
+                if device_id is None:
+                    missing.append(serial)
+                else:
+                    self.device_ids.move_to_end(serial)
+                    device_ids[serial] = device_id
+
+        if missing:
+            TestDevice.objects.bulk_create(
+                [TestDevice(serial=serial) for serial in missing],
+                ignore_conflicts=True,
+            )
+            found = dict(
+                TestDevice.objects.filter(serial__in=missing).values_list(
+                    "serial", "id"
+                )
+            )
+            device_ids.update(found)
+
+            with self.lock:
+                self.device_ids.update(found)
+                while len(self.device_ids) > self.max_size:
+                    self.device_ids.popitem(last=False)
+
+        return device_ids
+
+    # Forget the serials whose cached device is gone, deleted by another
+    # process or created in a transaction that was rolled back, with one select
+    def forget_deleted(self, serials):
+        from ..models import TestDevice
+
+        found = dict(
+            TestDevice.objects.filter(serial__in=serials).values_list("serial", "id")
+        )
+        with self.lock:
+            for serial in serials:
+                if serial in self.device_ids and (
+                    self.device_ids[serial] != found.get(serial)
+                ):
+                    del self.device_ids[serial]
+
+    def get_id(self, serial):
+        return self.get_ids([serial])[serial]
+
+    # Forget one device, or every device when no serial is given
+    def invalidate(self, serial=None):
+        with self.lock:
+            if serial is None:
+                self.device_ids.clear()
+            else:
+                self.device_ids.pop(serial, None)
+
+
+device_cache = DeviceCache()
@@ -0,0 +1,74 @@
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+# DeviceSummary fields changed by a batch of messages
+SUMMARY_FIELDS = [
+    "message_count",
+    "last_seen",
+    "missing_count",
+    "last_seq_num",
+    "last_msg_gen_ts",
+    "last_actual_temp",
+    "last_trumi_st",
+    "last_cell_id",
+]
+
+
+# Add saved TestSerialData rows, in the order they arrived, to their devices'
+# summaries. Called in the transaction that saved them. The summaries are
+# locked in device order (on databases with row locks), so ingest workers
+# saving the same devices wait for each other rather than deadlock.
+def update_summaries(items):
+    from ..models import DeviceSummary
+
+    device_items = {}
+    for item in items:
+        device_items.setdefault(item.device_serial_id, []).append(item)
+    if not device_items:
+        return
+
+    DeviceSummary.objects.bulk_create(
+        [DeviceSummary(device_id=device_id) for device_id in device_items],
+        ignore_conflicts=True,
+    )
+    summaries = list(
+        DeviceSummary.objects.select_for_update()
+        .filter(device_id__in=device_items)
+        .order_by("device_id")
+    )
+    for summary in summaries:
+        for item in device_items[summary.device_id]:
+            summary.add(item)
+
+    # One statement run per summary, bulk_update's CASE expressions take
+    # longer to build than the rows take to save
+    quote_name = connection.ops.quote_name
+    fields = [DeviceSummary._meta.get_field(name) for name in SUMMARY_FIELDS]
+    sql = (
+        f"UPDATE {quote_name(DeviceSummary._meta.db_table)} SET "
+        + ", ".join(f"{quote_name(field.column)} = %s" for field in fields)
+        + f" WHERE {quote_name(DeviceSummary._meta.pk.column)} = %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            sql,
+            [
+                [
+                    field.get_db_prep_save(getattr(summary, field.attname), connection)
+                    for field in fields
+                ]
+                + [summary.device_id]
+                for summary in summaries
+            ],
+        )
+
+
+# Take deleted rows off a device's message count
+def remove_messages(device_id, count):
+    from ..models import DeviceSummary
+
+    if count:
+        DeviceSummary.objects.filter(device_id=device_id).update(
+            message_count=Greatest(F("message_count") - count, 0)
+        )
@@ -0,0 +1,144 @@
+import csv
+import io
+import itertools
+import re
+
+from django.conf import settings
+
+# A device's rows exported as "| " separated text, streamed chunk by chunk so
+# memory stays flat whatever the device size. The rows are read with a single
+# iterator on the device index, with only the exported columns, and each chunk
+# has its undecoded payloads decoded and is written through one csv writer and
+# buffer.
+
+HEADER = (
+    "seq_num",
+    "msg_gen_ts",
+    "msg type",
+    "cell_id",
+    "cell_id_ts",
+    "actual_temp",
+    "trumi_st",
+    "flags",
+    "trumi_st_upd_count",
+    "trumi_st_upd_ts",
+    "trumi_st_trans_count",
+    "reloc_st_trans_count",
+    "stored_st_trans_count",
+    "wifi_aps",
+    "pld_sz",
+    "pld_crc",
+    "buffer_link_type",
+    "header_crc",
+    "xyz_decomp",
+)
+
+# The TestSerialData and TestSerialPayload columns the export reads, the
+# payload ones include what decoding an undecoded payload needs
+EXPORT_FIELDS = (
+    "device_serial",
+    "msg_type",
+    "flags",
+    "seq_num",
+    "msg_gen_ts",
+    "cell_id",
+    "cell_id_ts",
+    "actual_temp",
+    "trumi_st",
+    "trumi_st_upd_count",
+    "trumi_st_upd_ts",
+    "trumi_st_trans_count",
+    "reloc_st_trans_count",
+    "stored_st_trans_count",
+    "wifi_aps",
+    "pld_sz",
+    "pld_crc",
+    "buffer_link_type",
+    "header_crc",
+    "content__data_msg",
+    "content__payload",
+    "content__payload_type",
+)
+
+# Sample index prefixes and line breaks, dropped from the decompressed xyz data
+XYZ_STRIP = re.compile(r"\[\d+\] |\n")
+
+
+# Rows read per query and written per streamed chunk
+def chunk_size():
+    return getattr(settings, "N5_EXPORT_CHUNK_SIZE", 2000)
+
+
+# Exports are gzipped for clients accepting it unless N5_EXPORT_GZIP is off
+def gzip_enabled():
+    return getattr(settings, "N5_EXPORT_GZIP", True)
+
+
+# Counters are blank for messages without them, as in the page
+def blank_none(value):
+    return "" if value is None else value
+
+
+# The decompressed xyz samples of a payload on one line, other payloads as is
+def xyz_decomp(payload):
+    if "samples" not in payload:
+        return payload
+
+    return XYZ_STRIP.sub("", payload.split("samples", 2)[1])
+
+
+def export_row(item):
+    return (
+        item.seq_num,
+        item.msg_gen_ts_display,
+        item.msg_type_display,
+        item.cell_id,
+        item.cell_id_ts_display,
+        item.actual_temp_display,
+        item.trumi_st_display,
+        item.flags_display.replace("\n", ","),
+        item.trumi_st_upd_count,
+        item.trumi_st_upd_ts_display,
+        blank_none(item.trumi_st_trans_count),
+        blank_none(item.reloc_st_trans_count),
+        blank_none(item.stored_st_trans_count),
+        item.wifi_aps,
+        blank_none(item.pld_sz),
+        item.pld_crc,
+        item.buffer_link_type_display,
+        item.header_crc,
+        xyz_decomp(item.content.payload),
+    )
+
+
+# Values after the first are written with a leading space, giving the "| "
+# separators of the export
+def _spaced(values):
+    return [values[0], *(f" {value}" for value in values[1:])]
+
+
+# The export of the rows of `message_data`, in its order, as text chunks
+def export_lines(message_data, size=None):
+    from ..models import TestSerialData
+
+    size = size or chunk_size()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter="|", lineterminator="\n")
+
+    def flush():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(_spaced(HEADER))
+    yield flush()
+
+    rows = message_data.select_related("content").only(*EXPORT_FIELDS)
+    rows = rows.iterator(chunk_size=size)
+    for items in iter(lambda: list(itertools.islice(rows, size)), []):
+        # Payloads stored undecoded at ingest are decoded on first export
+        TestSerialData.decode_payloads(items)
+
+        writer.writerows(_spaced(export_row(item)) for item in items)
+        yield flush()
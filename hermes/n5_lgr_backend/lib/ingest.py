@@ -0,0 +1,647 @@
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    IntegrityError,
+    InterfaceError,
+    OperationalError,
+    close_old_connections,
+    connection,
+    transaction,
+)
+
+from . import parse_logger_msg, pg_copy
+from .samples import sample_fields
+from .dedup import message_key, recent_messages
+from .device_summary import update_summaries
+from .device_cache import device_cache
+from .metrics import metrics, save_seconds
+from .parse_pool import create_parse_pool
+from .spool import Spool
+
+# Wait before saving a spooled batch again after it failed
+SPOOL_RETRY_DELAY = 5
+
+# Errors of a database that is down, locked or was restarted, saving the same
+# messages again can work once it is back
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+# Spooled messages that could not be saved, one "<timestamp> : Msg: <hex>"
+# line each in the spool directory, to be loaded again with ingest_logs
+QUARANTINE_FILE = "quarantine.log"
+
+
+# With lazy payload decoding, ingest stores the raw payload and its type and
+# the payload is decoded when first displayed or exported
+def decode_payloads_at_ingest():
+    return not getattr(settings, "N5_LAZY_PAYLOAD_DECODE", False)
+
+
+# The payload samples are packed into TestSerialSamples at ingest, also when
+# the payload text is rendered later
+def store_samples_at_ingest():
+    return getattr(settings, "N5_INGEST_STORE_SAMPLES", False)
+
+
+# Metric labels of a parsed message
+def message_labels(parsed_msg):
+    return (
+        ("msg_type", parsed_msg["msg_type"]),
+        ("trumi_st", parsed_msg["trumi_st"]),
+    )
+
+
+# Parse a batch of raw messages, the malformed ones are left out. Headers are
+# decoded for the whole batch, then payloads (unless decoded lazily), so each
+# stage is timed on its own.
+def parse_messages(messages):
+    start_time = time.perf_counter()
+    parsed_msgs = []
+    for message in messages:
+        try:
+            parsed_msgs.append(
+                parse_logger_msg.parser.parse_msg(message, decode_payload=False)
+            )
+        except ValueError as error:
+            metrics.inc("n5_ingest_skipped_total")
+            print(f"{datetime.now()}: Skipping message ({error}): {message}")
+
+    metrics.observe_batch(
+        "n5_ingest_header_decode_seconds",
+        time.perf_counter() - start_time,
+        Counter(map(message_labels, parsed_msgs)),
+    )
+
+    decode_payloads = decode_payloads_at_ingest()
+    if decode_payloads or store_samples_at_ingest():
+        for parsed_msg in parsed_msgs:
+            if parsed_msg["payload_type"] is not None:
+                _decode_at_ingest(parsed_msg, decode_payloads)
+
+    return parsed_msgs
+
+
+# Render the payload of a parsed message, or only pack its samples. A payload
+# that cannot be decoded is left undecoded, the message is saved without it.
+def _decode_at_ingest(parsed_msg, render):
+    labels = dict(message_labels(parsed_msg))
+    try:
+        if render:
+            payload, xyz_raw, samples = render_payload(
+                parsed_msg["data_msg"], parsed_msg["payload_type"], labels
+            )
+        else:
+            samples = sample_fields(
+                decode_payload(
+                    parsed_msg["data_msg"], parsed_msg["payload_type"], labels
+                )
+            )
+    except parse_logger_msg.PAYLOAD_ERRORS as error:
+        metrics.inc("n5_ingest_payload_errors_total", labels)
+        print(
+            f"{datetime.now()}: Payload not decoded ({error}): "
+            f"{parsed_msg['data_msg']}"
+        )
+        return
+
+    if render:
+        parsed_msg["payload"] = payload
+        parsed_msg["xyz_raw"] = xyz_raw
+        parsed_msg["payload_type"] = None
+    parsed_msg["samples"] = samples
+
+
+# XYZPayload of a message whose payload is not decoded yet
+def decode_payload(data_msg, payload_type, labels=None):
+    start_time = time.perf_counter()
+    xyz_payload = parse_logger_msg.parser.parse_xyz_payload(data_msg, payload_type)
+
+    if payload_type == "decompress_payload":
+        decode_stage = "n5_ingest_decompress_seconds"
+    else:
+        decode_stage = "n5_ingest_payload_decode_seconds"
+    metrics.observe(decode_stage, time.perf_counter() - start_time, labels)
+
+    return xyz_payload
+
+
+# Payload text, raw hex and TestSerialSamples fields (None without samples) of
+# a message whose payload is not decoded yet
+def render_payload(data_msg, payload_type, labels=None):
+    xyz_payload = decode_payload(data_msg, payload_type, labels)
+    start_time = time.perf_counter()
+    payload = xyz_payload.render()
+    xyz_raw = xyz_payload.raw_hex()
+    metrics.observe(
+        "n5_ingest_render_seconds", time.perf_counter() - start_time, labels
+    )
+    samples = sample_fields(xyz_payload)
+
+    return payload, xyz_raw, samples
+
+
+# Header fields stored as their raw integer values, display text comes from
+# the parser lookup tables
+INTEGER_HEADER_FIELDS = (
+    "msg_type",
+    "flags",
+    "trumi_st",
+    "trumi_st_trans_count",
+    "reloc_st_trans_count",
+    "stored_st_trans_count",
+    "pld_sz",
+    "buffer_link_type",
+)
+
+
+# Timestamps are stored as UTC datetimes, None when the message has none
+def timestamp_datetime(epoch_seconds):
+    if epoch_seconds is None or epoch_seconds == "":
+        return None
+
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc)
+
+
+# TestSerialData field values for a parsed message, without the device
+def serial_data_fields(parsed_msg):
+    # Check sequence number is an integer
+    seq_num = parsed_msg["seq_num"]
+    if type(seq_num) != int:
+        seq_num = 000
+
+    # Check trumi update count is an integer
+    trumi_st_upd_count = parsed_msg["trumi_st_upd_count"]
+    if type(trumi_st_upd_count) != int:
+        trumi_st_upd_count = 000
+
+    header_values = parsed_msg.get("header_values")
+    if header_values is None:
+        # BOOT_INFO and unparsed messages have no header past the message type
+        fields = dict.fromkeys(INTEGER_HEADER_FIELDS)
+        if parsed_msg["msg_type"] == "BOOT_INFO":
+            fields["msg_type"] = parse_logger_msg.MSG_TYPE_BOOT_INFO
+        actual_temp = None
+    else:
+        fields = {
+            field: header_values[parse_logger_msg.HEADER_INDEX[field]]
+            for field in INTEGER_HEADER_FIELDS
+        }
+        actual_temp = parse_logger_msg.actual_temp_celsius(
+            header_values[parse_logger_msg.HEADER_INDEX["actual_temp"]]
+        )
+
+    fields.update(
+        {
+            "lgr_msg_ts": parsed_msg["lgr_msg_ts"],
+            "seq_num": seq_num,
+            "msg_gen_ts": timestamp_datetime(parsed_msg["msg_gen_ts"]),
+            "cell_id": parsed_msg["cell_id"],
+            "cell_id_ts": timestamp_datetime(parsed_msg["cell_id_ts"]),
+            "actual_temp": actual_temp,
+            "trumi_st_upd_count": trumi_st_upd_count,
+            "trumi_st_upd_ts": timestamp_datetime(parsed_msg["trumi_st_upd_ts"]),
+            "wifi_aps": parsed_msg["wifi_aps"],
+            "pld_crc": parsed_msg["pld_crc"],
+            "header_crc": parsed_msg["header_crc"],
+        }
+    )
+    return fields
+
+
+# TestSerialPayload field values for a parsed message
+def payload_fields(parsed_msg):
+    return {
+        "data_msg": parsed_msg["data_msg"],
+        "payload": parsed_msg["payload"],
+        "xyz_raw": parsed_msg["xyz_raw"],
+        "payload_type": parsed_msg["payload_type"],
+    }
+
+
+# Save a batch of parsed messages in one transaction, the device ids come from
+# the device cache. `copy` chooses COPY on PostgreSQL, N5_INGEST_COPY when
+# None. Returns the rows saved.
+def save_parsed_msgs(parsed_msgs, batch_size=None, copy=None):
+    serials = {parsed_msg["device_id"] for parsed_msg in parsed_msgs}
+    copy = pg_copy.copy_enabled(copy)
+
+    try:
+        return _save_rows(parsed_msgs, serials, batch_size, copy)
+    except IntegrityError:
+        # A cached device was deleted, by a purge in another process, or
+        # messages in the batch were saved before. Retry once with the gone
+        # devices created again and without the saved messages.
+        device_cache.forget_deleted(serials)
+        return _save_rows(parsed_msgs, serials, batch_size, copy, skip_saved=True)
+    except Exception:
+        # Devices created in the rolled back transaction do not exist
+        _invalidate_devices(serials)
+        raise
+
+
+def _save_rows(parsed_msgs, serials, batch_size, copy, skip_saved=False):
+    from ..models import TestSerialData, TestSerialPayload, TestSerialSamples
+
+    start_time = time.perf_counter()
+    with transaction.atomic():
+        device_ids = device_cache.get_ids(serials)
+        lookup_time = time.perf_counter()
+        rows = []
+        for parsed_msg in parsed_msgs:
+            item = TestSerialData(
+                device_serial_id=device_ids[parsed_msg["device_id"]],
+                **serial_data_fields(parsed_msg),
+            )
+            rows.append(
+                (
+                    parsed_msg,
+                    item,
+                    TestSerialPayload(serial_data=item, **payload_fields(parsed_msg)),
+                )
+            )
+        if skip_saved:
+            rows = _unsaved_rows(rows)
+
+        # The payload rows take the ids set on the items when they are saved
+        _insert_rows(TestSerialData, [item for _, item, _ in rows], batch_size, copy)
+        _insert_rows(
+            TestSerialPayload, [content for _, _, content in rows], batch_size, copy
+        )
+        _insert_rows(
+            TestSerialSamples,
+            [
+                TestSerialSamples(
+                    serial_data=item,
+                    device_serial_id=item.device_serial_id,
+                    **parsed_msg["samples"],
+                )
+                for parsed_msg, item, _ in rows
+                if parsed_msg.get("samples")
+            ],
+            batch_size,
+            copy,
+        )
+        update_summaries([item for _, item, _ in rows])
+    end_time = time.perf_counter()
+
+    label_counts = Counter(message_labels(parsed_msg) for parsed_msg, _, _ in rows)
+    metrics.observe_batch(
+        "n5_ingest_device_lookup_seconds", lookup_time - start_time, label_counts
+    )
+    metrics.observe_batch(
+        "n5_ingest_db_write_seconds", end_time - lookup_time, label_counts
+    )
+    for labels, count in label_counts.items():
+        metrics.inc("n5_ingest_messages_total", dict(labels), count)
+
+    return len(rows)
+
+
+# COPY when `copy` is set, only on PostgreSQL, bulk_create otherwise
+def _insert_rows(model, objs, batch_size, copy):
+    if copy:
+        pg_copy.copy_rows(model, objs)
+    else:
+        model.objects.bulk_create(objs, batch_size=batch_size)
+
+
+# Messages covered by the unique message constraints have a key, those without
+# a generation time are keyed by the device and sequence number with None
+def _message_key(item):
+    if item.msg_type is None or item.msg_type == parse_logger_msg.MSG_TYPE_BOOT_INFO:
+        return None
+
+    return item.device_serial_id, item.seq_num, item.msg_gen_ts
+
+
+# The rows whose message is not saved already, nor earlier in the batch
+def _unsaved_rows(rows):
+    from ..models import TestSerialData
+
+    keys = {_message_key(item) for _, item, _ in rows} - {None}
+    saved = set(
+        TestSerialData.objects.filter(
+            device_serial_id__in={key[0] for key in keys},
+            seq_num__in={key[1] for key in keys},
+            msg_type__isnull=False,
+        )
+        .exclude(msg_type=parse_logger_msg.MSG_TYPE_BOOT_INFO)
+        .values_list("device_serial_id", "seq_num", "msg_gen_ts")
+    )
+
+    unsaved = []
+    for row in rows:
+        key = _message_key(row[1])
+        if key is not None:
+            if key in saved:
+                continue
+            saved.add(key)
+        unsaved.append(row)
+
+    if len(unsaved) < len(rows):
+        metrics.inc("n5_ingest_duplicates_total", amount=len(rows) - len(unsaved))
+    return unsaved
+
+
+def _invalidate_devices(serials):
+    for serial in serials:
+        device_cache.invalidate(serial)
+
+
+# Marks the end of the queue for the writer thread
+_STOP = object()
+
+
+class IngestWriter:
+    """Write-behind queue between the MQTT callback and the database.
+
+    put() only queues the raw message, a writer thread parses and saves the
+    messages in batches of up to `batch_size`, waiting at most `flush_ms`
+    for a batch to fill. The queue holds `queue_max` messages, put() blocks
+    while it is full so the backlog stays with the broker. With
+    N5_INGEST_PARSE_WORKERS set the batches are parsed in a ParsePool.
+    `metrics_dir` and `copy` are passed to metrics.save() and
+    save_parsed_msgs(), None takes them from the settings.
+    """
+
+    # Errors the whole batch is given up on for, to be written again
+    retry_errors = ()
+
+    def __init__(
+        self,
+        batch_size=None,
+        flush_ms=None,
+        queue_max=None,
+        metrics_dir=None,
+        copy=None,
+    ):
+        if batch_size is None:
+            batch_size = getattr(settings, "N5_INGEST_BATCH_SIZE", 500)
+        if flush_ms is None:
+            flush_ms = getattr(settings, "N5_INGEST_FLUSH_MS", 200)
+        if queue_max is None:
+            queue_max = getattr(settings, "N5_INGEST_QUEUE_MAX", 10000)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.metrics_dir = metrics_dir
+        self.copy = copy
+        self.queue = queue.Queue(maxsize=queue_max)
+        self.thread = None
+        self.parse_pool = create_parse_pool()
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self.run, name="n5-ingest-writer", daemon=True
+            )
+            self.thread.start()
+
+    def put(self, message, block=True, timeout=None):
+        self.queue.put((time.time(), message), block, timeout)
+
+    # Save what is queued and stop the writer thread, the process's metrics
+    # snapshot goes with it
+    def stop(self, timeout=None):
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+            self.thread = None
+        metrics.remove(metrics_dir=self.metrics_dir)
+
+    def run(self):
+        try:
+            try:
+                device_cache.warm()
+            except DatabaseError as error:
+                print(f"{datetime.now()}: Device cache not warmed: {error}")
+
+            self.consume()
+        finally:
+            # The thread has its own database connection
+            connection.close()
+            if self.parse_pool is not None:
+                self.parse_pool.shutdown()
+
+    def consume(self):
+        stopping = False
+        while not stopping:
+            items, stopping = self.next_batch()
+            if items:
+                # The connection is kept for CONN_MAX_AGE and replaced once
+                # broken, as between requests
+                close_old_connections()
+                self.write(items)
+                metrics.set_gauge("n5_ingest_queue_depth", self.queue.qsize())
+                metrics.save(metrics_dir=self.metrics_dir)
+
+    # Wait for a message, saving the metrics snapshot while idle, then take
+    # more until the batch is full or the flush interval has passed since the
+    # first one. Items are (receive time, message) pairs.
+    def next_batch(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=save_seconds())
+                break
+            except queue.Empty:
+                metrics.save(metrics_dir=self.metrics_dir)
+        if item is _STOP:
+            return [], True
+
+        items = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if item is _STOP:
+                return items, True
+            items.append(item)
+
+        return items, False
+
+    # Returns whether the messages were dealt with, False only after an error
+    # in `retry_errors`. Retransmits of recently saved messages are dropped
+    # before they are parsed.
+    def write(self, items):
+        messages, keys, duplicates = recent_messages.filter(
+            [message for _, message in items]
+        )
+        try:
+            rejected = self.save(messages) if messages else []
+        except self.retry_errors as error:
+            metrics.inc("n5_ingest_errors_total")
+            print(f"{datetime.now()}: Error saving {len(messages)} messages: {error}")
+            return False
+
+        if rejected:
+            # Rejected messages are not remembered, a retransmit is tried again
+            rejected_keys = set(map(message_key, rejected))
+            keys = [
+                key
+                for key in map(message_key, messages)
+                if key is not None and key not in rejected_keys
+            ]
+        recent_messages.add(keys)
+        if duplicates:
+            metrics.inc("n5_ingest_duplicates_total", amount=duplicates)
+
+        saved_at = time.time()
+        for received_at, message in items:
+            if message not in rejected:
+                metrics.observe("n5_ingest_end_to_end_seconds", saved_at - received_at)
+        return True
+
+    # Save the messages in one batch. When the batch fails they are saved one
+    # at a time, so only the messages that cannot be saved are lost, which are
+    # rejected and returned.
+    def save(self, messages):
+        try:
+            if self.parse_pool is not None:
+                parsed_msgs = self.parse_pool.parse_messages(messages)
+            else:
+                parsed_msgs = parse_messages(messages)
+            save_parsed_msgs(parsed_msgs, copy=self.copy)
+            return []
+        except self.retry_errors:
+            raise
+        except Exception as error:
+            metrics.inc("n5_ingest_errors_total")
+            print(
+                f"{datetime.now()}: Error saving {len(messages)} messages, "
+                f"saving them one at a time: {error}"
+            )
+
+        rejected = []
+        for message in messages:
+            try:
+                save_parsed_msgs(parse_messages([message]), copy=self.copy)
+            except self.retry_errors:
+                raise
+            except Exception as error:
+                self.reject(message, error)
+                rejected.append(message)
+
+        return rejected
+
+    def reject(self, message, error):
+        metrics.inc("n5_ingest_rejected_total")
+        print(f"{datetime.now()}: Message not saved ({error}): {message}")
+
+
+class SpooledIngestWriter(IngestWriter):
+    """IngestWriter with its queue in an on-disk Spool.
+
+    put() appends the message to the spool and never waits for the
+    database. The writer thread tails the spool, commits the spool position
+    after each saved batch and retries a batch that failed on a transient
+    database error, so messages survive a slow or locked database and are
+    replayed from the checkpoint after a crash. Messages that cannot be
+    saved on their own are moved to the quarantine file, so they do not
+    hold up the spool.
+    """
+
+    retry_errors = TRANSIENT_ERRORS
+
+    def __init__(
+        self,
+        spool_dir,
+        segment_bytes=None,
+        batch_size=None,
+        flush_ms=None,
+        metrics_dir=None,
+        copy=None,
+    ):
+        super().__init__(batch_size, flush_ms, metrics_dir=metrics_dir, copy=copy)
+        if segment_bytes is None:
+            segment_bytes = getattr(
+                settings, "N5_INGEST_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024
+            )
+
+        self.spool = Spool(spool_dir, segment_bytes)
+        self.appended = threading.Event()
+        self.stopping = threading.Event()
+
+    def put(self, message, block=True, timeout=None):
+        self.spool.append(message, time.time())
+        self.appended.set()
+
+    # Save what is spooled and stop the writer thread, what cannot be saved
+    # stays in the spool for the next start
+    def stop(self, timeout=None):
+        if self.thread is not None:
+            self.stopping.set()
+            self.appended.set()
+            self.thread.join(timeout)
+            self.thread = None
+        self.spool.close()
+        metrics.remove(metrics_dir=self.metrics_dir)
+
+    def reject(self, message, error):
+        super().reject(message, error)
+        with open(self.spool.directory / QUARANTINE_FILE, "a") as quarantine:
+            quarantine.write(f"{message}\n")
+
+    def consume(self):
+        while True:
+            items, position = self.next_batch()
+            if items:
+                close_old_connections()
+                if self.write(items):
+                    self.spool.commit(position)
+                    metrics.set_gauge(
+                        "n5_ingest_spool_backlog_bytes", self.spool.backlog_bytes()
+                    )
+                    metrics.save(metrics_dir=self.metrics_dir)
+                    continue
+
+                # Read the batch again once the database is back
+                self.spool.rewind()
+                if self.stopping.wait(SPOOL_RETRY_DELAY):
+                    return
+            elif self.stopping.is_set():
+                return
+
+    def next_batch(self):
+        items, position = self.spool.read(self.batch_size)
+        while not items and not self.stopping.is_set():
+            if not self.appended.wait(save_seconds()):
+                metrics.save(metrics_dir=self.metrics_dir)
+            self.appended.clear()
+            items, position = self.spool.read(self.batch_size)
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch_size and not self.stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.appended.wait(remaining)
+            self.appended.clear()
+            more_items, position = self.spool.read(self.batch_size - len(items))
+            items += more_items
+
+        return items, position
+
+
+# Spooled writer when N5_INGEST_SPOOL_DIR is set, one spool directory per
+# ingest worker
+def create_writer(worker_index=0):
+    spool_dir = getattr(settings, "N5_INGEST_SPOOL_DIR", None)
+    if spool_dir:
+        return SpooledIngestWriter(Path(spool_dir) / f"worker-{worker_index}")
+
+    return IngestWriter()
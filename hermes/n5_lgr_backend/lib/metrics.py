@@ -0,0 +1,320 @@
+import bisect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+# In-process ingest metrics, exposed in Prometheus text format. Each ingest
+# process saves a snapshot to N5_METRICS_DIR now and then, the /metrics view
+# and the ingest_metrics command add up the snapshots of every process. Gauges
+# are not added up, each process's get a `process` label. A process removes its
+# snapshot when it stops, one not saved for N5_METRICS_EXPIRE_SECONDS was left
+# by a process that died and is deleted.
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+HELP = {
+    "n5_ingest_header_decode_seconds": "Regex match and header decode per message",
+    "n5_ingest_decompress_seconds": "Rice decompression of a motion payload",
+    "n5_ingest_payload_decode_seconds": "Decode of an uncompressed payload",
+    "n5_ingest_render_seconds": "Rendering a decoded payload to text",
+    "n5_ingest_device_lookup_seconds": "Device id lookup per message",
+    "n5_ingest_db_write_seconds": "Database insert and commit per message",
+    "n5_ingest_end_to_end_seconds": "Message receipt to database commit",
+    "n5_ingest_messages_total": "Messages saved",
+    "n5_ingest_skipped_total": "Messages that could not be parsed",
+    "n5_ingest_payload_errors_total": "Payloads that could not be decoded at ingest",
+    "n5_ingest_duplicates_total": "Retransmitted messages not saved again",
+    "n5_ingest_errors_total": "Batches that failed to save",
+    "n5_ingest_rejected_total": "Messages that could not be saved, even on their own",
+    "n5_ingest_queue_depth": "Messages waiting in the in-memory ingest queue",
+    "n5_ingest_spool_backlog_bytes": "Spooled bytes not yet saved",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.saved_at = 0
+
+    def observe(self, name, value, labels=None, count=1):
+        key = (name, _label_key(labels))
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[bucket] += count
+            histogram[-1] += value * count
+
+    # A batch stage timed as a whole, each message gets the batch average.
+    # label_counts maps message labels to the number of messages with them.
+    def observe_batch(self, name, elapsed, label_counts):
+        total = sum(label_counts.values())
+        if total:
+            for labels, count in label_counts.items():
+                self.observe(name, elapsed / total, dict(labels), count)
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=None):
+        with self.lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def snapshot(self):
+        with self.lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            "process": process_name,
+            "buckets": list(self.buckets),
+            "histograms": [
+                [name, list(labels), list(values)]
+                for (name, labels), values in self.histograms.items()
+            ],
+            "counters": [
+                [name, list(labels), value]
+                for (name, labels), value in self.counters.items()
+            ],
+            "gauges": [
+                [name, list(labels), value]
+                for (name, labels), value in self.gauges.items()
+            ],
+        }
+
+    # Snapshot of what was recorded since the last drain, which is forgotten.
+    # Parse pool workers hand their metrics back to the writer this way.
+    def drain(self):
+        with self.lock:
+            snapshot = self._snapshot()
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+        return snapshot
+
+    # Add a drained snapshot to this process's metrics
+    def add(self, snapshot):
+        with self.lock:
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    self.histograms[key] = list(values)
+                else:
+                    for index, value in enumerate(values):
+                        histogram[index] += value
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, value in snapshot["gauges"]:
+                self.gauges[(name, tuple(map(tuple, labels)))] = value
+
+    # Write the snapshot for other processes to read to `metrics_dir`
+    # (N5_METRICS_DIR when None), at most every N5_METRICS_SAVE_SECONDS unless
+    # forced
+    def save(self, force=False, metrics_dir=None):
+        snapshot_path = _snapshot_path(metrics_dir)
+        if snapshot_path is None:
+            return
+
+        now = time.monotonic()
+        if not force and now - self.saved_at < save_seconds():
+            return
+        self.saved_at = now
+
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_text(json.dumps(self.snapshot()))
+        os.replace(temp_path, snapshot_path)
+
+    # Delete the saved snapshot, once the process is done ingesting
+    def remove(self, metrics_dir=None):
+        snapshot_path = _snapshot_path(metrics_dir)
+        if snapshot_path is not None:
+            snapshot_path.unlink(missing_ok=True)
+        self.saved_at = 0
+
+
+# Seconds between snapshot saves, idle ingest processes save this often too so
+# their snapshot does not expire
+def save_seconds():
+    return getattr(settings, "N5_METRICS_SAVE_SECONDS", 10)
+
+
+def _snapshot_path(metrics_dir=None):
+    if metrics_dir is None:
+        metrics_dir = getattr(settings, "N5_METRICS_DIR", None)
+    if not metrics_dir:
+        return None
+
+    return Path(metrics_dir) / f"{process_name}.json"
+
+
+# Snapshots of this process and every process that saved one, the in-process
+# metrics replace this process's saved snapshot. Expired snapshots are deleted.
+def collect():
+    snapshots = {process_name: metrics.snapshot()}
+    metrics_dir = getattr(settings, "N5_METRICS_DIR", None)
+    if metrics_dir:
+        expire_before = time.time() - getattr(
+            settings, "N5_METRICS_EXPIRE_SECONDS", 600
+        )
+        for snapshot_path in Path(metrics_dir).glob("*.json"):
+            if snapshot_path.stem == process_name:
+                continue
+            try:
+                if snapshot_path.stat().st_mtime < expire_before:
+                    snapshot_path.unlink()
+                    continue
+                snapshot = json.loads(snapshot_path.read_text())
+            except (OSError, ValueError):
+                # Being replaced, or gone
+                continue
+            snapshot["process"] = snapshot_path.stem
+            snapshots[snapshot_path.stem] = snapshot
+
+    return list(snapshots.values())
+
+
+# Add up the snapshots, per metric name then labels. Gauges are kept per
+# snapshot, labelled with its process.
+def merge(snapshots):
+    histograms = {}
+    counters = {}
+    gauges = {}
+    buckets = list(LATENCY_BUCKETS)
+    for snapshot in snapshots:
+        if snapshot["buckets"] != buckets:
+            continue
+        for name, labels, values in snapshot["histograms"]:
+            key = tuple(map(tuple, labels))
+            merged = histograms.setdefault(name, {}).setdefault(
+                key, [0] * len(values)
+            )
+            for index, value in enumerate(values):
+                merged[index] += value
+        for name, labels, value in snapshot["counters"]:
+            key = tuple(map(tuple, labels))
+            metric = counters.setdefault(name, {})
+            metric[key] = metric.get(key, 0) + value
+        process = snapshot.get("process")
+        for name, labels, value in snapshot["gauges"]:
+            key = tuple(map(tuple, labels))
+            if process is not None:
+                key += (("process", process),)
+            gauges.setdefault(name, {})[key] = value
+
+    return buckets, histograms, counters, gauges
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    formatted = []
+    for key, value in pairs:
+        value = str(value).strip().replace("\\", "\\\\").replace('"', '\\"')
+        formatted.append(f'{key}="{value}"'.replace("\n", "\\n"))
+    return "{" + ",".join(formatted) + "}"
+
+
+def render_prometheus(snapshots):
+    buckets, histograms, counters, gauges = merge(snapshots)
+    lines = []
+    for name in sorted(histograms):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, values in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, count in zip(buckets + ["+Inf"], values[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels(labels, [("le", bound)])
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    for metric_type, totals in (("counter", counters), ("gauge", gauges)):
+        for name in sorted(totals):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(totals[name].items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Count, mean and approximate percentiles for each histogram
+def summarize(snapshots):
+    buckets, histograms, _, _ = merge(snapshots)
+    rows = []
+    for name in sorted(histograms):
+        for labels, values in sorted(histograms[name].items()):
+            count = sum(values[:-1])
+            if not count:
+                continue
+            rows.append(
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": count,
+                    "mean": values[-1] / count,
+                    "p50": _percentile(buckets, values, count, 0.5),
+                    "p99": _percentile(buckets, values, count, 0.99),
+                }
+            )
+
+    return rows
+
+
+# Upper bound of the bucket holding the percentile
+def _percentile(buckets, values, count, fraction):
+    cumulative = 0
+    for bound, bucket_count in zip(buckets + [float("inf")], values[:-1]):
+        cumulative += bucket_count
+        if cumulative >= count * fraction:
+            return bound
+
+    return float("inf")
+
+
+# Name of this process's snapshot, ingest workers set their own
+process_name = f"process-{os.getpid()}"
+metrics = Metrics()
@@ -1,121 +1,227 @@
 import paho.mqtt.client as mqtt
-from . import parse_logger_msg
+from . import ingest
 from datetime import datetime
+import asyncio
+import collections
+import functools
+import os
+import queue
 import socket
-import time
+import threading
 
+# Wait before reconnecting after a lost or failed connection
+RECONNECT_DELAY = 15
 
-def on_connect(mqtt_client, userdata, flags, rc, a):
-    if rc == 0:
-        # print("Connected successfully")
-        mqtt_client.subscribe("n5_msgs")
-    else:
-        print("Bad connection. Code:", rc)
 
+# Topic to subscribe to, shared subscriptions split the topic's messages
+# between the clients of the group
+def subscription_topic(topic, group=None):
+    if group:
+        return f"$share/{group}/{topic}"
 
-def on_message(mqtt_client, userdata, msg):
+    return topic
 
-    from ..models import TestDevice, TestSerialData
 
-    start_time = time.time()
+def unique_client_id(prefix):
+    return f"{prefix}-{socket.gethostname()}-{os.getpid()}"
 
-    message = msg.payload.decode()
 
-    try:
-        n5_lgr = parse_logger_msg.N5LoggerParse()
-        parsed_msg = n5_lgr.parse_msg(message)
-    except RuntimeWarning as run_warn:
-        print("Save message as unknown type, set device message as data msg in models")
-        item = TestSerialData(
-            lgr_msg_ts="ERROR: Check payload",
-            payload=f"{run_warn}: {message}",
-        )
-        item.save()
-    else:
-        # Save device ID if not already in database
-        device_id = parsed_msg["device_id"]
-        item = TestDevice(serial=device_id)
-        item.save()
-
-        # Check sequence number is an integer
-        seq_num = parsed_msg["seq_num"]
-        if type(seq_num) != int:
-            seq_num = 000
-
-        # Check trumi update count is an integer
-        trumi_st_upd_count = parsed_msg["trumi_st_upd_count"]
-        if type(trumi_st_upd_count) != int:
-            trumi_st_upd_count = 000
-
-        item = TestSerialData(
-            lgr_msg_ts=parsed_msg["lgr_msg_ts"],
-            device_serial=TestDevice.objects.get(serial=device_id),
-            data_msg=parsed_msg["data_msg"],
-            msg_type=parsed_msg["msg_type"],
-            flags=parsed_msg["flags"],
-            seq_num=seq_num,
-            msg_gen_ts=parsed_msg["msg_gen_ts"],
-            cell_id=parsed_msg["cell_id"],
-            cell_id_ts=parsed_msg["cell_id_ts"],
-            actual_temp=parsed_msg["actual_temp"],
-            trumi_st=parsed_msg["trumi_st"],
-            trumi_st_upd_count=trumi_st_upd_count,
-            trumi_st_upd_ts=parsed_msg["trumi_st_upd_ts"],
-            trumi_st_trans_count=parsed_msg["trumi_st_trans_count"],
-            reloc_st_trans_count=parsed_msg["reloc_st_trans_count"],
-            stored_st_trans_count=parsed_msg["stored_st_trans_count"],
-            wifi_aps=parsed_msg["wifi_aps"],
-            pld_sz=parsed_msg["pld_sz"],
-            pld_crc=parsed_msg["pld_crc"],
-            buffer_link_type=parsed_msg["buffer_link_type"],
-            header_crc=parsed_msg["header_crc"],
-            payload=parsed_msg["payload"],
-            xyz_raw=parsed_msg["xyz_raw"],
+class IngestService:
+    """MQTT ingest client with its network I/O on an asyncio event loop.
+
+    Messages go to an IngestWriter, when its queue is full the service stops
+    reading from the broker until the waiting messages fit.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        topic,
+        group=None,
+        client_id=None,
+        writer=None,
+        keepalive=60,
+    ):
+        self.host = host
+        self.port = port
+        self.topic = subscription_topic(topic, group)
+        self.keepalive = keepalive
+        self.writer = writer or ingest.create_writer()
+
+        self.client = mqtt.Client(
+            client_id=client_id or unique_client_id("hermes-ingest"),
+            transport="tcp",
+            protocol=mqtt.MQTTv5,
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
         )
-        item.save()
-
-    total_time = time.time() - start_time
-
-    print(
-        f"Message parsed ({device_id}-{seq_num}) and saved to database: {total_time} seconds"
-    )
-
-    # if device_id == "PPP1ZW":
-    #     print(
-    #         f"Message parsed ({device_id}-{seq_num}) and saved to database: {total_time} seconds"
-    #     )
-    #     for key, value in parsed_msg.items():
-    #         if key not in ["payload"]:
-    #             print(f"{key}: {value}")
-
-
-client = mqtt.Client(
-    client_id="Mary101",
-    transport="tcp",
-    protocol=mqtt.MQTTv5,
-    callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
-)
-
-client.on_connect = on_connect
-client.on_message = on_message
-
-retries = 0
-while not client.is_connected():
-    retries += 1
-
-    try:
-        cl_con = client.connect(host="16.171.79.146", port=1883, keepalive=60)
-        if cl_con == 0:
-            break
-    except socket.timeout:
-        print(f"{datetime.now()}: Connection attempt timed out. Will retry in 15min")
-        time.sleep(900)
-        print(f"{datetime.now()}: Attempting Connection...{retries}")
-        continue
-    except Exception as e:
-        print(f"{datetime.now()}: Error: {e}")
-        break
-
-print(
-    f"Connected to the mqtt broker @ 16.171.79.146 with {(client._client_id).decode('utf-8')}"
-)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        self.client.on_subscribe = self.on_subscribe
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+        self.loop = None
+        self.loop_thread = None
+        self.sock = None
+        self.misc_task = None
+        self.disconnected = None
+        self.stop_event = None
+        # Set while subscribed to the topic
+        self.subscribed = asyncio.Event()
+        # Messages waiting for room in the writer queue, reading from the
+        # broker is paused until they are queued
+        self.pending = collections.deque()
+        self.pending_task = None
+        self.paused = False
+
+    @property
+    def client_id(self):
+        return self.client._client_id.decode("utf-8")
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.stop_event = asyncio.Event()
+        self.writer.start()
+        try:
+            while not self.stop_event.is_set():
+                self.disconnected = self.loop.create_future()
+                try:
+                    # Name lookup and TCP connect block, they run off the loop
+                    await self.loop.run_in_executor(
+                        None,
+                        functools.partial(
+                            self.client.connect,
+                            self.host,
+                            self.port,
+                            keepalive=self.keepalive,
+                        ),
+                    )
+                except OSError as error:
+                    print(
+                        f"{datetime.now()}: Error connecting to {self.host}:{self.port}: "
+                        f"{error}. Will retry in {RECONNECT_DELAY}s"
+                    )
+                    await self.wait_before_reconnect()
+                    continue
+
+                if self.stop_event.is_set():
+                    # Stopped while connecting
+                    self.client.disconnect()
+                await self.disconnected
+                if not self.stop_event.is_set():
+                    print(
+                        f"{datetime.now()}: Connection lost. Will retry in "
+                        f"{RECONNECT_DELAY}s"
+                    )
+                    await self.wait_before_reconnect()
+        finally:
+            # Save everything already received, the waiting messages are
+            # queued before the writer is stopped
+            if self.pending_task is not None:
+                await self.pending_task
+            await self.loop.run_in_executor(None, self.writer.stop)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.sock is not None:
+            self.client.disconnect()
+        elif self.disconnected is not None and not self.disconnected.done():
+            self.disconnected.set_result(None)
+
+    async def wait_before_reconnect(self):
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), RECONNECT_DELAY)
+        except asyncio.TimeoutError:
+            pass
+
+    def on_connect(self, mqtt_client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            print(
+                f"Connected to the mqtt broker @ {self.host} with {self.client_id}, "
+                f"subscribed to {self.topic}"
+            )
+            mqtt_client.subscribe(self.topic)
+        else:
+            print("Bad connection. Code:", reason_code)
+
+    def on_subscribe(self, mqtt_client, userdata, mid, reason_code_list, properties):
+        self.subscribed.set()
+
+    def on_disconnect(self, mqtt_client, userdata, flags, reason_code, properties):
+        self.subscribed.clear()
+        if self.disconnected is not None and not self.disconnected.done():
+            self.disconnected.set_result(reason_code)
+
+    def on_message(self, mqtt_client, userdata, msg):
+        message = msg.payload.decode()
+        if not self.pending:
+            try:
+                self.writer.put(message, block=False)
+                return
+            except queue.Full:
+                pass
+
+        self.pending.append(message)
+        if not self.paused:
+            self.paused = True
+            self.loop.remove_reader(self.sock)
+            self.pending_task = self.loop.create_task(self.queue_pending())
+
+    # Hand the waiting messages to the writer off the event loop, then read
+    # from the broker again
+    async def queue_pending(self):
+        while self.pending:
+            await self.loop.run_in_executor(None, self.writer.put, self.pending[0])
+            self.pending.popleft()
+
+        self.paused = False
+        if self.sock is not None:
+            self.loop.add_reader(self.sock, self.client.loop_read)
+
+    # paho socket callbacks, the event loop watches the socket in place of
+    # paho's network thread. connect() calls them from an executor thread,
+    # they are handed to the loop.
+    def on_socket_open(self, mqtt_client, userdata, sock):
+        self.call_on_loop(self.watch_socket, sock)
+
+    def on_socket_close(self, mqtt_client, userdata, sock):
+        self.call_on_loop(self.forget_socket, sock)
+
+    def on_socket_register_write(self, mqtt_client, userdata, sock):
+        self.call_on_loop(self.loop.add_writer, sock, mqtt_client.loop_write)
+
+    def on_socket_unregister_write(self, mqtt_client, userdata, sock):
+        self.call_on_loop(self.loop.remove_writer, sock)
+
+    def call_on_loop(self, callback, *args):
+        if threading.get_ident() == self.loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def watch_socket(self, sock):
+        self.sock = sock
+        if not self.paused:
+            self.loop.add_reader(sock, self.client.loop_read)
+        self.misc_task = self.loop.create_task(self.misc_loop())
+
+    def forget_socket(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self.sock is not sock:
+            return
+
+        self.sock = None
+        if self.misc_task is not None:
+            self.misc_task.cancel()
+            self.misc_task = None
+
+    # Keep alive pings and retries
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
@@ -0,0 +1,255 @@
+import asyncio
+
+# Minimal in-process MQTT broker standing in for mosquitto when testing the
+# ingest service and generating load. Speaks MQTT 3.1.1 and 5, delivers at
+# QoS 0 and supports $share/<group>/<filter> shared subscriptions. No
+# retained messages, wills or sessions.
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+MQTT_V5 = 5
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(packet_type, body, flags=0):
+    return bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + body
+
+
+def _string(data):
+    return len(data).to_bytes(2, "big") + data
+
+
+def _read_string(data, pos):
+    length = int.from_bytes(data[pos : pos + 2], "big")
+    return data[pos + 2 : pos + 2 + length], pos + 2 + length
+
+
+def _skip_properties(data, pos):
+    length = 0
+    multiplier = 1
+    while True:
+        byte = data[pos]
+        pos += 1
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return pos + length
+        multiplier *= 128
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level not in ("+", topic_levels[index]):
+            return False
+
+    return len(filter_levels) == len(topic_levels)
+
+
+class _Session:
+    def __init__(self, writer):
+        self.writer = writer
+        self.version = MQTT_V5
+        self.client_id = ""
+        self.subscriptions = set()
+
+
+class MQTTBroker:
+    def __init__(self):
+        self.server = None
+        self.sessions = set()
+        # (group, filter) -> subscribed sessions, messages go round robin
+        self.shared_groups = {}
+        self.shared_next = {}
+        self.published = 0
+
+    # Listen on host:port, port 0 picks a free port. Returns the port.
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve(self, host="127.0.0.1", port=0):
+        await self.start(host, port)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        self.server.close()
+        for session in list(self.sessions):
+            session.writer.close()
+        await self.server.wait_closed()
+
+    async def read_packet(self, reader):
+        first_byte = (await reader.readexactly(1))[0]
+        length = 0
+        multiplier = 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+
+        body = await reader.readexactly(length)
+        return first_byte >> 4, first_byte & 0x0F, body
+
+    async def handle_client(self, reader, writer):
+        session = _Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                packet_type, flags, body = await self.read_packet(reader)
+                if packet_type == CONNECT:
+                    _, pos = _read_string(body, 0)
+                    session.version = body[pos]
+                    # Flags, keep alive and properties come before the client id
+                    pos += 4
+                    if session.version == MQTT_V5:
+                        pos = _skip_properties(body, pos)
+                    client_id, _ = _read_string(body, pos)
+                    session.client_id = client_id.decode()
+                    if session.version == MQTT_V5:
+                        writer.write(_packet(CONNACK, b"\x00\x00\x00"))
+                    else:
+                        writer.write(_packet(CONNACK, b"\x00\x00"))
+                elif packet_type in (SUBSCRIBE, UNSUBSCRIBE):
+                    self.handle_subscribe(session, packet_type, body)
+                elif packet_type == PUBLISH:
+                    await self.handle_publish(session, flags, body)
+                elif packet_type == PUBREL:
+                    writer.write(_packet(PUBCOMP, body[:2]))
+                elif packet_type == PINGREQ:
+                    writer.write(_packet(PINGRESP, b""))
+                elif packet_type == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            for members in self.shared_groups.values():
+                if session in members:
+                    members.remove(session)
+            writer.close()
+
+    def handle_subscribe(self, session, packet_type, body):
+        packet_id = body[:2]
+        pos = 2
+        if session.version == MQTT_V5:
+            pos = _skip_properties(body, pos)
+
+        reason_codes = bytearray()
+        while pos < len(body):
+            topic_filter, pos = _read_string(body, pos)
+            topic_filter = topic_filter.decode()
+            if packet_type == SUBSCRIBE:
+                # Skip the subscription options
+                pos += 1
+                self.subscribe(session, topic_filter)
+            else:
+                self.unsubscribe(session, topic_filter)
+            reason_codes.append(0)
+
+        if packet_type == SUBSCRIBE:
+            response = packet_id + (b"\x00" if session.version == MQTT_V5 else b"")
+            session.writer.write(_packet(SUBACK, response + bytes(reason_codes)))
+        elif session.version == MQTT_V5:
+            session.writer.write(
+                _packet(UNSUBACK, packet_id + b"\x00" + bytes(reason_codes))
+            )
+        else:
+            session.writer.write(_packet(UNSUBACK, packet_id))
+
+    def subscribe(self, session, topic_filter):
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+            members = self.shared_groups.setdefault((group, topic_filter), [])
+            if session not in members:
+                members.append(session)
+        else:
+            session.subscriptions.add(topic_filter)
+
+    def unsubscribe(self, session, topic_filter):
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+            members = self.shared_groups.get((group, topic_filter), [])
+            if session in members:
+                members.remove(session)
+        else:
+            session.subscriptions.discard(topic_filter)
+
+    async def handle_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic, pos = _read_string(body, 0)
+        packet_id = b""
+        if qos:
+            packet_id = body[pos : pos + 2]
+            pos += 2
+        if session.version == MQTT_V5:
+            pos = _skip_properties(body, pos)
+
+        await self.publish(topic, body[pos:])
+
+        if qos == 1:
+            session.writer.write(_packet(PUBACK, packet_id))
+        elif qos == 2:
+            session.writer.write(_packet(PUBREC, packet_id))
+
+    async def publish(self, topic, payload):
+        if isinstance(topic, str):
+            topic = topic.encode()
+        topic_name = topic.decode()
+        self.published += 1
+
+        targets = [
+            session
+            for session in self.sessions
+            if any(
+                topic_matches(topic_filter, topic_name)
+                for topic_filter in session.subscriptions
+            )
+        ]
+        for key, members in self.shared_groups.items():
+            if members and topic_matches(key[1], topic_name):
+                index = self.shared_next.get(key, 0) % len(members)
+                self.shared_next[key] = index + 1
+                targets.append(members[index])
+
+        v3_packet = _packet(PUBLISH, _string(topic) + payload)
+        v5_packet = _packet(PUBLISH, _string(topic) + b"\x00" + payload)
+        for target in targets:
+            target.writer.write(v5_packet if target.version == MQTT_V5 else v3_packet)
+        # Slow subscribers hold up the publisher rather than buffering here
+        for target in targets:
+            try:
+                await target.writer.drain()
+            except ConnectionError:
+                pass
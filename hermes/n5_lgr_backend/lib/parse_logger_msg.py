@@ -1,374 +1,643 @@
 import re
-from datetime import datetime, timedelta
+import struct
+import time
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 import binascii
 import ctypes
 
-
-class N5LoggerParse:
-    def __init__(self) -> None:
-        self.test_mode = False
-        self.pattern = pattern = (
-            r"(\w{3}\s+\w{3}\s+\d{1,2} \d{2}:\d{2}:\d{2} \d{4}) : Msg: (.*)"
-        )
-        self.header_format = {
-            "device_id": {"size": 6, "ascii": True},
-            "msg_type": {
-                "size": 1,
-                "enum": [
-                    "SIGFOX_UPLINK",
-                    "FILE_ACTION",
-                    "DIAG_DEPRECATED",
-                    "BOOT_INFO",
-                    "IBEACON_SCAN",
-                    "MESSAGE_LIST",
-                    "CORE_MSG_UPLINK",
-                ],
-            },
-            "flags": {
-                "size": 1,
-                "bits": [
-                    {
-                        "size": 3,
-                        "name": "Trumi Sample Rate",
-                        "enum": [
-                            "TRUMI_NEXT_EXEC_UNDEFINED",
-                            "TRUMI_NEXT_EXEC_ASAP",
-                            "TRUMI_NEXT_EXEC_IN_500MS",
-                            "TRUMI_NEXT_EXEC_IN_1S",
-                            "TRUMI_NEXT_EXEC_IN_10S",
-                        ],
-                    },
-                    {
-                        "size": 2,
-                        "name": "Trumi Acc Mode",
-                        "enum": [
-                            "TRUMI_ACC_UNDEFINED",
-                            "TRUMI_ACC_SINGLE_SAMPLE",
-                            "TRUMI_ACC_100HZ",
-                            "TRUMI_ACC_1600HZ",
-                        ],
-                    },
-                ],
-            },
-            "seq_num": {"size": 4},
-            "msg_gen_ts": {"size": 4, "timestamp": True},
-            "cell_id": {"size": 4, "hex": True},
-            "cell_id_ts": {"size": 4, "timestamp": True},
-            "actual_temp": {"size": 1},
-            "trumi_st": {
-                "size": 1,
+import numpy as np
+
+
+MSG_PATTERN = re.compile(
+    r"(\w{3}\s+\w{3}\s+\d{1,2} \d{2}:\d{2}:\d{2} \d{4}) : Msg: (.*)"
+)
+
+HEADER_FORMAT = {
+    "device_id": {"size": 6, "ascii": True},
+    "msg_type": {
+        "size": 1,
+        "enum": [
+            "SIGFOX_UPLINK",
+            "FILE_ACTION",
+            "DIAG_DEPRECATED",
+            "BOOT_INFO",
+            "IBEACON_SCAN",
+            "MESSAGE_LIST",
+            "CORE_MSG_UPLINK",
+        ],
+    },
+    "flags": {
+        "size": 1,
+        "bits": [
+            {
+                "size": 3,
+                "name": "Trumi Sample Rate",
                 "enum": [
-                    "TRUMI_STATE_UNKNOWN",
-                    "TRUMI_STATE_SLEEP",
-                    "TRUMI_STATE_MOTION_DETECTION",
-                    "TRUMI_STATE_RELOCATION ",
+                    "TRUMI_NEXT_EXEC_UNDEFINED",
+                    "TRUMI_NEXT_EXEC_ASAP",
+                    "TRUMI_NEXT_EXEC_IN_500MS",
+                    "TRUMI_NEXT_EXEC_IN_1S",
+                    "TRUMI_NEXT_EXEC_IN_10S",
                 ],
             },
-            "trumi_st_upd_count": {"size": 2},
-            "trumi_st_upd_ts": {"size": 4, "timestamp": True},
-            "trumi_st_trans_count": {"size": 2},
-            "reloc_st_trans_count": {"size": 2},
-            "stored_st_trans_count": {"size": 2},
-            "wifi_aps": {"size": 18, "hex": True},
-            "reserved_1": {"size": 2},
-            "pld_sz": {"size": 2},
-            "pld_crc": {"size": 2, "hex": True},
-            "buffer_link_type": {
-                "size": 1,
+            {
+                "size": 2,
+                "name": "Trumi Acc Mode",
                 "enum": [
-                    "Link Ok",
-                    "Link Lost",
+                    "TRUMI_ACC_UNDEFINED",
+                    "TRUMI_ACC_SINGLE_SAMPLE",
+                    "TRUMI_ACC_100HZ",
+                    "TRUMI_ACC_1600HZ",
                 ],
             },
-            "header_crc": {"size": 1, "hex": True},
-            "payload": {"size": 2},  # DEFAULT TO AS THIS WILL CHANGE ANYWAY WHEN FOUND
-        }
+        ],
+    },
+    "seq_num": {"size": 4},
+    "msg_gen_ts": {"size": 4, "timestamp": True},
+    "cell_id": {"size": 4, "hex": True},
+    "cell_id_ts": {"size": 4, "timestamp": True},
+    "actual_temp": {"size": 1},
+    "trumi_st": {
+        "size": 1,
+        "enum": [
+            "TRUMI_STATE_UNKNOWN",
+            "TRUMI_STATE_SLEEP",
+            "TRUMI_STATE_MOTION_DETECTION",
+            "TRUMI_STATE_RELOCATION ",
+        ],
+    },
+    "trumi_st_upd_count": {"size": 2},
+    "trumi_st_upd_ts": {"size": 4, "timestamp": True},
+    "trumi_st_trans_count": {"size": 2},
+    "reloc_st_trans_count": {"size": 2},
+    "stored_st_trans_count": {"size": 2},
+    "wifi_aps": {"size": 18, "hex": True},
+    "reserved_1": {"size": 2},
+    "pld_sz": {"size": 2},
+    "pld_crc": {"size": 2, "hex": True},
+    "buffer_link_type": {
+        "size": 1,
+        "enum": [
+            "Link Ok",
+            "Link Lost",
+        ],
+    },
+    "header_crc": {"size": 1, "hex": True},
+    "payload": {"size": 2},  # DEFAULT TO AS THIS WILL CHANGE ANYWAY WHEN FOUND
+}
+
+# Logger timestamps count seconds from 2000-01-01, the parser outputs Unix
+# epoch seconds
+LOGGER_EPOCH = int(datetime(2000, 1, 1, tzinfo=timezone.utc).timestamp())
+UNIX_EPOCH = datetime(1970, 1, 1)
+TIMESTAMP_FORMAT = "%a %B %d, %Y %I:%M:%S %p"
+DAY_FORMAT = "%a %B %d, %Y"
+
+
+# Build the big-endian struct layout and per-field byte offsets of the header.
+# The "payload" entry stays in the layout as its first word has always been
+# read, so a message must carry at least that many bytes.
+def _compile_header(header_format):
+    struct_codes = {1: "B", 2: "H", 4: "I"}
+    layout = ">"
+    offsets = {}
+    offset = 0
+    for field, field_settings in header_format.items():
+        size = field_settings["size"]
+        layout += struct_codes.get(size, f"{size}s")
+        offsets[field] = (offset, offset + size)
+        offset += size
+
+    return struct.Struct(layout), offsets
+
+
+# Lookup table covering every value a field of `size` bytes can take
+def _enum_table(enum, size):
+    table = [f"Unknown enum value: {value}" for value in range(256**size)]
+    table[: len(enum)] = enum
+    return tuple(table)
+
+
+# Rendered flag text for all 256 possible flag bytes
+def _flags_table(bits):
+    table = []
+    for field_msg_int in range(256):
+        bit_start = 0
+        flag_msg = ""
+        for bit_info in bits:
+            bit_value = (field_msg_int >> bit_start) & ((1 << bit_info["size"]) - 1)
+            bit_start += bit_info["size"]
+            try:
+                flag_msg += f'{bit_info["name"]}: {bit_info["enum"][bit_value]}\n'
+            except IndexError:
+                flag_msg += (
+                    f"Error with bit value: {bit_value} in {bit_info['name']}\n"
+                )
+        table.append(flag_msg)
+
+    return tuple(table)
+
+
+@lru_cache(maxsize=1024)
+def _format_day(days):
+    day = UNIX_EPOCH + timedelta(days=days)
+    return day.strftime(DAY_FORMAT)
+
+
+# Display text for an epoch timestamp, the same text as strftime(TIMESTAMP_FORMAT)
+# with the date part cached per day
+@lru_cache(maxsize=4096)
+def format_timestamp(epoch_seconds):
+    if epoch_seconds is None:
+        return "No timestamp"
+
+    days, seconds = divmod(epoch_seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return (
+        f"{_format_day(days)} {(hours - 1) % 12 + 1:02d}:{minutes:02d}:{seconds:02d} "
+        f"{'PM' if hours >= 12 else 'AM'}"
+    )
+
+
+# A zero logger timestamp means the device has not set it
+def _epoch_timestamp(logger_seconds):
+    if logger_seconds == 0:
+        return None
+
+    return logger_seconds + LOGGER_EPOCH
+
+
+HEADER_STRUCT, HEADER_OFFSETS = _compile_header(HEADER_FORMAT)
+HEADER_HEX_SIZE = HEADER_STRUCT.size * 2
+# Hex character spans of the fields that are stored as the raw hex string
+CELL_ID_SPAN = tuple(i * 2 for i in HEADER_OFFSETS["cell_id"])
+WIFI_APS_SPAN = tuple(i * 2 for i in HEADER_OFFSETS["wifi_aps"])
+PLD_CRC_SPAN = tuple(i * 2 for i in HEADER_OFFSETS["pld_crc"])
+HEADER_CRC_SPAN = tuple(i * 2 for i in HEADER_OFFSETS["header_crc"])
+PAYLOAD_POS = HEADER_OFFSETS["payload"][0] * 2
+# device_id + msg_type, all that is decoded for a BOOT_INFO message
+BOOT_HEADER_POS = HEADER_OFFSETS["msg_type"][1] * 2
+
+MSG_TYPE_TABLE = _enum_table(HEADER_FORMAT["msg_type"]["enum"], 1)
+TRUMI_ST_TABLE = _enum_table(HEADER_FORMAT["trumi_st"]["enum"], 1)
+BUFFER_LINK_TYPE_TABLE = _enum_table(HEADER_FORMAT["buffer_link_type"]["enum"], 1)
+FLAGS_TABLE = _flags_table(HEADER_FORMAT["flags"]["bits"])
+HEADER_INDEX = {field: index for index, field in enumerate(HEADER_FORMAT)}
+
+
+# Degrees C from the header temperature byte, None when not measured
+def actual_temp_celsius(value):
+    if value == 255:
+        return None
+
+    return (value / 2) - 40
+
+
+ACTUAL_TEMP_TABLE = tuple(
+    "n/a" if value == 255 else f"{actual_temp_celsius(value)} C"
+    for value in range(256)
+)
+
+MSG_TYPE_BOOT_INFO = MSG_TYPE_TABLE.index("BOOT_INFO")
+TRUMI_ST_MOTION_DETECTION = TRUMI_ST_TABLE.index("TRUMI_STATE_MOTION_DETECTION")
+BUFFER_LINK_LOST = BUFFER_LINK_TYPE_TABLE.index("Link Lost")
+
+
+# Raised decoding a malformed payload: bad or odd-length hex (binascii.Error
+# is a ValueError) or a short read
+PAYLOAD_ERRORS = (ValueError, struct.error)
+
+RICE_LIB_DIR = Path(__file__).resolve().parent
+RICE_FMT_INT16 = 3
+# Buffer will always be 192 bytes (32 samples * 6 bytes each) in trumi mode
+RICE_FIFO_SIZE = 192
+# Decompressed FIFO as stored in the payload, 4 byte timestamp then the samples
+RICE_FIFO_FRAME_SIZE = 4 + RICE_FIFO_SIZE
+
+
+# The Rice library is loaded once per process, test mode uses the Windows build
+@lru_cache(maxsize=None)
+def load_rice_library(test_mode=False):
+    library_path = RICE_LIB_DIR / ("rice.dll" if test_mode else "rice.so")
+    if not library_path.exists():
+        raise OSError(
+            f"{library_path} not found, build it with `make -C {RICE_LIB_DIR}`"
+        )
+    dll = ctypes.CDLL(str(library_path))
+
+    dll.Rice_Uncompress.argtypes = [
+        ctypes.c_void_p,  # void* in
+        ctypes.c_void_p,  # void* out
+        ctypes.c_uint,  # unsigned int insize
+        ctypes.c_uint,  # unsigned int outsize
+        ctypes.c_int,  # int format
+    ]
+    dll.Rice_Uncompress.restype = None
+
+    dll.Rice_Compress.argtypes = [
+        ctypes.c_void_p,  # void* in
+        ctypes.c_void_p,  # void* out
+        ctypes.c_uint,  # unsigned int insize
+        ctypes.c_int,  # int format
+    ]
+    dll.Rice_Compress.restype = ctypes.c_int
+
+    if hasattr(dll, "Rice_UncompressFifos"):
+        dll.Rice_UncompressFifos.argtypes = [
+            ctypes.c_char_p,  # void* in
+            ctypes.c_uint,  # unsigned int insize
+            ctypes.c_void_p,  # void* out
+            ctypes.c_uint,  # unsigned int outsize
+            ctypes.c_uint,  # unsigned int fifosize
+            ctypes.c_int,  # int format
+            ctypes.POINTER(ctypes.c_int),  # int* error
+        ]
+        dll.Rice_UncompressFifos.restype = ctypes.c_uint
+    else:
+        print(
+            f"{datetime.now()}: {library_path.name} has no Rice_UncompressFifos, "
+            "motion payloads are decompressed one FIFO at a time. Rebuild it "
+            "from rice.c."
+        )
+
+    return dll
+
+
+# Payload frame layouts (little-endian), one record per timestamp
+PAYLOAD_FRAME_DTYPES = {
+    # 196 is (32 samples * 6 bytes) + 4 bytes for timestamp
+    "decompress_payload": np.dtype([("timestamp", "<u4"), ("xyz", "<i2", (32, 3))]),
+    # 12 is 4 byte timestamp, trumi state of 2 bytes plus 6 byte data
+    "link_lost_mode": np.dtype(
+        [("timestamp", "<u4"), ("state", "<i2"), ("xyz", "<i2", (1, 3))]
+    ),
+    # 10 is sample of 6 bytes and 4 byte timestamp
+    "": np.dtype([("timestamp", "<u4"), ("xyz", "<i2", (1, 3))]),
+}
+
+
+def _signed_byte(value):
+    return np.int8(np.uint8(value & 0xFF))
+
+
+def _trumi_state_name(trumi_st_int):
+    try:
+        return HEADER_FORMAT["trumi_st"]["enum"][trumi_st_int]
+    except IndexError:
+        return f"Unknow state -> {trumi_st_int}"
+
+
+class XYZPayload:
+    """Accelerometer payload decoded into typed arrays.
+
+    `timestamps` (Unix epoch seconds) and `state` hold one value per frame
+    (`state` is None unless the payload is a link lost buffer), `xyz` is an
+    (n, 3) int16 array of the samples and `frame_index` maps each sample to
+    its frame. The legacy text form is only built when render() is called.
+    """
+
+    def __init__(self, payload_type, binary_data, fifo_error=""):
+        self.payload_type = payload_type
+        self.binary_data = binary_data
+        self.fifo_error = fifo_error
+
+        frame_dtype = PAYLOAD_FRAME_DTYPES.get(payload_type, PAYLOAD_FRAME_DTYPES[""])
+        header_size = frame_dtype.itemsize - frame_dtype["xyz"].itemsize
+        samples_per_frame = frame_dtype["xyz"].shape[0]
+
+        # A trailing partial frame is zero padded, keeping only the samples
+        # that started inside the buffer
+        full_frames, tail_size = divmod(len(binary_data), frame_dtype.itemsize)
+        sample_count = full_frames * samples_per_frame
+        if tail_size:
+            sample_count += -(-max(tail_size - header_size, 0) // 6)
+            binary_data = bytes(binary_data) + bytes(
+                frame_dtype.itemsize - tail_size
+            )
+
+        frames = np.frombuffer(binary_data, dtype=frame_dtype)
+        self.timestamps = frames["timestamp"].astype(np.int64) + LOGGER_EPOCH
+        self.state = frames["state"] if "state" in frame_dtype.names else None
+        self.xyz = frames["xyz"].reshape(-1, 3)[:sample_count]
+        self.frame_index = np.arange(sample_count) // samples_per_frame
+
+        # A value cut to its low byte was read as that byte signed, not as
+        # the zero padded value
+        if tail_size:
+            if self.state is not None and tail_size == header_size - 1:
+                self.state = self.state.copy()
+                self.state[-1] = _signed_byte(self.state[-1])
+            sample_tail = max(tail_size - header_size, 0) % 6
+            if sample_tail % 2:
+                self.xyz = self.xyz.copy()
+                self.xyz[-1, sample_tail // 2] = _signed_byte(
+                    self.xyz[-1, sample_tail // 2]
+                )
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def raw_hex(self):
+        return binascii.hexlify(self.binary_data).decode("utf-8")
+
+    def render(self):
+        timestamps = [format_timestamp(ts) for ts in self.timestamps.tolist()]
+        samples = self.xyz.tolist()
+
+        if self.payload_type == "decompress_payload":
+            # In trumi mode the timestamp is on its own line for each 32 sample lot
+            lines = []
+            samples_per_frame = PAYLOAD_FRAME_DTYPES[self.payload_type]["xyz"].shape[0]
+            for frame_num, accel_sample_timestamp in enumerate(timestamps):
+                lines.append(f"{accel_sample_timestamp},\n")
+                start = frame_num * samples_per_frame
+                lines.extend(
+                    f"[{idx}] X: {x} Y: {y} Z: {z},\n"
+                    for idx, (x, y, z) in enumerate(
+                        samples[start : start + samples_per_frame], start + 1
+                    )
+                )
+        else:
+            if self.state is not None:
+                states = [_trumi_state_name(st) for st in self.state.tolist()]
+            else:
+                states = [""] * len(timestamps)
+            lines = [
+                f"[{idx}] X: {x} Y: {y} Z: {z}, "
+                f"{timestamps[frame]},{states[frame]}\n"
+                for idx, ((x, y, z), frame) in enumerate(
+                    zip(samples, self.frame_index.tolist()), 1
+                )
+            ]
+
+        xyz_data = "".join(lines)
+        return (
+            f"{len(samples)} accelerometer samples\n"
+            f"{self.fifo_error}\n{xyz_data}\n"
+        )
+
+
+def _payload_type(header_values):
+    return payload_type_for(
+        header_values[HEADER_INDEX["trumi_st"]],
+        header_values[HEADER_INDEX["buffer_link_type"]],
+    )
+
+
+# Payload layout from the raw trumi_st and buffer_link_type header values
+def payload_type_for(trumi_st, buffer_link_type):
+    if buffer_link_type == BUFFER_LINK_LOST:
+        return "link_lost_mode"
+    if trumi_st == TRUMI_ST_MOTION_DETECTION:
+        return "decompress_payload"
+
+    return ""
+
+
+# Message dict from the unpacked header values, in the order of HEADER_FORMAT.
+# Without a parsed payload the payload is left blank and "payload_type" says
+# how to decode it later, it is None once the payload is decoded. The raw
+# values are kept as "header_values" for storing in typed columns.
+def _build_msg_dict(timestamp, msg_data, header_values, payload_type, parsed_payload):
+    (
+        _,
+        msg_type,
+        flags,
+        seq_num,
+        msg_gen_ts,
+        _,
+        cell_id_ts,
+        actual_temp,
+        trumi_st,
+        trumi_st_upd_count,
+        trumi_st_upd_ts,
+        trumi_st_trans_count,
+        reloc_st_trans_count,
+        stored_st_trans_count,
+        _,
+        reserved_1,
+        pld_sz,
+        _,
+        buffer_link_type,
+        _,
+        _,
+    ) = header_values
+
+    if parsed_payload is None:
+        parsed_payload = {"xyz_data": "", "xyz_data_raw": ""}
+    else:
+        payload_type = None
+
+    return {
+        "data_msg": msg_data,
+        "lgr_msg_ts": timestamp,
+        "xyz_raw": parsed_payload["xyz_data_raw"],
+        "device_id": binascii.unhexlify(msg_data[0:12]).decode("utf-8"),
+        "msg_type": MSG_TYPE_TABLE[msg_type],
+        "flags": FLAGS_TABLE[flags],
+        "seq_num": seq_num,
+        "msg_gen_ts": _epoch_timestamp(msg_gen_ts),
+        "cell_id": msg_data[CELL_ID_SPAN[0] : CELL_ID_SPAN[1]],
+        "cell_id_ts": _epoch_timestamp(cell_id_ts),
+        "actual_temp": ACTUAL_TEMP_TABLE[actual_temp],
+        "trumi_st": (
+            "VARIOUS"
+            if buffer_link_type == BUFFER_LINK_LOST
+            else TRUMI_ST_TABLE[trumi_st]
+        ),
+        "trumi_st_upd_count": trumi_st_upd_count,
+        "trumi_st_upd_ts": _epoch_timestamp(trumi_st_upd_ts),
+        "trumi_st_trans_count": trumi_st_trans_count,
+        "reloc_st_trans_count": reloc_st_trans_count,
+        "stored_st_trans_count": stored_st_trans_count,
+        "wifi_aps": msg_data[WIFI_APS_SPAN[0] : WIFI_APS_SPAN[1]],
+        "reserved_1": reserved_1,
+        "pld_sz": pld_sz,
+        "pld_crc": msg_data[PLD_CRC_SPAN[0] : PLD_CRC_SPAN[1]],
+        "buffer_link_type": BUFFER_LINK_TYPE_TABLE[buffer_link_type],
+        "header_crc": msg_data[HEADER_CRC_SPAN[0] : HEADER_CRC_SPAN[1]],
+        "payload": parsed_payload["xyz_data"],
+        "payload_type": payload_type,
+        "header_values": header_values,
+    }
+
+
+class N5LoggerParse:
+    pattern = MSG_PATTERN.pattern
+    header_format = HEADER_FORMAT
+
+    def __init__(self) -> None:
+        self.test_mode = False
 
-    def parse_msg(self, message):
+    def parse_msg(self, message, decode_payload=True):
         # Match the pattern in the input string
-        match = re.match(self.pattern, message)
+        match = MSG_PATTERN.match(message)
 
         # Extract timestamp and message data
         if match:
-            timestamp = match.group(1)
-            msg_data = match.group(2)
+            timestamp, msg_data = match.groups()
         else:
             # If not matched, set all key values to blank string, and only set 3 values to parse
-            for key in self.header_format:
-                parsed_msg_dict[key] = ""
-            parsed_msg["device_id"] = binascii.unhexlify(message[0:12]).decode("utf-8")
-            parsed_msg["msg_gen_ts"] = datetime.now()
-            parsed_msg["payload"] = message
+            parsed_msg_dict = dict.fromkeys(self.header_format, "")
+            parsed_msg_dict["device_id"] = binascii.unhexlify(message[0:12]).decode(
+                "utf-8"
+            )
+            parsed_msg_dict["msg_gen_ts"] = int(time.time())
+            parsed_msg_dict["payload"] = message
+            parsed_msg_dict["payload_type"] = None
 
             return parsed_msg_dict
 
-        parsed_msg_dict = {
-            "data_msg": msg_data,
-            "lgr_msg_ts": timestamp,
-            "xyz_raw": "n/a",
-        }
+        if msg_data[12:14] and int(msg_data[12:14], 16) == MSG_TYPE_BOOT_INFO:
+            return self._parse_boot_msg(msg_data, timestamp)
 
-        payload_type = ""
-        data_pos = 0
-        for field, field_settings in self.header_format.items():
-            bytes_to_char_len = field_settings["size"] * 2
-            field_msg = msg_data[data_pos : data_pos + bytes_to_char_len]
-
-            field_settings_keys = field_settings.keys()
-            field_msg_int = int(field_msg, 16)
-
-            if "enum" in field_settings_keys:
-                try:
-                    field_msg = field_settings["enum"][field_msg_int]
-                except (KeyError, IndexError):
-                    field_msg = f"Unknown enum value: {field_msg_int}"
-
-                # Check for enum flag states
-                if field == "trumi_st" and field_msg == "TRUMI_STATE_MOTION_DETECTION":
-                    payload_type = "decompress_payload"
-
-                elif field == "buffer_link_type" and field_msg == "Link Lost":
-                    payload_type = "link_lost_mode"
-                    parsed_msg_dict["trumi_st"] = "VARIOUS"
-
-            elif "timestamp" in field_settings_keys:
-                if field_msg_int != 0:
-                    ts_delta = timedelta(seconds=field_msg_int)
-                    epoch_offset = datetime(2000, 1, 1)
-                    timestamp = epoch_offset + ts_delta
-                    field_msg = timestamp.strftime("%a %B %d, %Y %I:%M:%S %p")
-                else:
-                    field_msg = "No timestamp"
-
-            elif "bits" in field_settings_keys:
-                # For "bits", three keys are mandatory -> size, name, enum.
-                # Get binary string of value, then reverse so it can be iterated through
-                field_bits_rev = format(field_msg_int, "08b")[::-1]
-
-                bit_start = 0
-                flag_msg = ""
-                for bit_info in field_settings["bits"]:
-                    end_bits = bit_start + bit_info["size"]
-                    bit_value = int(field_bits_rev[bit_start:end_bits][::-1], 2)
-                    bit_start = end_bits
-                    try:
-                        flag_msg += (
-                            f'{bit_info["name"]}: {bit_info["enum"][bit_value]}\n'
-                        )
-                    except IndexError:
-                        flag_msg += (
-                            f"Error with bit value: {bit_value} in {bit_info['name']}\n"
-                        )
-
-                if flag_msg:
-                    field_msg = flag_msg
-                else:
-                    field_msg = f"Error with flags value: {field_msg}"
-
-            elif field == "actual_temp":
-                if field_msg_int == 255:
-                    field_msg = "n/a"
-                else:
-                    actual_temp = (field_msg_int / 2) - 40
-                    field_msg = f"{actual_temp} C"
-            elif field == "payload":
-                payload = msg_data[data_pos:]
-                parsed_payload = self._parse_payload(payload, payload_type)
-                parsed_msg_dict.update({"xyz_raw": parsed_payload["xyz_data_raw"]})
-                field_msg = parsed_payload["xyz_data"]
-            else:
-                if "hex" in field_settings_keys:
-                    field_msg = field_msg
-                elif "ascii" in field_settings_keys:
-                    field_msg = binascii.unhexlify(field_msg).decode("utf-8")
-                else:
-                    field_msg = field_msg_int
+        header = msg_data[:HEADER_HEX_SIZE]
+        if len(header) != HEADER_HEX_SIZE:
+            raise ValueError(f"Message too short for N5 header: {msg_data}")
 
-            data_pos += bytes_to_char_len
+        header_values = HEADER_STRUCT.unpack(binascii.unhexlify(header))
+        payload_type = _payload_type(header_values)
+        parsed_payload = None
+        if decode_payload:
+            parsed_payload = self.parse_payload(msg_data, payload_type)
 
-            parsed_msg_dict.update({field: field_msg})
+        return _build_msg_dict(
+            timestamp, msg_data, header_values, payload_type, parsed_payload
+        )
 
-            if field == "msg_type" and field_msg == "BOOT_INFO":
-                # Convert hex string to bytes
-                hex_bytes = binascii.unhexlify(msg_data[data_pos:])
-                # Convert bytes to ASCII while skipping non-ASCII characters
-                boot_msg = "".join(chr(byte) for byte in hex_bytes if byte < 128)
+    def parse_payload(self, msg_data, payload_type):
+        # Decode the payload of a message whose decoding was deferred, from
+        # the message hex and the "payload_type" parse_msg returned
+        return self._parse_payload(msg_data[PAYLOAD_POS:], payload_type)
 
-                parsed_msg_dict.update({"payload": boot_msg})
-                break
+    def parse_xyz_payload(self, msg_data, payload_type):
+        # The deferred payload as an XYZPayload, before rendering to text
+        return self._decode_payload(msg_data[PAYLOAD_POS:], payload_type)
 
-            if field == "actual_temp":
-                if field_msg == 255:
-                    field_msg = "Not Implemented yet."
+    def _parse_boot_msg(self, msg_data, timestamp):
+        parsed_msg_dict = {
+            "data_msg": msg_data,
+            "lgr_msg_ts": timestamp,
+            "xyz_raw": "n/a",
+            "device_id": binascii.unhexlify(msg_data[0:12]).decode("utf-8"),
+            "msg_type": "BOOT_INFO",
+        }
+
+        # Convert hex string to bytes
+        hex_bytes = binascii.unhexlify(msg_data[BOOT_HEADER_POS:])
+        # Convert bytes to ASCII while skipping non-ASCII characters
+        boot_msg = "".join(chr(byte) for byte in hex_bytes if byte < 128)
+        parsed_msg_dict["payload"] = boot_msg
 
         # Set keys that have not been populated to default value of null string
         for key in self.header_format:
-            if key not in parsed_msg_dict:
-                parsed_msg_dict[key] = ""
+            parsed_msg_dict.setdefault(key, "")
+        parsed_msg_dict["payload_type"] = None
 
         return parsed_msg_dict
 
     def _parse_payload(self, payload, payload_type):
+        xyz_payload = self._decode_payload(payload, payload_type)
+        parsed_payload = {
+            "xyz_data": xyz_payload.render(),
+            "xyz_data_raw": xyz_payload.raw_hex(),
+        }
 
-        xyz_data = ""
-        incorrect_payload = ""
+        return parsed_payload
 
+    def _decode_payload(self, payload, payload_type):
         if payload_type == "decompress_payload":
             decompressed_payload = self._decompress_payload(payload)
-            binary_data = decompressed_payload["decomp_payload"]
-            incorrect_payload = decompressed_payload["fifo_error"]
-            # 196 is (32 samples * 6 bytes) + 4 bytes for timestamp
-            timestamp_interval_every = 196
-        elif payload_type == "link_lost_mode":
-            binary_data = binascii.unhexlify(payload)
-            # 12 is 4 byte timestamp, trumi state of 2 bytes plus 6 byte data
-            timestamp_interval_every = 12
-        else:
-            binary_data = binascii.unhexlify(payload)
-            # 10 is sample of 6 bytes and 4 byte timestamp
-            timestamp_interval_every = 10
+            return XYZPayload(
+                payload_type,
+                decompressed_payload["decomp_payload"],
+                decompressed_payload["fifo_error"],
+            )
 
-        # Iterate over binary data in chunks of 6 bytes
-        accel_sample_idx = 0
-        xyz_bytes = []
-        accel_sample_timestamp = ""
+        return XYZPayload(payload_type, binascii.unhexlify(payload))
 
-        index = 0
-        while index < len(binary_data):
-            fifo_timestamp = binary_data[index : index + 4]
-            field_msg_int = int.from_bytes(fifo_timestamp, byteorder="little")
-            ts_delta = timedelta(seconds=field_msg_int)
-            epoch_offset = datetime(2000, 1, 1)
-            timestamp = epoch_offset + ts_delta
-            accel_sample_timestamp = timestamp.strftime("%a %B %d, %Y %I:%M:%S %p")
-
-            if payload_type == "link_lost_mode":
-                # 0-4 -> timestamp
-                # 4-6 -> Trumi state
-                # 6-12 -> XYZ data
-                trumi_st_int = int.from_bytes(
-                    binary_data[index + 4 : index + 6], byteorder="little", signed=True
-                )
-                try:
-                    trumi_st = self.header_format["trumi_st"]["enum"][trumi_st_int]
-                except IndexError:
-                    trumi_st = f"Unknow state -> {trumi_st_int}"
-                data_p = binary_data[index + 6 : index + timestamp_interval_every]
-            else:
-                # 0-4 -> timestamp
-                # 4-10 -> XYZ data
-                trumi_st = ""
-                data_p = binary_data[index + 4 : index + timestamp_interval_every]
-
-            index += timestamp_interval_every
-
-            # If trumi mode (sample size is 196 in trumi mode), set a newline
-            # for each 32 sample lots
-            if timestamp_interval_every == 196:
-                xyz_data += f"{accel_sample_timestamp},\n"
-
-            for i in range(0, len(data_p), 6):
-                accel_sample_idx += 1
-                # Extract XYZ value from the chunk
-                xyz_bytes = data_p[i : i + 6]
-
-                # Interpret XYZ bytes (assuming little-endian encoding)
-                x = int.from_bytes(xyz_bytes[0:2], byteorder="little", signed=True)
-                y = int.from_bytes(xyz_bytes[2:4], byteorder="little", signed=True)
-                z = int.from_bytes(xyz_bytes[4:6], byteorder="little", signed=True)
-
-                # Print XYZ values, if trumi mode don't add timestamp for each
-                # sample
-                if timestamp_interval_every == 196:
-                    xyz_data += f"[{accel_sample_idx}] X: {x} Y: {y} Z: {z},\n"
-                else:
-                    xyz_data += (
-                        f"[{accel_sample_idx}] X: {x} Y: {y} Z: {z}, "
-                        f"{accel_sample_timestamp},{trumi_st}\n"
-                    )
+    def _decompress_payload(self, payload: str) -> dict:
+        dll = load_rice_library(self.test_mode)
 
-        xyz_data = (
-            f"{accel_sample_idx} accelerometer samples\n"
-            f"{incorrect_payload}\n{xyz_data}\n"
-        )
-        xyz_data_raw = binascii.hexlify(binary_data).decode("utf-8")
-        parsed_payload = {"xyz_data": xyz_data, "xyz_data_raw": xyz_data_raw}
-
-        return parsed_payload
+        payload_data = bytes.fromhex(payload)
+        payload_len = len(payload_data)
 
-    def _decompress_payload(self, payload: str) -> bytes:
+        # A complete FIFO takes at least 5 bytes (length + timestamp), which
+        # bounds how many can be in the payload
+        output_buffer = np.empty(
+            (payload_len // 5) * RICE_FIFO_FRAME_SIZE, dtype=np.uint8
+        )
 
-        # Test mode
-        if self.test_mode:
-            dll = ctypes.CDLL("./hermes/n5_lgr_backend/lib/rice.dll")
+        if hasattr(dll, "Rice_UncompressFifos"):
+            error = ctypes.c_int(0)
+            fifo_count = dll.Rice_UncompressFifos(
+                payload_data,
+                payload_len,
+                output_buffer.ctypes.data,
+                len(output_buffer),
+                RICE_FIFO_SIZE,
+                RICE_FMT_INT16,
+                ctypes.byref(error),
+            )
+            fifo_error = error.value
         else:
-            # Real mode
-            dll = ctypes.CDLL("./n5_lgr_backend/lib/rice.so")
-
-        # Define the argument types
-        dll.Rice_Uncompress.argtypes = [
-            ctypes.c_void_p,  # void* in
-            ctypes.c_void_p,  # void* out
-            ctypes.c_uint,  # unsigned int insize
-            ctypes.c_uint,  # unsigned int outsize
-            ctypes.c_int,  # int format
-        ]
-
-        # Define the return type
-        dll.Rice_Uncompress.restype = None  # The function doesn't return anything
+            # Library built before Rice_UncompressFifos (logged when it was
+            # loaded), walk the FIFOs here but still decode straight into the
+            # output buffer
+            fifo_count, fifo_error = self._decompress_fifos(
+                dll, payload_data, output_buffer
+            )
+
+        decompressed_payload = {
+            "decomp_payload": output_buffer[: fifo_count * RICE_FIFO_FRAME_SIZE],
+            "fifo_error": (
+                f"Error at fifo payload number {fifo_count + 1}" if fifo_error else ""
+            ),
+        }
 
-        payload_data = bytes.fromhex(payload)
+        return decompressed_payload
 
+    def _decompress_fifos(self, dll, payload_data, output_buffer):
         payload_len = len(payload_data)
+        input_address = ctypes.cast(ctypes.c_char_p(payload_data), ctypes.c_void_p).value
+        output_address = output_buffer.ctypes.data
 
         index = 0
-        fifo_num = 0
-        decompressed_payload = {"decomp_payload": b"", "fifo_error": ""}
+        fifo_count = 0
         while index < payload_len:
-            fifo_num += 1
             fifo_length = payload_data[index]
-            fifo_timestamp = payload_data[index + 1 : index + 5]
-            index += 5
-            fifo_data_size = index + fifo_length
+            fifo_data_size = index + 5 + fifo_length
 
             if fifo_data_size > payload_len:
-                decompressed_payload["fifo_error"] = (
-                    f"Error at fifo payload number {fifo_num}"
-                )
-                break
-            else:
-                fifo_data = payload_data[index:fifo_data_size]
-
-                input_buffer = ctypes.create_string_buffer(fifo_data)
-                # Allocate a buffer for the output
-                # Buffer will always be 192 bytes (32 samples * 6 bytes each) in trumi mode
-                output_buffer = ctypes.create_string_buffer(192)
+                return fifo_count, True
 
-                # Call the function
+            output_pos = fifo_count * RICE_FIFO_FRAME_SIZE
+            output_buffer[output_pos : output_pos + 4] = np.frombuffer(
+                payload_data, dtype=np.uint8, count=4, offset=index + 1
+            )
+            if fifo_length:
                 dll.Rice_Uncompress(
-                    input_buffer,
-                    output_buffer,
-                    len(input_buffer),
-                    len(output_buffer),
-                    3,
+                    input_address + index + 5,
+                    output_address + output_pos + 4,
+                    fifo_length,
+                    RICE_FIFO_SIZE,
+                    RICE_FMT_INT16,
                 )
+            else:
+                output_buffer[output_pos + 4 : output_pos + RICE_FIFO_FRAME_SIZE] = 0
 
-                decompressed_payload["decomp_payload"] += (
-                    fifo_timestamp + output_buffer.raw
-                )
+            fifo_count += 1
+            index = fifo_data_size
 
-                # field_msg_int = int.from_bytes(fifo_timestamp, byteorder="little")
-                # ts_delta = timedelta(seconds=field_msg_int)
-                # epoch_offset = datetime(2000, 1, 1)
-                # timestamp = epoch_offset + ts_delta
-                # accel_sample_timestamp = timestamp.strftime("%a, %B %d, %Y %I:%M:%S %p")
-                # print(
-                #     f"{accel_sample_timestamp} - {output_buffer.raw.hex()} ({len(output_buffer.raw.hex())})"
-                # )
+        return fifo_count, False
 
-            index += fifo_length
 
-        return decompressed_payload
+# Shared parser, the parser holds no per-message state so one instance serves
+# every message
+parser = N5LoggerParse()
 
 
 if __name__ == "__main__":
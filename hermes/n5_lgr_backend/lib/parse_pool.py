@@ -0,0 +1,94 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from django.conf import settings
+
+from . import parse_logger_msg
+from .metrics import metrics
+
+# Smallest slice of a batch worth sending to a worker process
+MIN_CHUNK_SIZE = 50
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    # Spawned workers start without Django, forked ones have it already
+    if not apps.ready:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hermes.settings")
+        django.setup()
+
+    # Forget the metrics a forked worker copied from the writer process
+    metrics.drain()
+    try:
+        parse_logger_msg.load_rice_library(parse_logger_msg.parser.test_mode)
+    except OSError as error:
+        # Motion payloads fail to decode the same way in the writer
+        print(f"{datetime.now()}: Rice library not loaded: {error}")
+
+
+def _parse_chunk(messages):
+    from .ingest import parse_messages
+
+    return parse_messages(messages), metrics.drain()
+
+
+class ParsePool:
+    """Parses ingest batches in `workers` worker processes.
+
+    A batch is split into consecutive slices, one per worker, and the
+    parsed messages are put back together in the order received, so each
+    device's messages are saved in the order they arrived. The workers'
+    stage metrics are added to the writer process's metrics. If a worker
+    dies the batch is parsed in the writer thread and a new pool is
+    started for the next one.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+
+    def parse_messages(self, messages):
+        from .ingest import parse_messages
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker
+            )
+
+        chunk_size = max(MIN_CHUNK_SIZE, math.ceil(len(messages) / self.workers))
+        try:
+            futures = [
+                self.executor.submit(_parse_chunk, messages[start : start + chunk_size])
+                for start in range(0, len(messages), chunk_size)
+            ]
+            parsed_msgs = []
+            for future in futures:
+                chunk_msgs, snapshot = future.result()
+                parsed_msgs += chunk_msgs
+                metrics.add(snapshot)
+        except BrokenProcessPool as error:
+            print(f"{datetime.now()}: Parse pool failed, parsing in thread: {error}")
+            self.shutdown()
+            return parse_messages(messages)
+
+        return parsed_msgs
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+# ParsePool with N5_INGEST_PARSE_WORKERS processes, None to parse in the
+# writer thread
+def create_parse_pool():
+    workers = getattr(settings, "N5_INGEST_PARSE_WORKERS", 0)
+    if workers:
+        return ParsePool(workers)
+
+    return None
@@ -0,0 +1,143 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .device_cache import device_cache
+from .device_summary import remove_messages
+
+# Old TestSerialData rows are deleted with raw SQL in batches of about
+# batch_size rows, oldest first, one transaction per batch so the database
+# (the whole of it with SQLite) is not locked for long. No model instances
+# are created: each batch deletes the rows of the tables pointing at
+# TestSerialData, then the rows themselves, by device and create_at, which
+# the device index covers. A batch ends at the create_at of its last row, so
+# rows created in the same microsecond can make it slightly larger. Rows
+# saved by ingest between the statements are left for the next batch.
+
+
+# Rows deleted per transaction
+def batch_size():
+    return getattr(settings, "N5_RETENTION_BATCH_SIZE", 2000)
+
+
+# Days of data kept for a device, None keeps all of it
+def retention_days(serial):
+    device_days = getattr(settings, "N5_RETENTION_DEVICE_DAYS", {})
+    if serial in device_days:
+        return device_days[serial]
+
+    return getattr(settings, "N5_RETENTION_DAYS", None)
+
+
+# The delete statements of a batch, children first, for rows matching `where`
+def _delete_statements(where):
+    from ..models import TestSerialData
+
+    quote_name = connection.ops.quote_name
+    table = quote_name(TestSerialData._meta.db_table)
+    select_ids = f"SELECT id FROM {table} WHERE {where}"
+    statements = []
+    unreferenced = []
+    for relation in TestSerialData._meta.related_objects:
+        related_table = quote_name(relation.related_model._meta.db_table)
+        column = quote_name(relation.field.column)
+        statements.append(
+            f"DELETE FROM {related_table} WHERE {column} IN ({select_ids})"
+        )
+        unreferenced.append(
+            f"NOT EXISTS (SELECT 1 FROM {related_table} "
+            f"WHERE {related_table}.{column} = {table}.id)"
+        )
+    statements.append(
+        f"DELETE FROM {table} WHERE {where} AND " + " AND ".join(unreferenced)
+    )
+    return statements
+
+
+# Delete the rows of a device created before `before` (all of them when it is
+# None), returns the number of TestSerialData rows deleted
+def delete_device_rows(device_id, before=None, size=None):
+    from ..models import TestSerialData
+
+    if size is None:
+        size = batch_size()
+    rows = TestSerialData.objects.filter(device_serial_id=device_id)
+    if before is not None:
+        rows = rows.filter(create_at__lt=before)
+    rows = rows.order_by("create_at").values_list("create_at", flat=True)
+
+    adapt = connection.ops.adapt_datetimefield_value
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            # The create_at of the batch's last row, with fewer rows left
+            # than a batch the rest go
+            boundary = list(rows[size - 1 : size])
+            if boundary:
+                where = "device_serial_id = %s AND create_at <= %s"
+                params = [device_id, adapt(boundary[0])]
+            elif before is not None:
+                where = "device_serial_id = %s AND create_at < %s"
+                params = [device_id, adapt(before)]
+            else:
+                where = "device_serial_id = %s"
+                params = [device_id]
+
+            with connection.cursor() as cursor:
+                for statement in _delete_statements(where):
+                    cursor.execute(statement, params)
+                batch_deleted = cursor.rowcount
+            remove_messages(device_id, batch_deleted)
+            deleted += batch_deleted
+
+        if not boundary:
+            return deleted
+
+
+# Delete a device and all of its data, without loading the rows
+def purge_device(serial, size=None):
+    from ..models import DeviceSummary, TestDevice
+
+    device_id = (
+        TestDevice.objects.filter(serial=serial).values_list("id", flat=True).first()
+    )
+    if device_id is None:
+        return None
+
+    deleted = delete_device_rows(device_id, size=size)
+    with transaction.atomic():
+        # Locked before the cascade in the order ingest locks them, the
+        # summary while saving and the device when the foreign keys are
+        # checked at commit, so batches saving rows for the device are waited
+        # for. Later batches fail on the foreign key and create it again.
+        list(DeviceSummary.objects.select_for_update().filter(device_id=device_id))
+        for device in TestDevice.objects.select_for_update().filter(id=device_id):
+            device.delete()
+    device_cache.invalidate(serial)
+    return deleted
+
+
+# Delete the rows older than each device's retention, or `days` for every
+# device. Returns {serial: (rows deleted, seconds taken)} for the devices
+# that had rows deleted.
+def apply_retention(days=None, size=None):
+    from ..models import TestDevice
+
+    now = timezone.now()
+    freed = {}
+    for device_id, serial in TestDevice.objects.values_list("id", "serial"):
+        keep_days = days if days is not None else retention_days(serial)
+        if keep_days is None:
+            continue
+
+        start_time = time.perf_counter()
+        deleted = delete_device_rows(
+            device_id, before=now - timedelta(days=keep_days), size=size
+        )
+        if deleted:
+            freed[serial] = (deleted, time.perf_counter() - start_time)
+
+    return freed
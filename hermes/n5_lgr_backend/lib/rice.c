@@ -102,6 +102,7 @@
 *************************************************************************/
 
 #include "rice.h"
+#include <string.h>
 
 
 
@@ -580,3 +581,70 @@ void Rice_Uncompress( void *in, void *out, unsigned int insize,
         }
     }
 }
+
+
+/*************************************************************************
+* Rice_UncompressFifos() - Uncompress a buffer of Rice compressed FIFOs.
+*  in       - Input buffer. Each FIFO is stored as one length byte, a
+*             4 byte timestamp and then length bytes of compressed data.
+*  out      - Output buffer. Each FIFO is written as its 4 byte timestamp
+*             followed by fifosize bytes of uncompressed data.
+*  insize   - Number of input bytes.
+*  outsize  - Number of output bytes.
+*  fifosize - Number of uncompressed bytes in one FIFO.
+*  format   - Binary format (see rice.h)
+*  error    - Set to 1 if a FIFO runs past the end of the input buffer,
+*             0 otherwise.
+* The function returns the number of FIFOs written to the output buffer.
+*************************************************************************/
+
+unsigned int Rice_UncompressFifos( void *in, unsigned int insize, void *out,
+  unsigned int outsize, unsigned int fifosize, int format, int *error )
+{
+    unsigned char *inptr, *outptr;
+    unsigned int  index, length, count;
+
+    inptr  = (unsigned char *) in;
+    outptr = (unsigned char *) out;
+    index  = 0;
+    count  = 0;
+    *error = 0;
+
+    while( index < insize )
+    {
+        length = inptr[ index ];
+
+        /* FIFO data past the end of the input buffer? */
+        if( index + 5 + length > insize )
+        {
+            *error = 1;
+            break;
+        }
+
+        /* Out of room in the output buffer? */
+        if( (count + 1) * (4 + fifosize) > outsize )
+        {
+            break;
+        }
+
+        /* Copy timestamp */
+        memcpy( outptr, &inptr[ index + 1 ], 4 );
+
+        /* Uncompress data, an empty FIFO decodes to all zeros */
+        if( length > 0 )
+        {
+            Rice_Uncompress( &inptr[ index + 5 ], outptr + 4, length,
+                             fifosize, format );
+        }
+        else
+        {
+            memset( outptr + 4, 0, fifosize );
+        }
+
+        outptr += 4 + fifosize;
+        index  += 5 + length;
+        ++ count;
+    }
+
+    return count;
+}
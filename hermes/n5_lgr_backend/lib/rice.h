@@ -58,6 +58,9 @@ extern "C" {
 int Rice_Compress( void *in, void *out, unsigned int insize, int format );
 void Rice_Uncompress( void *in, void *out, unsigned int insize,
                       unsigned int outsize, int format );
+unsigned int Rice_UncompressFifos( void *in, unsigned int insize, void *out,
+                                   unsigned int outsize, unsigned int fifosize,
+                                   int format, int *error );
 
 
 #ifdef __cplusplus
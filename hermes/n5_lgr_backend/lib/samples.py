@@ -0,0 +1,145 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from . import parse_logger_msg
+
+# Samples are kept per message as packed little-endian arrays: the x, y, z
+# int16 triples, one uint32 Unix timestamp per frame and, for link lost
+# payloads, one int16 trumi state per frame. A sample's frame is its index
+# divided by the samples per frame.
+XYZ_DTYPE = np.dtype("<i2")
+TIMESTAMP_DTYPE = np.dtype("<u4")
+STATE_DTYPE = np.dtype("<i2")
+# State of the samples whose payload has none
+NO_STATE = -1
+
+
+# TestSerialSamples field values for a decoded payload, None when the payload
+# has no samples
+def sample_fields(xyz_payload):
+    sample_count = len(xyz_payload)
+    if not sample_count:
+        return None
+
+    frame_count = int(xyz_payload.frame_index[-1]) + 1
+    timestamps = xyz_payload.timestamps[:frame_count]
+    state = None
+    if xyz_payload.state is not None:
+        state = xyz_payload.state[:frame_count].astype(STATE_DTYPE).tobytes()
+
+    return {
+        "start_ts": datetime.fromtimestamp(int(timestamps.min()), timezone.utc),
+        "end_ts": datetime.fromtimestamp(int(timestamps.max()), timezone.utc),
+        "sample_count": sample_count,
+        "samples_per_frame": parse_logger_msg.PAYLOAD_FRAME_DTYPES.get(
+            xyz_payload.payload_type, parse_logger_msg.PAYLOAD_FRAME_DTYPES[""]
+        )["xyz"].shape[0],
+        "xyz": xyz_payload.xyz.astype(XYZ_DTYPE).tobytes(),
+        "timestamps": timestamps.astype(TIMESTAMP_DTYPE).tobytes(),
+        "state": state,
+    }
+
+
+class DeviceSamples:
+    """Accelerometer samples of one device as NumPy arrays, one entry per sample.
+
+    `xyz` is an (n, 3) int16 array, `timestamps` the Unix seconds of each
+    sample's frame, `state` the trumi state of link lost samples (NO_STATE
+    for the others) and `serial_data_id` the TestSerialData row the sample
+    came from. Samples are ordered by message time.
+    """
+
+    def __init__(self, serial_data_id, timestamps, xyz, state):
+        self.serial_data_id = serial_data_id
+        self.timestamps = timestamps
+        self.xyz = xyz
+        self.state = state
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def __getitem__(self, index):
+        return DeviceSamples(
+            self.serial_data_id[index],
+            self.timestamps[index],
+            self.xyz[index],
+            self.state[index],
+        )
+
+    @classmethod
+    def from_rows(cls, rows):
+        # Rows of (serial_data_id, sample_count, samples_per_frame, xyz,
+        # timestamps, state) are unpacked together, the per sample frame
+        # lookups done in one step for all the messages
+        if not rows:
+            return cls(
+                np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.int64),
+                np.empty((0, 3), dtype=XYZ_DTYPE),
+                np.empty(0, dtype=STATE_DTYPE),
+            )
+
+        ids, counts, samples_per_frame, xyz, timestamps, states = zip(*rows)
+        counts = np.array(counts, dtype=np.int64)
+        frame_counts = np.array(
+            [len(blob) // TIMESTAMP_DTYPE.itemsize for blob in timestamps],
+            dtype=np.int64,
+        )
+        frame_ts = np.frombuffer(b"".join(timestamps), dtype=TIMESTAMP_DTYPE)
+        frame_state = np.concatenate(
+            [
+                np.frombuffer(state, dtype=STATE_DTYPE)
+                if state is not None
+                else np.full(frame_count, NO_STATE, dtype=STATE_DTYPE)
+                for state, frame_count in zip(states, frame_counts.tolist())
+            ]
+        )
+
+        sample_starts = np.cumsum(counts) - counts
+        frame_starts = np.cumsum(frame_counts) - frame_counts
+        position = np.arange(counts.sum()) - np.repeat(sample_starts, counts)
+        frame = np.repeat(frame_starts, counts) + position // np.repeat(
+            np.array(samples_per_frame, dtype=np.int64), counts
+        )
+
+        return cls(
+            np.repeat(np.array(ids, dtype=np.int64), counts),
+            frame_ts[frame].astype(np.int64),
+            np.frombuffer(b"".join(xyz), dtype=XYZ_DTYPE).reshape(-1, 3),
+            frame_state[frame],
+        )
+
+
+# The samples of a device whose timestamps fall between start and end
+# (datetimes, either may be None), read from the packed arrays without
+# touching the payload text. Messages whose payload is still undecoded have
+# no samples until it is decoded or build_samples is run.
+def load_samples(serial, start=None, end=None):
+    from ..models import TestSerialSamples
+
+    rows = TestSerialSamples.objects.filter(device_serial__serial=serial)
+    if start is not None:
+        rows = rows.filter(end_ts__gte=start)
+    if end is not None:
+        rows = rows.filter(start_ts__lte=end)
+    rows = rows.order_by("start_ts", "serial_data_id").values_list(
+        "serial_data_id",
+        "sample_count",
+        "samples_per_frame",
+        "xyz",
+        "timestamps",
+        "state",
+    )
+
+    samples = DeviceSamples.from_rows(list(rows))
+    # Messages overlapping the range can hold samples outside it
+    keep = np.ones(len(samples), dtype=bool)
+    if start is not None:
+        keep &= samples.timestamps >= int(start.timestamp())
+    if end is not None:
+        keep &= samples.timestamps <= int(end.timestamp())
+    if keep.all():
+        return samples
+
+    return samples[keep]
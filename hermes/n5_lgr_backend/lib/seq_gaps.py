@@ -0,0 +1,58 @@
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import Lag
+
+from . import parse_logger_msg
+
+# Newest first. Rows saved in the same microsecond are in id order, as in the
+# device index.
+PAGE_ORDER = (F("create_at").desc(), F("id").asc())
+
+
+# The rows of a page, each with `is_incremental` set when the sequence number
+# is one below the newer row's before it. The LAG(seq_num) window runs over
+# the page's rows and the row before the page only, picked by a subquery on
+# the device index, so deep pages read no more rows than the first.
+def page_rows(message_data, page_obj):
+    from ..models import TestSerialData
+
+    per_page = page_obj.paginator.per_page
+    bottom = (page_obj.number - 1) * per_page
+    start = max(bottom - 1, 0)
+    rows = list(
+        TestSerialData.objects.filter(
+            id__in=message_data.order_by(*PAGE_ORDER).values("id")[
+                start : bottom + per_page
+            ]
+        )
+        .annotate(prev_seq_num=Window(Lag("seq_num"), order_by=PAGE_ORDER))
+        .order_by(*PAGE_ORDER)
+    )
+    # The row before the page only gives the first row its LAG
+    if bottom:
+        rows = rows[1:]
+
+    for row in rows:
+        row.is_incremental = (
+            row.prev_seq_num is None or row.prev_seq_num - row.seq_num == 1
+        )
+    return rows
+
+
+# (first, last) of each run of sequence numbers missing between a device's
+# messages, in order. Messages of a restarted logger share the sequence
+# numbers, so a gap is only reported where no run of the device has them.
+def missing_ranges(device_id):
+    from ..models import TestSerialData
+
+    quote_name = connection.ops.quote_name
+    sql = (
+        "SELECT prev_seq_num + 1, seq_num - 1 FROM ("
+        "SELECT seq_num, LAG(seq_num) OVER (ORDER BY seq_num) AS prev_seq_num "
+        f"FROM {quote_name(TestSerialData._meta.db_table)} "
+        "WHERE device_serial_id = %s AND msg_type IS NOT NULL AND msg_type <> %s"
+        ") AS seq_nums WHERE seq_num > prev_seq_num + 1 ORDER BY seq_num"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [device_id, parse_logger_msg.MSG_TYPE_BOOT_INFO])
+        return [tuple(row) for row in cursor.fetchall()]
@@ -0,0 +1,176 @@
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+# Append-only on-disk spool of raw messages. Records are the message length
+# (4 bytes) and receive time (8 byte float epoch seconds), big-endian, then
+# the message, written to numbered segment files. The consumer
+# reads from its position, saves the messages and commits the position to
+# the checkpoint file, fully consumed segments are then deleted. After a
+# crash the consumer replays from the last checkpoint.
+
+RECORD_HEADER = struct.Struct(">Id")
+SEGMENT_SUFFIX = ".spool"
+CHECKPOINT_FILE = "checkpoint"
+
+
+class Spool:
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, fsync=False):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+
+        # Position is (segment number, byte offset in the segment)
+        self.checkpoint = self.load_checkpoint()
+        self.read_position = self.checkpoint
+        self.read_file = None
+
+        # A restarted writer never appends to an old segment, whatever
+        # follows a torn record there is in the next segment
+        self.write_lock = threading.Lock()
+        self.write_file = None
+        self.write_size = 0
+        self.write_segment = max(self.segments() + [self.checkpoint[0]]) + 1
+
+    def segment_path(self, segment):
+        return self.directory / f"{segment:012d}{SEGMENT_SUFFIX}"
+
+    def segments(self):
+        return sorted(
+            int(path.stem) for path in self.directory.glob(f"*{SEGMENT_SUFFIX}")
+        )
+
+    def load_checkpoint(self):
+        try:
+            segment, offset = (self.directory / CHECKPOINT_FILE).read_text().split()
+        except FileNotFoundError:
+            segments = self.segments()
+            return (segments[0] if segments else 0, 0)
+
+        return int(segment), int(offset)
+
+    # One buffered write per message, the segment is rotated when full
+    def append(self, message, received_at=None):
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        if received_at is None:
+            received_at = time.time()
+        record = RECORD_HEADER.pack(len(message), received_at) + message
+
+        with self.write_lock:
+            if self.write_file is None or self.write_size >= self.segment_bytes:
+                self._rotate()
+            self.write_file.write(record)
+            self.write_file.flush()
+            if self.fsync:
+                os.fsync(self.write_file.fileno())
+            self.write_size += len(record)
+
+    def _rotate(self):
+        # The old segment is closed before the new one exists, so a reader
+        # that sees the new segment can read the old one to its end
+        if self.write_file is not None:
+            self.write_file.close()
+            self.write_segment += 1
+        self.write_file = open(self.segment_path(self.write_segment), "ab")
+        self.write_size = 0
+
+    # Up to max_messages (receive time, message) pairs from the read position
+    # onwards, with the position after them
+    def read(self, max_messages):
+        messages = []
+        segment, offset = self.read_position
+        while len(messages) < max_messages:
+            if self.read_file is None:
+                path = self.segment_path(segment)
+                if not path.exists():
+                    next_segment = self._next_segment(segment)
+                    if next_segment is None:
+                        break
+                    segment, offset = next_segment, 0
+                    continue
+                self.read_file = open(path, "rb")
+                self.read_file.seek(offset)
+
+            offset = self._read_records(messages, max_messages, offset)
+            if len(messages) >= max_messages:
+                break
+
+            # At the end of the segment, move on only once the writer has
+            # moved on, reading what it wrote before it did
+            next_segment = self._next_segment(segment)
+            if next_segment is None:
+                break
+            offset = self._read_records(messages, max_messages, offset)
+            if len(messages) >= max_messages:
+                break
+
+            # Anything left is a record torn by a crash
+            self.read_file.close()
+            self.read_file = None
+            segment, offset = next_segment, 0
+
+        self.read_position = (segment, offset)
+        return messages, self.read_position
+
+    def _read_records(self, messages, max_messages, offset):
+        while len(messages) < max_messages:
+            header = self.read_file.read(RECORD_HEADER.size)
+            if len(header) == RECORD_HEADER.size:
+                length, received_at = RECORD_HEADER.unpack(header)
+                message = self.read_file.read(length)
+                if len(message) == length:
+                    messages.append((received_at, message.decode("utf-8")))
+                    offset += RECORD_HEADER.size + length
+                    continue
+
+            # Incomplete record, read it again next time
+            self.read_file.seek(offset)
+            break
+
+        return offset
+
+    def _next_segment(self, segment):
+        later = [other for other in self.segments() if other > segment]
+        return later[0] if later else None
+
+    # Record that everything before `position` is saved and delete the
+    # segments before it
+    def commit(self, position):
+        checkpoint_path = self.directory / CHECKPOINT_FILE
+        temp_path = checkpoint_path.with_suffix(".tmp")
+        temp_path.write_text(f"{position[0]} {position[1]}\n")
+        os.replace(temp_path, checkpoint_path)
+        self.checkpoint = position
+
+        for segment in self.segments():
+            if segment >= position[0]:
+                break
+            self.segment_path(segment).unlink(missing_ok=True)
+
+    # Read again from the checkpoint, after the messages read could not be saved
+    def rewind(self):
+        if self.read_file is not None:
+            self.read_file.close()
+            self.read_file = None
+        self.read_position = self.checkpoint
+
+    # Messages appended and not yet committed, in bytes
+    def backlog_bytes(self):
+        total = 0
+        for segment in self.segments():
+            if segment >= self.checkpoint[0]:
+                total += self.segment_path(segment).stat().st_size
+        return total - self.checkpoint[1]
+
+    def close(self):
+        with self.write_lock:
+            if self.write_file is not None:
+                self.write_file.close()
+                self.write_file = None
+        if self.read_file is not None:
+            self.read_file.close()
+            self.read_file = None
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...lib import retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete TestSerialData rows older than the retention settings, and "
+        "purge devices. Meant to be run on a schedule, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Keep this many days for every device, instead of the settings",
+        )
+        parser.add_argument(
+            "--purge",
+            action="append",
+            default=[],
+            metavar="SERIAL",
+            help="Delete a device and all of its data, can be repeated",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Rows deleted per transaction (N5_RETENTION_BATCH_SIZE)",
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.perf_counter()
+        total = 0
+
+        for serial in options["purge"]:
+            purge_start = time.perf_counter()
+            deleted = retention.purge_device(serial, size=options["batch_size"])
+            if deleted is None:
+                self.stderr.write(f"Device {serial} does not exist")
+                continue
+            total += deleted
+            self.stdout.write(
+                f"Purged {serial}: {deleted} rows in "
+                f"{time.perf_counter() - purge_start:.2f}s"
+            )
+
+        if not options["purge"] or options["days"] is not None:
+            freed = retention.apply_retention(
+                days=options["days"], size=options["batch_size"]
+            )
+            for serial, (deleted, seconds) in sorted(freed.items()):
+                total += deleted
+                self.stdout.write(f"{serial}: {deleted} rows in {seconds:.2f}s")
+
+        self.stdout.write(
+            f"Freed {total} rows in {time.perf_counter() - start_time:.2f}s"
+        )
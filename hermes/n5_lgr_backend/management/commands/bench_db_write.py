@@ -0,0 +1,111 @@
+import itertools
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...lib import corpus, ingest, retention
+
+# Serials of the devices written by the benchmark, deleted before and after
+# each run
+BENCH_SERIAL_PREFIX = "BW"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark saving parsed messages on the configured database: "
+        "bulk_create, and COPY on PostgreSQL"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--devices", type=int, default=100, help="Devices the messages come from"
+        )
+        parser.add_argument(
+            "--messages", type=int, default=20000, help="Messages saved per method"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Messages saved per transaction, as N5_INGEST_BATCH_SIZE",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=1000,
+            help="Fleet message rate (msg/s) to compare the results with",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Message seed")
+        parser.add_argument(
+            "--allow-default-database",
+            action="store_true",
+            help=f"Let the benchmark write to the default database, deleting the "
+            f"{BENCH_SERIAL_PREFIX}* devices",
+        )
+
+    def handle(self, *args, **options):
+        if not options["allow_default_database"]:
+            raise CommandError(
+                "The benchmark saves and deletes the devices named "
+                f"{BENCH_SERIAL_PREFIX}* in the default database "
+                f"({connection.settings_dict['NAME']}), add "
+                "--allow-default-database to run it there"
+            )
+
+        serials = tuple(
+            f"{BENCH_SERIAL_PREFIX}{number:04d}" for number in range(options["devices"])
+        )
+        messages = list(
+            itertools.islice(
+                corpus.message_stream(options["seed"], serials), options["messages"]
+            )
+        )
+        batch_size = options["batch_size"]
+        # Parsed once, only saving is timed
+        batches = [
+            ingest.parse_messages(messages[start : start + batch_size])
+            for start in range(0, len(messages), batch_size)
+        ]
+
+        methods = ["bulk_create"]
+        if connection.vendor == "postgresql":
+            methods.append("copy")
+        self.stdout.write(
+            f"{connection.vendor}: {len(messages)} messages from {len(serials)} "
+            f"devices in batches of {batch_size}, fleet rate {options['rate']:.0f} "
+            "msg/s"
+        )
+
+        try:
+            for method in methods:
+                self.delete_devices(serials)
+                batch_times = self.run(batches, copy=method == "copy")
+                self.report(method, batches, batch_times, options["rate"])
+        finally:
+            self.delete_devices(serials)
+
+    # Seconds each batch took to save
+    def run(self, batches, copy):
+        batch_times = []
+        for parsed_msgs in batches:
+            start_time = time.perf_counter()
+            ingest.save_parsed_msgs(parsed_msgs, copy=copy)
+            batch_times.append(time.perf_counter() - start_time)
+
+        return batch_times
+
+    def report(self, method, batches, batch_times, rate):
+        batch_ms = np.array(batch_times) * 1000
+        messages = sum(len(parsed_msgs) for parsed_msgs in batches)
+        msg_per_sec = messages / sum(batch_times)
+        self.stdout.write(
+            f"{method:<12}{msg_per_sec:>10.0f} msg/s{msg_per_sec / rate:>8.1f}x fleet"
+            f"   batch p50 {np.percentile(batch_ms, 50):.1f} ms"
+            f"  p99 {np.percentile(batch_ms, 99):.1f} ms"
+        )
+
+    def delete_devices(self, serials):
+        for serial in serials:
+            retention.purge_device(serial)
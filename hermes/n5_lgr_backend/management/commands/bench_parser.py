@@ -0,0 +1,188 @@
+import gc
+import json
+import platform
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from ...lib import corpus, parse_logger_msg
+
+BASELINE_FILE = (
+    Path(__file__).resolve().parents[2] / "benchmarks" / "parser_baseline.json"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the logger message parser and Rice decompression on a "
+        "generated corpus and compare with the stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000, help="Corpus size")
+        parser.add_argument("--seed", type=int, default=0, help="Corpus seed")
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=10,
+            help="Timed runs per benchmark, the fastest is reported",
+        )
+        parser.add_argument(
+            "--baseline", default=str(BASELINE_FILE), help="Baseline JSON file"
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write the results as the new baseline",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Slowdown against the baseline reported as a regression",
+        )
+
+    def handle(self, *args, **options):
+        messages = corpus.generate_messages(options["messages"], options["seed"])
+        n5lgr = parse_logger_msg.parser
+
+        # Payloads grouped by how they are decoded, straight from the corpus
+        payloads = {}
+        for message in messages:
+            parsed_msg = n5lgr.parse_msg(message, decode_payload=False)
+            if parsed_msg["payload_type"] is not None:
+                payloads.setdefault(parsed_msg["payload_type"], []).append(
+                    parsed_msg["data_msg"][parse_logger_msg.PAYLOAD_POS :]
+                )
+        motion_payloads = payloads.get("decompress_payload", [])
+        link_lost_payloads = payloads.get("link_lost_mode", [])
+        sample_payloads = payloads.get("", [])
+
+        # Name: (items, function called per item, messages or payloads in total)
+        benchmarks = {
+            "parse_msg": (messages, n5lgr.parse_msg, len(messages)),
+            "parse_msg_lazy": (
+                messages,
+                lambda message: n5lgr.parse_msg(message, decode_payload=False),
+                len(messages),
+            ),
+            "parse_payload_motion": (
+                motion_payloads,
+                lambda payload: n5lgr._parse_payload(payload, "decompress_payload"),
+                len(motion_payloads),
+            ),
+            "parse_payload_link_lost": (
+                link_lost_payloads,
+                lambda payload: n5lgr._parse_payload(payload, "link_lost_mode"),
+                len(link_lost_payloads),
+            ),
+            "parse_payload_samples": (
+                sample_payloads,
+                lambda payload: n5lgr._parse_payload(payload, ""),
+                len(sample_payloads),
+            ),
+            "decompress_payload": (
+                motion_payloads,
+                n5lgr._decompress_payload,
+                len(motion_payloads),
+            ),
+        }
+
+        results = {}
+        for name, (items, function, item_count) in benchmarks.items():
+            if items:
+                results[name] = self.run(
+                    items, function, item_count, options["repeat"]
+                )
+                self.stdout.write(self.format_result(name, results[name]))
+
+        baseline_file = Path(options["baseline"])
+        if options["save_baseline"]:
+            baseline_file.parent.mkdir(parents=True, exist_ok=True)
+            baseline = {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "messages": options["messages"],
+                "seed": options["seed"],
+                "results": results,
+            }
+            baseline_file.write_text(json.dumps(baseline, indent=2) + "\n")
+            self.stdout.write(
+                self.style.SUCCESS(f"Baseline saved to {baseline_file}")
+            )
+            return
+
+        if not baseline_file.exists():
+            self.stdout.write(
+                f"No baseline at {baseline_file}, run with --save-baseline"
+            )
+            return
+
+        self.compare(
+            json.loads(baseline_file.read_text()), results, options["tolerance"]
+        )
+
+    # Best time of `repeat` runs with the garbage collector off (as timeit
+    # does), then one more run under tracemalloc for the peak memory
+    # allocated while it runs
+    def run(self, items, function, item_count, repeat):
+        best_time = None
+        gc.disable()
+        try:
+            for _ in range(max(repeat, 1)):
+                start_time = time.perf_counter()
+                for item in items:
+                    function(item)
+                run_time = time.perf_counter() - start_time
+                if best_time is None or run_time < best_time:
+                    best_time = run_time
+        finally:
+            gc.enable()
+
+        tracemalloc.start()
+        for item in items:
+            function(item)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            "count": item_count,
+            "us_per_item": round(best_time / item_count * 1e6, 2),
+            "items_per_sec": round(item_count / best_time),
+            "peak_kib": round(peak_memory / 1024, 1),
+        }
+
+    def format_result(self, name, result):
+        return (
+            f"{name:<26}{result['us_per_item']:>10.2f} us/item"
+            f"{result['items_per_sec']:>12} items/sec"
+            f"{result['peak_kib']:>12.1f} KiB peak  ({result['count']} items)"
+        )
+
+    def compare(self, baseline, results, tolerance):
+        regressions = []
+        for name, result in results.items():
+            baseline_result = baseline["results"].get(name)
+            if baseline_result is None:
+                continue
+
+            change = result["us_per_item"] / baseline_result["us_per_item"] - 1
+            line = (
+                f"{name:<26}{baseline_result['us_per_item']:>10.2f} -> "
+                f"{result['us_per_item']:.2f} us/item ({change:+.0%})"
+            )
+            if change > tolerance:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(
+                f"Slower than the baseline by more than {tolerance:.0%}: "
+                + ", ".join(regressions)
+            )
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...lib import parse_logger_msg, samples
+from ...models import TestSerialData, TestSerialSamples
+
+
+class Command(BaseCommand):
+    help = "Store the packed accelerometer samples of messages saved without them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Messages decoded per transaction",
+        )
+
+    def handle(self, *args, **options):
+        # Messages with a header and no samples row, those still stored
+        # undecoded get theirs when decode_payloads decodes them
+        rows = (
+            TestSerialData.objects.filter(msg_type__isnull=False, samples__isnull=True)
+            .exclude(msg_type=parse_logger_msg.MSG_TYPE_BOOT_INFO)
+            .select_related("content")
+            .order_by("id")
+        )
+
+        last_id = 0
+        created = 0
+        decoded = 0
+        while True:
+            with transaction.atomic():
+                batch = list(rows.filter(id__gt=last_id)[: options["batch_size"]])
+                if not batch:
+                    break
+
+                lazy = [item for item in batch if item.content.payload_type is not None]
+                TestSerialData.decode_payloads(lazy)
+                lazy_ids = {item.id for item in lazy}
+
+                sample_rows = []
+                for item in batch:
+                    if item.id in lazy_ids:
+                        continue
+                    try:
+                        xyz_payload = parse_logger_msg.parser.parse_xyz_payload(
+                            item.content.data_msg,
+                            parse_logger_msg.payload_type_for(
+                                item.trumi_st, item.buffer_link_type
+                            ),
+                        )
+                    except ValueError as error:
+                        self.stderr.write(f"Skipping message {item.id}: {error}")
+                        continue
+                    sample_fields = samples.sample_fields(xyz_payload)
+                    if sample_fields is not None:
+                        sample_rows.append(
+                            TestSerialSamples(
+                                serial_data=item,
+                                device_serial_id=item.device_serial_id,
+                                **sample_fields,
+                            )
+                        )
+                TestSerialSamples.objects.bulk_create(
+                    sample_rows, ignore_conflicts=True
+                )
+
+            created += len(sample_rows)
+            decoded += len(lazy)
+            last_id = batch[-1].id
+            self.stdout.write(f"Checked messages up to id {last_id}")
+
+        self.stdout.write(
+            f"Stored the samples of {created} messages and decoded {decoded} "
+            "stored undecoded"
+        )
@@ -0,0 +1,101 @@
+import mmap
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...lib import ingest
+
+MSG_MARKER = b" : Msg: "
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk load logger serial logs ("<timestamp> : Msg: <hex>" lines) into '
+        "TestSerialData"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", help="Log files to ingest")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Messages parsed and saved per transaction",
+        )
+        parser.add_argument(
+            "--offset",
+            type=int,
+            default=0,
+            help="Byte offset to resume the first file from",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        self.start_time = time.time()
+        self.rows = 0
+        offset = options["offset"]
+        for file_name in options["files"]:
+            self.ingest_file(file_name, offset, batch_size)
+            # The offset only applies to the file being resumed
+            offset = 0
+
+        total_time = time.time() - self.start_time
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Saved {self.rows} rows in {total_time:.1f} seconds "
+                f"({self.rows / max(total_time, 1e-9):.0f} rows/sec)"
+            )
+        )
+
+    def ingest_file(self, file_name, offset, batch_size):
+        skipped = 0
+
+        with open(file_name, "rb") as log_file:
+            try:
+                log_map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file, nothing to map
+                return
+
+            with log_map:
+                if offset > len(log_map):
+                    raise CommandError(
+                        f"Offset {offset} is past the end of {file_name} "
+                        f"({len(log_map)} bytes)"
+                    )
+                log_map.seek(offset)
+
+                messages = []
+                for line in iter(log_map.readline, b""):
+                    if MSG_MARKER in line:
+                        messages.append(line.decode("utf-8", "replace").rstrip("\r\n"))
+
+                    if len(messages) >= batch_size:
+                        skipped += self.save_batch(messages)
+                        messages = []
+                        self.report(file_name, log_map.tell())
+
+                if messages:
+                    skipped += self.save_batch(messages)
+                self.report(file_name, log_map.tell())
+
+        if skipped:
+            self.stderr.write(f"{file_name}: skipped {skipped} unparsable lines")
+
+    def save_batch(self, messages):
+        parsed_msgs = ingest.parse_messages(messages)
+        self.rows += ingest.save_parsed_msgs(parsed_msgs)
+
+        # Number of lines skipped
+        return len(messages) - len(parsed_msgs)
+
+    def report(self, file_name, position):
+        # Everything before `position` is committed, so it is the resume offset
+        elapsed = time.time() - self.start_time
+        self.stdout.write(
+            f"{file_name}: committed up to byte {position}, {self.rows} rows "
+            f"({self.rows / max(elapsed, 1e-9):.0f} rows/sec)"
+        )
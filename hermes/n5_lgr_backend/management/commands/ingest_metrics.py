@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from ...lib import metrics
+
+
+class Command(BaseCommand):
+    help = "Show the ingest stage latencies and counters of the ingest processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--prometheus",
+            action="store_true",
+            help="Print the Prometheus text served at /metrics",
+        )
+
+    def handle(self, *args, **options):
+        snapshots = metrics.collect()
+        if options["prometheus"]:
+            self.stdout.write(metrics.render_prometheus(snapshots), ending="")
+            return
+
+        rows = metrics.summarize(snapshots)
+        if not rows:
+            self.stdout.write("No ingest metrics recorded yet")
+            return
+
+        self.stdout.write(
+            f"{'stage':<34}{'msg_type':<18}{'trumi_st':<32}"
+            f"{'count':>9}{'mean ms':>10}{'p50 ms':>9}{'p99 ms':>9}"
+        )
+        for row in rows:
+            stage = row["name"].replace("n5_ingest_", "").replace("_seconds", "")
+            self.stdout.write(
+                f"{stage:<34}{row['labels'].get('msg_type', '').strip():<18}"
+                f"{row['labels'].get('trumi_st', '').strip():<32}"
+                f"{row['count']:>9}{row['mean'] * 1000:>10.3f}"
+                f"{row['p50'] * 1000:>9.3f}{row['p99'] * 1000:>9.3f}"
+            )
+
+        _, _, counters, gauges = metrics.merge(snapshots)
+        for totals in (counters, gauges):
+            for name in sorted(totals):
+                self.stdout.write(f"{name} {sum(totals[name].values())}")
@@ -0,0 +1,278 @@
+import asyncio
+import itertools
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import paho.mqtt.client as paho
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+
+from ...lib import corpus, ingest, metrics, mqtt, mqtt_broker, parse_logger_msg
+from ...models import TestSerialData
+
+# device_serials() names up to this many devices
+MAX_DEVICES = 10000
+# Rows are counted this often while waiting for ingest to catch up
+POLL_INTERVAL = 0.2
+# Published to unless --host is given, never the configured N5_MQTT_HOST
+DEFAULT_HOST = "127.0.0.1"
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish synthetic N5 logger messages at a fixed rate. With --ingest "
+        "the MQTT ingest service runs in this process and the ingest "
+        "throughput and end-to-end latency are reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--devices",
+            type=int,
+            default=100,
+            help=f"Devices taking turns to send, up to {MAX_DEVICES}",
+        )
+        parser.add_argument(
+            "--rate", type=float, default=1000, help="Messages published per second"
+        )
+        parser.add_argument(
+            "--duration", type=float, default=10, help="Seconds to publish for"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Message seed")
+        parser.add_argument(
+            "--qos", type=int, choices=(0, 1, 2), default=0, help="Publish QoS"
+        )
+        parser.add_argument(
+            "--host", default=DEFAULT_HOST, help=f"MQTT broker host, {DEFAULT_HOST}"
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            help="MQTT broker port, 1883 or a free one with --local-broker",
+        )
+        parser.add_argument("--topic", help="Topic to publish to")
+        parser.add_argument(
+            "--local-broker",
+            action="store_true",
+            help="Start the in-process stand-in broker, on a free port unless "
+            "--port is given",
+        )
+        parser.add_argument(
+            "--ingest",
+            action="store_true",
+            help="Run the ingest service in this process and report how it kept up",
+        )
+        parser.add_argument(
+            "--allow-default-database",
+            action="store_true",
+            help="Let --ingest save the messages to the default database",
+        )
+        parser.add_argument(
+            "--metrics-dir",
+            help="Where --ingest saves its metrics snapshot, a temporary "
+            "directory unless given, apart from the ingest workers' N5_METRICS_DIR",
+        )
+        parser.add_argument(
+            "--drain-timeout",
+            type=float,
+            default=30,
+            help="Seconds to wait for ingest to save the messages after publishing",
+        )
+
+    def handle(self, *args, **options):
+        if not 0 < options["devices"] <= MAX_DEVICES:
+            raise CommandError(f"--devices must be between 1 and {MAX_DEVICES}")
+        if options["rate"] <= 0:
+            raise CommandError("--rate must be positive")
+        if options["ingest"] and not options["allow_default_database"]:
+            raise CommandError(
+                "--ingest saves the messages to the default database "
+                f"({connection.settings_dict['NAME']}), add --allow-default-database "
+                "to run it there"
+            )
+
+        local_broker = options["local_broker"]
+        host = options["host"]
+        port = options["port"]
+        if port is None:
+            port = 0 if local_broker else 1883
+        topic = options["topic"] or getattr(settings, "N5_MQTT_TOPIC", "n5_msgs")
+
+        # Logger and log line clocks start now, so every run sends messages
+        # not seen before
+        count = max(1, int(options["rate"] * options["duration"]))
+        start_time = time.perf_counter()
+        stream = corpus.message_stream(
+            options["seed"],
+            corpus.device_serials(options["devices"]),
+            int(time.time()) - parse_logger_msg.LOGGER_EPOCH,
+            datetime.now(),
+        )
+        messages = list(itertools.islice(stream, count))
+        self.stdout.write(
+            f"Generated {count} messages from {options['devices']} devices in "
+            f"{time.perf_counter() - start_time:.2f}s"
+        )
+
+        # The run's metrics and spool are kept apart from the ingest workers'
+        with tempfile.TemporaryDirectory(prefix="loadgen-") as temp_dir:
+            asyncio.run(
+                self.run(messages, host, port, topic, local_broker, temp_dir, options)
+            )
+
+    async def run(self, messages, host, port, topic, local_broker, temp_dir, options):
+        loop = asyncio.get_running_loop()
+        if local_broker:
+            broker = mqtt_broker.MQTTBroker()
+            port = await broker.start(host, port)
+            self.stdout.write(f"Stand-in MQTT broker listening on {host}:{port}")
+
+        service = None
+        if options["ingest"]:
+            metrics.process_name = "loadgen"
+            first_id = await loop.run_in_executor(None, self.last_row_id)
+            service = mqtt.IngestService(
+                host, port, topic, writer=self.create_writer(temp_dir, options)
+            )
+            service_task = loop.create_task(service.run())
+            await service.subscribed.wait()
+
+        try:
+            sent_at, elapsed = await loop.run_in_executor(
+                None,
+                self.publish,
+                messages,
+                host,
+                port,
+                topic,
+                options["rate"],
+                options["qos"],
+            )
+            self.stdout.write(
+                f"Published {len(messages)} messages in {elapsed:.2f}s "
+                f"({len(messages) / elapsed:.0f} msg/s, target "
+                f"{options['rate']:.0f} msg/s)"
+            )
+
+            if service is not None:
+                rows = await loop.run_in_executor(
+                    None,
+                    self.wait_for_rows,
+                    first_id,
+                    len(messages),
+                    options["drain_timeout"],
+                )
+        finally:
+            if service is not None:
+                service.stop()
+                await service_task
+            if local_broker:
+                await broker.stop()
+
+        if service is not None:
+            self.report(rows, sent_at, len(messages))
+
+    # A writer like the ingest workers', spooling to `temp_dir` when they spool
+    def create_writer(self, temp_dir, options):
+        metrics_dir = options["metrics_dir"] or temp_dir
+        if getattr(settings, "N5_INGEST_SPOOL_DIR", None):
+            return ingest.SpooledIngestWriter(
+                Path(temp_dir) / "spool", metrics_dir=metrics_dir
+            )
+
+        return ingest.IngestWriter(metrics_dir=metrics_dir)
+
+    # Publish the messages evenly spread over time, returns the time each
+    # was sent keyed by its data_msg, and the time publishing took
+    def publish(self, messages, host, port, topic, rate, qos):
+        client = paho.Client(
+            client_id=mqtt.unique_client_id("hermes-loadgen"),
+            protocol=paho.MQTTv5,
+            callback_api_version=paho.CallbackAPIVersion.VERSION2,
+        )
+        client.connect(host, port)
+        client.loop_start()
+
+        sent_at = {}
+        start_time = time.perf_counter()
+        try:
+            for index, message in enumerate(messages):
+                delay = start_time + index / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sent_at[message.partition(" : Msg: ")[2]] = time.time()
+                info = client.publish(topic, message, qos)
+            info.wait_for_publish()
+            elapsed = time.perf_counter() - start_time
+        finally:
+            client.disconnect()
+            client.loop_stop()
+
+        return sent_at, elapsed
+
+    def last_row_id(self):
+        try:
+            return TestSerialData.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        finally:
+            connection.close()
+
+    # (data_msg, create_at) of the rows saved since `first_id`, once `expected`
+    # are saved or no more have been for `timeout` seconds
+    def wait_for_rows(self, first_id, expected, timeout):
+        try:
+            new_rows = TestSerialData.objects.filter(id__gt=first_id)
+            saved = 0
+            deadline = time.monotonic() + timeout
+            while saved < expected and time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                count = new_rows.count()
+                if count > saved:
+                    saved = count
+                    deadline = time.monotonic() + timeout
+
+            return list(new_rows.values_list("content__data_msg", "create_at"))
+        finally:
+            connection.close()
+
+    def report(self, rows, sent_at, published):
+        latencies = np.array(
+            [
+                create_at.timestamp() - sent_at[data_msg]
+                for data_msg, create_at in rows
+                if data_msg in sent_at
+            ]
+        )
+        if not len(latencies):
+            self.stdout.write("No messages were saved")
+            return
+
+        first_sent = min(sent_at.values())
+        saved_at = [create_at.timestamp() for _, create_at in rows]
+        ingest_seconds = max(saved_at) - first_sent
+        db_seconds = max(max(saved_at) - min(saved_at), 1e-6)
+        self.stdout.write(
+            f"Saved {len(latencies)} of {published} messages in "
+            f"{ingest_seconds:.2f}s: {len(latencies) / ingest_seconds:.0f} msg/s "
+            f"sustained, {len(latencies) / db_seconds:.0f} rows/s written"
+        )
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        self.stdout.write(
+            f"End-to-end latency, publish to insert: p50 {p50:.1f} ms, "
+            f"p99 {p99:.1f} ms, max {latencies.max() * 1000:.1f} ms"
+        )
+
+        _, _, counters, _ = metrics.merge([metrics.metrics.snapshot()])
+        for name in (
+            "n5_ingest_duplicates_total",
+            "n5_ingest_skipped_total",
+            "n5_ingest_errors_total",
+            "n5_ingest_rejected_total",
+        ):
+            total = sum(counters.get(name, {}).values())
+            if total:
+                self.stdout.write(f"{name} {total}")
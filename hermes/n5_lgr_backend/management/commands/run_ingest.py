@@ -0,0 +1,138 @@
+import asyncio
+import signal
+import subprocess
+import sys
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...lib import ingest, metrics, mqtt, mqtt_broker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the MQTT ingest service, --workers processes split the topic "
+        "between them with an MQTT v5 shared subscription"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=1, help="Ingest processes to run"
+        )
+        parser.add_argument("--host", help="MQTT broker host")
+        parser.add_argument("--port", type=int, help="MQTT broker port")
+        parser.add_argument("--topic", help="Topic the loggers publish to")
+        parser.add_argument(
+            "--group",
+            help='Shared subscription group, "" subscribes to the topic directly',
+        )
+        parser.add_argument(
+            "--worker-index",
+            type=int,
+            default=0,
+            help="Index of this worker, selects its spool directory",
+        )
+        parser.add_argument(
+            "--local-broker",
+            action="store_true",
+            help="Start the in-process stand-in broker on --host/--port and "
+            "ingest from it, for testing without mosquitto",
+        )
+
+    def handle(self, *args, **options):
+        local_broker = options["local_broker"]
+        host = options["host"]
+        if host is None:
+            host = "127.0.0.1" if local_broker else settings.N5_MQTT_HOST
+        port = options["port"] or getattr(settings, "N5_MQTT_PORT", 1883)
+        topic = options["topic"] or getattr(settings, "N5_MQTT_TOPIC", "n5_msgs")
+        group = options["group"]
+        if group is None:
+            group = getattr(settings, "N5_MQTT_SHARE_GROUP", "")
+
+        if options["workers"] > 1:
+            if not group:
+                raise CommandError(
+                    "Several workers need a shared subscription --group, or "
+                    "every worker saves every message"
+                )
+            if local_broker:
+                self.start_broker_thread(host, port)
+            self.run_workers(options["workers"], host, port, topic, group)
+        else:
+            asyncio.run(
+                self.run_service(
+                    host, port, topic, group, local_broker, options["worker_index"]
+                )
+            )
+
+    async def run_service(self, host, port, topic, group, local_broker, worker_index):
+        if local_broker:
+            broker = mqtt_broker.MQTTBroker()
+            await broker.start(host, port)
+            self.stdout.write(f"Stand-in MQTT broker listening on {host}:{port}")
+
+        metrics.process_name = f"ingest-worker-{worker_index}"
+        service = mqtt.IngestService(
+            host, port, topic, group, writer=ingest.create_writer(worker_index)
+        )
+        try:
+            loop = asyncio.get_running_loop()
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signal_number, service.stop)
+        except NotImplementedError:
+            # No signal handlers on Windows event loops, Ctrl+C still ends it
+            pass
+
+        await service.run()
+
+        if local_broker:
+            await broker.stop()
+
+    def start_broker_thread(self, host, port):
+        broker = mqtt_broker.MQTTBroker()
+        started = threading.Event()
+
+        async def serve():
+            await broker.start(host, port)
+            started.set()
+            await broker.server.serve_forever()
+
+        threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+        started.wait()
+        self.stdout.write(f"Stand-in MQTT broker listening on {host}:{port}")
+
+    # Each worker is a separate `run_ingest` process, so each has its own
+    # client id, event loop and database connection
+    def run_workers(self, workers, host, port, topic, group):
+        command = [
+            sys.executable,
+            str(settings.BASE_DIR / "manage.py"),
+            "run_ingest",
+            "--host",
+            host,
+            "--port",
+            str(port),
+            "--topic",
+            topic,
+            "--group",
+            group,
+        ]
+        processes = [
+            subprocess.Popen(command + ["--worker-index", str(worker_index)])
+            for worker_index in range(workers)
+        ]
+        self.stdout.write(f"Started {workers} ingest workers")
+
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+            for process in processes:
+                process.wait()
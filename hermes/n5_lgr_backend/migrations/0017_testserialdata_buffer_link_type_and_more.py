@@ -0,0 +1,72 @@
+# Generated by Django 4.1.7 on 2026-10-17 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0016_alter_testserialdata_flags"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testserialdata",
+            name="buffer_link_type",
+            field=models.CharField(default="", max_length=50),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="header_crc",
+            field=models.CharField(default="", max_length=10),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="pld_crc",
+            field=models.CharField(default="", max_length=10),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="pld_sz",
+            field=models.CharField(default="", max_length=50),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="reloc_st_trans_count",
+            field=models.CharField(default="", max_length=50),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="stored_st_trans_count",
+            field=models.CharField(default="", max_length=50),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="trumi_st_trans_count",
+            field=models.CharField(default="", max_length=50),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="wifi_aps",
+            field=models.CharField(default="", max_length=50),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="xyz_raw",
+            field=models.CharField(default="", max_length=8000),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name="testserialdata",
+            name="payload",
+            field=models.CharField(max_length=8000),
+        ),
+    ]
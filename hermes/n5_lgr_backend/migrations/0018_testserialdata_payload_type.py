@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-17 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0017_testserialdata_buffer_link_type_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testserialdata",
+            name="payload_type",
+            field=models.CharField(blank=True, default=None, max_length=20, null=True),
+        ),
+    ]
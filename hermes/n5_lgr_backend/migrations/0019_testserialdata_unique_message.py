@@ -0,0 +1,44 @@
+# Generated by Django 4.1.7 on 2026-10-17 19:37
+
+from django.db import migrations, models
+
+
+# Keep the first saved copy of each retransmitted message so the unique
+# constraint can be added. The copies are the rows the constraint covers with
+# the same device, sequence number and generation time, that is the same
+# device and sequence number for messages whose time is "No timestamp", which
+# are NULL from 0021 on and kept unique by the constraint of 0029.
+MESSAGE_KEY = ("device_serial", "seq_num", "msg_gen_ts")
+
+
+def delete_duplicate_messages(apps, schema_editor):
+    TestSerialData = apps.get_model("n5_lgr_backend", "TestSerialData")
+    messages = TestSerialData.objects.exclude(msg_type__in=["BOOT_INFO", ""])
+    duplicated = (
+        messages.values(*MESSAGE_KEY)
+        .annotate(first_id=models.Min("id"), copies=models.Count("id"))
+        .filter(copies__gt=1)
+    )
+    for message in duplicated.iterator():
+        messages.filter(**{field: message[field] for field in MESSAGE_KEY}).exclude(
+            id=message["first_id"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0018_testserialdata_payload_type"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_messages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="testserialdata",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("msg_type__in", ["BOOT_INFO", ""]), _negated=True),
+                fields=MESSAGE_KEY,
+                name="unique_serial_data_message",
+            ),
+        ),
+    ]
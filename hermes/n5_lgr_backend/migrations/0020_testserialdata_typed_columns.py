@@ -0,0 +1,79 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+# The typed columns are added next to the text ones, 0021 fills them in and
+# 0022 replaces the text columns with them
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0019_testserialdata_unique_message"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="testserialdata",
+            name="unique_serial_data_message",
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="msg_type_typed",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="flags_typed",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="msg_gen_ts_typed",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="cell_id_ts_typed",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="actual_temp_typed",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="trumi_st_typed",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="trumi_st_upd_ts_typed",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="trumi_st_trans_count_typed",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="reloc_st_trans_count_typed",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="stored_st_trans_count_typed",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="pld_sz_typed",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testserialdata",
+            name="buffer_link_type_typed",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
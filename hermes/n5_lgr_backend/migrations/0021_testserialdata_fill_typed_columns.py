@@ -0,0 +1,151 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:10
+
+import binascii
+import struct
+from datetime import datetime, timezone
+
+from django.db import migrations, transaction
+
+# Rows converted per transaction
+BATCH_SIZE = 2000
+
+# The message header as the parser read it when the text columns were
+# converted, kept here so later parser changes do not change this migration.
+# Big-endian fields in message order, the payload word ends the header.
+HEADER_FIELDS = (
+    ("device_id", "6s"),
+    ("msg_type", "B"),
+    ("flags", "B"),
+    ("seq_num", "I"),
+    ("msg_gen_ts", "I"),
+    ("cell_id", "I"),
+    ("cell_id_ts", "I"),
+    ("actual_temp", "B"),
+    ("trumi_st", "B"),
+    ("trumi_st_upd_count", "H"),
+    ("trumi_st_upd_ts", "I"),
+    ("trumi_st_trans_count", "H"),
+    ("reloc_st_trans_count", "H"),
+    ("stored_st_trans_count", "H"),
+    ("wifi_aps", "18s"),
+    ("reserved_1", "H"),
+    ("pld_sz", "H"),
+    ("pld_crc", "H"),
+    ("buffer_link_type", "B"),
+    ("header_crc", "B"),
+    ("payload", "H"),
+)
+HEADER_STRUCT = struct.Struct(">" + "".join(code for _, code in HEADER_FIELDS))
+HEADER_HEX_SIZE = HEADER_STRUCT.size * 2
+HEADER_INDEX = {field: index for index, (field, _) in enumerate(HEADER_FIELDS)}
+MSG_TYPE_BOOT_INFO = 3
+# Logger timestamps count seconds from 2000-01-01
+LOGGER_EPOCH = 946684800
+# The text the timestamp columns were stored as
+TIMESTAMP_FORMAT = "%a %B %d, %Y %I:%M:%S %p"
+
+INTEGER_FIELDS = (
+    "msg_type",
+    "flags",
+    "trumi_st",
+    "trumi_st_trans_count",
+    "reloc_st_trans_count",
+    "stored_st_trans_count",
+    "pld_sz",
+    "buffer_link_type",
+)
+TIMESTAMP_FIELDS = ("msg_gen_ts", "cell_id_ts", "trumi_st_upd_ts")
+TYPED_FIELDS = [
+    f"{field}_typed" for field in INTEGER_FIELDS + TIMESTAMP_FIELDS + ("actual_temp",)
+]
+
+
+# A zero logger timestamp means the device has not set it
+def logger_datetime(logger_seconds):
+    if logger_seconds == 0:
+        return None
+
+    return datetime.fromtimestamp(logger_seconds + LOGGER_EPOCH, timezone.utc)
+
+
+# Degrees C from the header temperature byte, None when not measured
+def actual_temp_celsius(value):
+    if value == 255:
+        return None
+
+    return (value / 2) - 40
+
+
+# Timestamps stored as text by earlier versions, unparsed messages only have
+# their receive time in msg_gen_ts
+def text_datetime(text):
+    try:
+        return datetime.strptime(text, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+# The typed values come from the header still stored in data_msg, the text
+# columns were rendered from it
+def fill_typed_values(row):
+    for field in TYPED_FIELDS:
+        setattr(row, field, None)
+
+    if row.msg_type == "BOOT_INFO":
+        row.msg_type_typed = MSG_TYPE_BOOT_INFO
+        return
+
+    try:
+        header_values = HEADER_STRUCT.unpack(
+            binascii.unhexlify(row.data_msg[:HEADER_HEX_SIZE])
+        )
+    except (ValueError, struct.error):
+        row.msg_gen_ts_typed = text_datetime(row.msg_gen_ts)
+        return
+
+    for field in INTEGER_FIELDS:
+        setattr(
+            row,
+            f"{field}_typed",
+            header_values[HEADER_INDEX[field]],
+        )
+    for field in TIMESTAMP_FIELDS:
+        setattr(
+            row,
+            f"{field}_typed",
+            logger_datetime(header_values[HEADER_INDEX[field]]),
+        )
+    row.actual_temp_typed = actual_temp_celsius(
+        header_values[HEADER_INDEX["actual_temp"]]
+    )
+
+
+# One transaction per batch, so a large table is not converted in one
+def fill_typed_columns(apps, schema_editor):
+    TestSerialData = apps.get_model("n5_lgr_backend", "TestSerialData")
+    rows = TestSerialData.objects.order_by("id").only(
+        "id", "data_msg", "msg_type", "msg_gen_ts"
+    )
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(rows.filter(id__gt=last_id)[:BATCH_SIZE])
+            if not batch:
+                break
+            for row in batch:
+                fill_typed_values(row)
+            TestSerialData.objects.bulk_update(batch, TYPED_FIELDS)
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("n5_lgr_backend", "0020_testserialdata_typed_columns"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_typed_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0021_testserialdata_fill_typed_columns"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="msg_type",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="msg_type_typed",
+            new_name="msg_type",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="flags",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="flags_typed",
+            new_name="flags",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="msg_gen_ts",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="msg_gen_ts_typed",
+            new_name="msg_gen_ts",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="cell_id_ts",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="cell_id_ts_typed",
+            new_name="cell_id_ts",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="actual_temp",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="actual_temp_typed",
+            new_name="actual_temp",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="trumi_st",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="trumi_st_typed",
+            new_name="trumi_st",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="trumi_st_upd_ts",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="trumi_st_upd_ts_typed",
+            new_name="trumi_st_upd_ts",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="trumi_st_trans_count",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="trumi_st_trans_count_typed",
+            new_name="trumi_st_trans_count",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="reloc_st_trans_count",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="reloc_st_trans_count_typed",
+            new_name="reloc_st_trans_count",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="stored_st_trans_count",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="stored_st_trans_count_typed",
+            new_name="stored_st_trans_count",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="pld_sz",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="pld_sz_typed",
+            new_name="pld_sz",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="buffer_link_type",
+        ),
+        migrations.RenameField(
+            model_name="testserialdata",
+            old_name="buffer_link_type_typed",
+            new_name="buffer_link_type",
+        ),
+        migrations.AddConstraint(
+            model_name="testserialdata",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("msg_type__isnull", False),
+                    models.Q(("msg_type", 3), _negated=True),
+                ),
+                fields=("device_serial", "seq_num", "msg_gen_ts"),
+                name="unique_serial_data_message",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-17 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0022_testserialdata_replace_text_columns"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="testserialdata",
+            index=models.Index(
+                fields=["device_serial", "-create_at"],
+                name="serial_data_device_created",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testserialdata",
+            index=models.Index(
+                fields=["device_serial", "seq_num"], name="serial_data_device_seq"
+            ),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:40
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+# Rows copied per transaction
+BATCH_SIZE = 5000
+
+
+# Copy the bulky columns to the new table with INSERT ... SELECT, one id range
+# at a time
+def copy_payloads(apps, schema_editor):
+    TestSerialData = apps.get_model("n5_lgr_backend", "TestSerialData")
+    TestSerialPayload = apps.get_model("n5_lgr_backend", "TestSerialPayload")
+    quote_name = schema_editor.quote_name
+    insert_sql = (
+        f"INSERT INTO {quote_name(TestSerialPayload._meta.db_table)} "
+        "(serial_data_id, data_msg, payload, xyz_raw, payload_type) "
+        "SELECT id, data_msg, payload, xyz_raw, payload_type "
+        f"FROM {quote_name(TestSerialData._meta.db_table)} "
+        "WHERE id >= %s AND id < %s"
+    )
+
+    ids = TestSerialData.objects.aggregate(
+        first_id=models.Min("id"), last_id=models.Max("id")
+    )
+    if ids["first_id"] is None:
+        return
+
+    for start in range(ids["first_id"], ids["last_id"] + 1, BATCH_SIZE):
+        with transaction.atomic():
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute(insert_sql, [start, start + BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("n5_lgr_backend", "0023_testserialdata_device_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TestSerialPayload",
+            fields=[
+                (
+                    "serial_data",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="content",
+                        serialize=False,
+                        to="n5_lgr_backend.testserialdata",
+                    ),
+                ),
+                ("data_msg", models.CharField(max_length=2000)),
+                ("payload", models.CharField(max_length=8000)),
+                ("xyz_raw", models.CharField(max_length=8000)),
+                (
+                    "payload_type",
+                    models.CharField(
+                        blank=True, default=None, max_length=20, null=True
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(copy_payloads, migrations.RunPython.noop),
+    ]
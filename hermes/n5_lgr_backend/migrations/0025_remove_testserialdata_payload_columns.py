@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0024_testserialpayload"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="data_msg",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="payload",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="payload_type",
+        ),
+        migrations.RemoveField(
+            model_name="testserialdata",
+            name="xyz_raw",
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.1.7 on 2026-10-17 21:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0025_remove_testserialdata_payload_columns"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TestSerialSamples",
+            fields=[
+                (
+                    "serial_data",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="samples",
+                        serialize=False,
+                        to="n5_lgr_backend.testserialdata",
+                    ),
+                ),
+                ("start_ts", models.DateTimeField()),
+                ("end_ts", models.DateTimeField()),
+                ("sample_count", models.PositiveIntegerField()),
+                ("samples_per_frame", models.PositiveSmallIntegerField()),
+                ("xyz", models.BinaryField()),
+                ("timestamps", models.BinaryField()),
+                ("state", models.BinaryField(blank=True, null=True)),
+                (
+                    "device_serial",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="n5_lgr_backend.testdevice",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="testserialsamples",
+            index=models.Index(
+                fields=["device_serial", "start_ts"],
+                name="serial_samples_device_start",
+            ),
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 4.1.7 on 2026-10-17 21:40
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Q, Subquery
+import django.db.models.deletion
+
+MSG_TYPE_BOOT_INFO = 3
+# Summaries saved per transaction
+BATCH_SIZE = 1000
+# Values of the last generated message kept in the summary
+LAST_FIELDS = ("seq_num", "msg_gen_ts", "actual_temp", "trumi_st", "cell_id")
+
+
+# Summaries of the existing rows from aggregate queries: the device's messages
+# and when the last one arrived, the sequence numbers no message has between
+# its lowest and highest, as seq_gaps reports them, and the values of the
+# header message generated last
+def fill_summaries(apps, schema_editor):
+    TestDevice = apps.get_model("n5_lgr_backend", "TestDevice")
+    TestSerialData = apps.get_model("n5_lgr_backend", "TestSerialData")
+    DeviceSummary = apps.get_model("n5_lgr_backend", "DeviceSummary")
+
+    header = Q(msg_type__isnull=False) & ~Q(msg_type=MSG_TYPE_BOOT_INFO)
+    totals = {
+        total.pop("device_serial_id"): total
+        for total in TestSerialData.objects.order_by()
+        .values("device_serial_id")
+        .annotate(
+            message_count=Count("id"),
+            last_seen=Max("create_at"),
+            first_seq_num=Min("seq_num", filter=header),
+            last_seq_num=Max("seq_num", filter=header),
+            seq_nums=Count("seq_num", filter=header, distinct=True),
+        )
+    }
+    last_ids = dict(
+        TestDevice.objects.annotate(
+            last_id=Subquery(
+                TestSerialData.objects.filter(header, device_serial_id=OuterRef("pk"))
+                .order_by(F("msg_gen_ts").desc(nulls_last=True), "-id")
+                .values("id")[:1]
+            )
+        ).values_list("id", "last_id")
+    )
+    last_values = {
+        row.pop("id"): row
+        for row in TestSerialData.objects.filter(id__in=last_ids.values()).values(
+            "id", *LAST_FIELDS
+        )
+    }
+
+    summaries = []
+    for device_id, last_id in last_ids.items():
+        summary = DeviceSummary(device_id=device_id)
+        total = totals.get(device_id)
+        if total is not None:
+            summary.message_count = total["message_count"]
+            summary.last_seen = total["last_seen"]
+            if total["seq_nums"]:
+                summary.missing_count = (
+                    total["last_seq_num"]
+                    - total["first_seq_num"]
+                    + 1
+                    - total["seq_nums"]
+                )
+        if last_id is not None:
+            for field, value in last_values[last_id].items():
+                setattr(summary, f"last_{field}", value)
+        summaries.append(summary)
+
+    for start in range(0, len(summaries), BATCH_SIZE):
+        with transaction.atomic():
+            DeviceSummary.objects.bulk_create(summaries[start : start + BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("n5_lgr_backend", "0026_testserialsamples"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceSummary",
+            fields=[
+                (
+                    "device",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="n5_lgr_backend.testdevice",
+                    ),
+                ),
+                ("message_count", models.PositiveIntegerField(default=0)),
+                ("last_seen", models.DateTimeField(blank=True, null=True)),
+                ("missing_count", models.PositiveIntegerField(default=0)),
+                ("last_seq_num", models.IntegerField(blank=True, null=True)),
+                ("last_msg_gen_ts", models.DateTimeField(blank=True, null=True)),
+                ("last_actual_temp", models.FloatField(blank=True, null=True)),
+                (
+                    "last_trumi_st",
+                    models.PositiveSmallIntegerField(blank=True, null=True),
+                ),
+                (
+                    "last_cell_id",
+                    models.CharField(blank=True, default="", max_length=200),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
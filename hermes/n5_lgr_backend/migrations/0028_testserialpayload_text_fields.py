@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0027_devicesummary"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="testserialpayload",
+            name="data_msg",
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name="testserialpayload",
+            name="payload",
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name="testserialpayload",
+            name="xyz_raw",
+            field=models.TextField(),
+        ),
+    ]
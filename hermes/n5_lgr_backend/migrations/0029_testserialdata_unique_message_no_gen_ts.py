@@ -0,0 +1,55 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:41
+
+from django.db import migrations, models
+from django.db.models.functions import Greatest
+
+MSG_TYPE_BOOT_INFO = 3
+
+
+# Keep the first saved copy of each retransmitted message without a generation
+# time so the unique constraint can be added, as 0019 did when the time was
+# the text "No timestamp". The copies are taken off the device's summary.
+def delete_duplicate_messages(apps, schema_editor):
+    TestSerialData = apps.get_model("n5_lgr_backend", "TestSerialData")
+    DeviceSummary = apps.get_model("n5_lgr_backend", "DeviceSummary")
+    messages = TestSerialData.objects.filter(
+        msg_type__isnull=False, msg_gen_ts__isnull=True
+    ).exclude(msg_type=MSG_TYPE_BOOT_INFO)
+    duplicated = (
+        messages.values("device_serial", "seq_num")
+        .annotate(first_id=models.Min("id"), copies=models.Count("id"))
+        .filter(copies__gt=1)
+    )
+    for message in duplicated.iterator():
+        messages.filter(
+            device_serial=message["device_serial"],
+            seq_num=message["seq_num"],
+        ).exclude(id=message["first_id"]).delete()
+        DeviceSummary.objects.filter(device_id=message["device_serial"]).update(
+            message_count=Greatest(
+                models.F("message_count") - (message["copies"] - 1), 0
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("n5_lgr_backend", "0028_testserialpayload_text_fields"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_messages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="testserialdata",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("msg_type__isnull", False),
+                    models.Q(("msg_type", 3), _negated=True),
+                    ("msg_gen_ts__isnull", True),
+                ),
+                fields=("device_serial", "seq_num"),
+                name="unique_serial_data_message_no_gen_ts",
+            ),
+        ),
+    ]
@@ -1,5 +1,10 @@
 from django.db import models
 
+from .lib import ingest, parse_logger_msg, samples
+
+# Payload text of a message whose stored payload is malformed
+UNDECODABLE_PAYLOAD = "payload undecodable"
+
 
 class TestDevice(models.Model):
     serial = models.CharField(max_length=6, unique=True)
@@ -16,33 +21,306 @@ class TestDevice(models.Model):
 class TestSerialData(models.Model):
     device_serial = models.ForeignKey(TestDevice, on_delete=models.CASCADE)
     lgr_msg_ts = models.CharField(max_length=200)
-    data_msg = models.CharField(max_length=2000)
-    msg_type = models.CharField(max_length=200)
-    flags = models.CharField(max_length=50)
+    # Header fields hold the raw header values, the *_display properties give
+    # the text shown and exported. BOOT_INFO messages only have a msg_type,
+    # unparsed messages have none.
+    msg_type = models.PositiveSmallIntegerField(null=True, blank=True)
+    flags = models.PositiveSmallIntegerField(null=True, blank=True)
     seq_num = models.IntegerField()
-    msg_gen_ts = models.CharField(max_length=200)
+    msg_gen_ts = models.DateTimeField(null=True, blank=True)
     cell_id = models.CharField(max_length=200)
-    cell_id_ts = models.CharField(max_length=200)
-    actual_temp = models.CharField(max_length=5)
-    trumi_st = models.CharField(max_length=200)
+    cell_id_ts = models.DateTimeField(null=True, blank=True)
+    # Degrees C, None when the logger did not measure it
+    actual_temp = models.FloatField(null=True, blank=True)
+    trumi_st = models.PositiveSmallIntegerField(null=True, blank=True)
     trumi_st_upd_count = models.IntegerField()
-    trumi_st_upd_ts = models.CharField(max_length=200)
-    trumi_st_trans_count = models.CharField(max_length=50)
-    reloc_st_trans_count = models.CharField(max_length=50)
-    stored_st_trans_count = models.CharField(max_length=50)
+    trumi_st_upd_ts = models.DateTimeField(null=True, blank=True)
+    trumi_st_trans_count = models.PositiveIntegerField(null=True, blank=True)
+    reloc_st_trans_count = models.PositiveIntegerField(null=True, blank=True)
+    stored_st_trans_count = models.PositiveIntegerField(null=True, blank=True)
     wifi_aps = models.CharField(max_length=50)
-    pld_sz = models.CharField(max_length=50)
+    pld_sz = models.PositiveIntegerField(null=True, blank=True)
     pld_crc = models.CharField(max_length=10)
-    buffer_link_type = models.CharField(max_length=50)
+    buffer_link_type = models.PositiveSmallIntegerField(null=True, blank=True)
     header_crc = models.CharField(max_length=10)
-
-    payload = models.CharField(max_length=8000)
-    xyz_raw = models.CharField(max_length=8000)
+    # The raw message and payload are in TestSerialPayload, as `content`
     create_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         # Order the data by competition
         ordering = ("-create_at",)
+        # The pages and exports read one device's rows newest first, gap
+        # detection walks them by sequence number
+        indexes = [
+            models.Index(
+                fields=["device_serial", "-create_at"],
+                name="serial_data_device_created",
+            ),
+            models.Index(
+                fields=["device_serial", "seq_num"], name="serial_data_device_seq"
+            ),
+        ]
+        constraints = [
+            # A retransmitted message is only saved once, BOOT_INFO messages
+            # and unparsed ones have no sequence number
+            models.UniqueConstraint(
+                fields=["device_serial", "seq_num", "msg_gen_ts"],
+                condition=models.Q(msg_type__isnull=False)
+                & ~models.Q(msg_type=parse_logger_msg.MSG_TYPE_BOOT_INFO),
+                name="unique_serial_data_message",
+            ),
+            # NULLs are never equal in the constraint above, the messages of a
+            # device that has not set its clock are unique by sequence number
+            models.UniqueConstraint(
+                fields=["device_serial", "seq_num"],
+                condition=models.Q(msg_type__isnull=False)
+                & ~models.Q(msg_type=parse_logger_msg.MSG_TYPE_BOOT_INFO)
+                & models.Q(msg_gen_ts__isnull=True),
+                name="unique_serial_data_message_no_gen_ts",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.device_serial} - {self.seq_num} - {self.lgr_msg_ts}"
+
+    @property
+    def has_header(self):
+        return (
+            self.msg_type is not None
+            and self.msg_type != parse_logger_msg.MSG_TYPE_BOOT_INFO
+        )
+
+    @property
+    def msg_type_display(self):
+        if self.msg_type is None:
+            return ""
+        return parse_logger_msg.MSG_TYPE_TABLE[self.msg_type]
+
+    @property
+    def flags_display(self):
+        if self.flags is None:
+            return ""
+        return parse_logger_msg.FLAGS_TABLE[self.flags]
+
+    @property
+    def trumi_st_display(self):
+        if self.trumi_st is None:
+            return ""
+        # A link lost payload holds samples from several states
+        if self.buffer_link_type == parse_logger_msg.BUFFER_LINK_LOST:
+            return "VARIOUS"
+        return parse_logger_msg.TRUMI_ST_TABLE[self.trumi_st]
+
+    @property
+    def buffer_link_type_display(self):
+        if self.buffer_link_type is None:
+            return ""
+        return parse_logger_msg.BUFFER_LINK_TYPE_TABLE[self.buffer_link_type]
+
+    @property
+    def actual_temp_display(self):
+        if self.actual_temp is None:
+            return "n/a" if self.has_header else ""
+        return f"{self.actual_temp} C"
+
+    def timestamp_display(self, timestamp):
+        if timestamp is None:
+            return "No timestamp" if self.has_header else ""
+        return parse_logger_msg.format_timestamp(int(timestamp.timestamp()))
+
+    @property
+    def msg_gen_ts_display(self):
+        return self.timestamp_display(self.msg_gen_ts)
+
+    @property
+    def cell_id_ts_display(self):
+        return self.timestamp_display(self.cell_id_ts)
+
+    @property
+    def trumi_st_upd_ts_display(self):
+        return self.timestamp_display(self.trumi_st_upd_ts)
+
+    def decode_payload(self):
+        TestSerialData.decode_payloads([self])
+
+    @classmethod
+    def decode_payloads(cls, items):
+        # Decode the payloads stored undecoded at ingest and save the result,
+        # so each payload is only decoded once. Contents not loaded with the
+        # items are fetched in one query. A payload that cannot be decoded is
+        # shown as UNDECODABLE_PAYLOAD and left undecoded.
+        items = list(items)
+        models.prefetch_related_objects(items, "content")
+        decoded = []
+        sample_rows = []
+        for item in items:
+            if item.content.payload_type is None:
+                continue
+            try:
+                payload, xyz_raw, sample_fields = ingest.render_payload(
+                    item.content.data_msg,
+                    item.content.payload_type,
+                    {
+                        "msg_type": item.msg_type_display,
+                        "trumi_st": item.trumi_st_display,
+                    },
+                )
+            except parse_logger_msg.PAYLOAD_ERRORS:
+                item.content.payload = UNDECODABLE_PAYLOAD
+                continue
+
+            item.content.payload = payload
+            item.content.xyz_raw = xyz_raw
+            item.content.payload_type = None
+            decoded.append(item)
+            if sample_fields is not None:
+                sample_rows.append(
+                    TestSerialSamples(
+                        serial_data=item,
+                        device_serial_id=item.device_serial_id,
+                        **sample_fields,
+                    )
+                )
+
+        if decoded:
+            TestSerialPayload.objects.bulk_update(
+                [item.content for item in decoded],
+                ["payload", "xyz_raw", "payload_type"],
+                batch_size=500,
+            )
+            TestSerialSamples.objects.bulk_create(
+                sample_rows, batch_size=500, ignore_conflicts=True
+            )
+
+
+# The bulky part of a TestSerialData row, kept apart so that device scans
+# read short rows. Loaded only when a row is shown expanded or exported.
+class TestSerialPayload(models.Model):
+    serial_data = models.OneToOneField(
+        TestSerialData,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="content",
+    )
+    data_msg = models.TextField()
+    payload = models.TextField()
+    xyz_raw = models.TextField()
+    # Set when the payload was stored undecoded, the parser payload type to
+    # decode it from data_msg the first time it is needed
+    payload_type = models.CharField(max_length=20, null=True, blank=True, default=None)
+
+    def __str__(self):
+        return str(self.serial_data_id)
+
+
+# The accelerometer samples of a message packed into little-endian arrays,
+# see lib.samples, which loads them back as NumPy arrays for a device and
+# time range. Messages without samples have no row.
+class TestSerialSamples(models.Model):
+    serial_data = models.OneToOneField(
+        TestSerialData,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="samples",
+    )
+    device_serial = models.ForeignKey(TestDevice, on_delete=models.CASCADE)
+    # First and last frame timestamps
+    start_ts = models.DateTimeField()
+    end_ts = models.DateTimeField()
+    sample_count = models.PositiveIntegerField()
+    samples_per_frame = models.PositiveSmallIntegerField()
+    xyz = models.BinaryField()
+    timestamps = models.BinaryField()
+    # Trumi state of each frame, link lost payloads only
+    state = models.BinaryField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["device_serial", "start_ts"],
+                name="serial_samples_device_start",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.serial_data_id} - {self.sample_count} samples"
+
+    @property
+    def arrays(self):
+        return samples.DeviceSamples.from_rows(
+            [
+                (
+                    self.serial_data_id,
+                    self.sample_count,
+                    self.samples_per_frame,
+                    self.xyz,
+                    self.timestamps,
+                    self.state,
+                )
+            ]
+        )
+
+
+# Totals and latest values of a device, kept up to date by ingest in the same
+# transaction as the rows, see lib.device_summary. Pages and device lists
+# read them instead of counting or scanning TestSerialData.
+class DeviceSummary(models.Model):
+    device = models.OneToOneField(
+        TestDevice,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="summary",
+    )
+    message_count = models.PositiveIntegerField(default=0)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    # Sequence numbers skipped between consecutive messages, less the late
+    # messages that filled a gap since. Retention leaves it as it is.
+    missing_count = models.PositiveIntegerField(default=0)
+    # Values of the last generated message with a header
+    last_seq_num = models.IntegerField(null=True, blank=True)
+    last_msg_gen_ts = models.DateTimeField(null=True, blank=True)
+    last_actual_temp = models.FloatField(null=True, blank=True)
+    last_trumi_st = models.PositiveSmallIntegerField(null=True, blank=True)
+    last_cell_id = models.CharField(max_length=200, blank=True, default="")
+
+    def __str__(self):
+        return f"{self.device_id} - {self.message_count} messages"
+
+    # Count a saved message, messages are added in the order they arrived
+    def add(self, item):
+        self.message_count += 1
+        if self.last_seen is None or item.create_at > self.last_seen:
+            self.last_seen = item.create_at
+        if not item.has_header:
+            return
+
+        # A message generated before the last one arrived late, filling a gap.
+        # Without generation times a lower sequence number tells
+        if item.msg_gen_ts is not None and self.last_msg_gen_ts is not None:
+            late = item.msg_gen_ts < self.last_msg_gen_ts
+        else:
+            late = self.last_seq_num is not None and item.seq_num < self.last_seq_num
+        if late:
+            if item.seq_num < self.last_seq_num:
+                self.missing_count = max(self.missing_count - 1, 0)
+            return
+
+        if self.last_seq_num is not None and item.seq_num > self.last_seq_num + 1:
+            self.missing_count += item.seq_num - self.last_seq_num - 1
+        self.last_seq_num = item.seq_num
+        self.last_msg_gen_ts = item.msg_gen_ts
+        self.last_actual_temp = item.actual_temp
+        self.last_trumi_st = item.trumi_st
+        self.last_cell_id = item.cell_id
+
+    @property
+    def last_trumi_st_display(self):
+        if self.last_trumi_st is None:
+            return ""
+        return parse_logger_msg.TRUMI_ST_TABLE[self.last_trumi_st]
+
+    @property
+    def last_actual_temp_display(self):
+        if self.last_actual_temp is None:
+            return "n/a"
+        return f"{self.last_actual_temp} C"
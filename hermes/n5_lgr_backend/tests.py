@@ -1,3 +1,1261 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db import DataError, OperationalError, connection
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import views
+from .lib import (
+    corpus,
+    dedup,
+    export,
+    ingest,
+    metrics,
+    mqtt,
+    mqtt_broker,
+    parse_logger_msg,
+    parse_pool,
+    pg_copy,
+    retention,
+    samples,
+    seq_gaps,
+)
+from .lib.device_cache import device_cache
+from .models import (
+    UNDECODABLE_PAYLOAD,
+    DeviceSummary,
+    TestDevice,
+    TestSerialData,
+    TestSerialPayload,
+    TestSerialSamples,
+)
+
+# The sample messages of parse_logger_msg, the last one Rice compressed
+SAMPLE_MESSAGES = (
+    "Mon Jul 15 10:21:42 2024 : Msg: "
+    "54415450414a000c0000001f2e27b4ae0015055b2e27b3a47c0112b72e27afe0000100000002489b"
+    "d5f8df60489bd5f8df61489bd5f8df62000001185a3c0050a0b3272ec6ff1800bd03aab3272ec4ff"
+    "1800be03b4b3272ec3ff1800bc03beb3272ec4ff1700bc03c8b3272ec4ff1900be03d2b3272ec3ff"
+    "1a00be03dcb3272ec4ff1900bf03e6b3272ec6ff1a00c103f0b3272ec3ff1900bf03fab3272ec6ff"
+    "1700bd0304b4272ec5ff1700bd030eb4272ec4ff1800bf0318b4272ec4ff1c00bb0322b4272ec4ff"
+    "1800bd032cb4272ec4ff1900c10336b4272ec7ff1b00bd0340b4272ec6ff1a00c0034ab4272ec4ff"
+    "1800be0354b4272ec5ff1a00bf035eb4272ec5ff1900be0368b4272ec7ff1900be0372b4272ec6ff"
+    "1c00bf037cb4272ec6ff1800bf0386b4272ec3ff1800be0390b4272ec5ff1900bf039ab4272ec4ff"
+    "1800bf03a4b4272ec4ff1800bf03aeb4272e8bffb8ffd403",
+    "Mon Jul  8 15:48:48 2024 : Msg: "
+    "484557474850000c000000022e1ec6df022f2bcf2e1ec6678a01000f2e1ec6840000000000010000"
+    "000000000000000000000000000000000000000a7c3d007edfc61e2e5cffe90081fc",
+    "Mon Jul 8 15:57:05 2024 : Msg: "
+    "484557474850001a000000962e1ec8cd022f2bcf2e1ec667ff026f0f2e1ec6df000100000001ffff"
+    "ffffffffffffffffffffffffffffffff000003a5e012004697cac81e2e070f23ffedb8791fff6fc3"
+    "48fffb7e1a47ffdbd0d23ffedd8690fff6e43487ffb721a43ffdb70b23ffedb8591fff6dc348fffb"
+    "721a47ffdbd0f23ffee08991fff70c4c8fffb862a4bffdc11527ffee08549fffb861327ffee284c9"
+    "fffb8e1325ffee384497ffb8e1125ffee38448fffb8a1121ffee284c8fffb8a1325ffee184c9fffb"
+    "7e1327ffedd84c9fffb761125ffedc83c8fffb6e96cbc81e2e07152bffee28892fff70c4497ffb82"
+    "264bffdc11327ffee18993fff714224fffdc70894fff71c264fffdc90892fff72c1e47ffdc90791f"
+    "ff7143c97ffb861a4fffdc10d27ffedf8793fff6ec3c9fffb721e53ffdb70f27ffedb8793fff6d44"
+    "497ffb6a1e47ffdb50f23ffeda8791fff6d43c9fffb6a1e4fffdb71125ffedc8992fff6fc549fffb"
+    "862a57ffdc50a96fff70c2a57ffdc595cbc81e2e070f27ffee18593fff7042ca7ffb86124fffdc50"
+    "927ffee28593fff70c2c9fffb82164fffdc10b25ffee18592fff7042c8fffb7a1647ffdbb0925ffe"
+    "dd8493fff6e4249fffb66164fffdb30d27ffed98692fff6cc2c97ffb661643ffdb50b21ffedb8590"
+    "fff6e4348fffb721a4bffdbb0d25ffede8591fff704348fffb861a47ffdc30d25ffee38693fff71c"
+    "349fffb8a1e4fffdc397ccc81e2e071127ffedc8893fff6ec449fffb76224fffdbb1123ffedc8891"
+    "fff6e42647ffdb90a92fff6e4264fffdbd0894fff6fc2257ffdc10994fff70c264fffdc50993fff7"
+    "1c2a4fffdc70a92fff71c2a47ffdc50991fff714224bffdc30792fff70c1e4bffdc30d25ffee0879"
+    "3fff6fc449fffb7a264bffdbb1125ffedc8792fff6e43c8fffb722247ffdb71125ffedb8892fff6d"
+    "c449fffb7298ccc81e2e071129ffee28891fff70c4c8fffb8a264fffdc71329ffee48894fff72422"
+    "4fffdc70892fff7141e47ffdc30790fff704348fffb7a1a47ffdbb0d23ffede8791fff6fc4497ffb"
+    "7a2247ffdbb1323ffedd8992fff6ec224fffdbb0992fff6f4264bffdbf0993fff6f4264fffdbf099"
+    "3fff70c264fffdc50993fff714264bffdc70992fff71c2a4bffdc70991fff714264fffdc50894fff"
+    "714096cdc81e2e07111fffedd8892fff6e4449fffb72224bffdb91123ffedc8892fff6e4224bffdb"
+    "90892fff6ec224bffdbd0792fff6fc1e47ffdbf0f23ffee08692fff70c3c97ffb8a1e4fffdc70f25"
+    "ffee38791fff71c3c97ffb8a1e4bffdc51125ffee18791fff704348fffb7e1a4bffdbd0f25ffedd8"
+    "791fff6ec348fffb721e43ffdb70f21ffeda8790fff6d43c7fffb6e223fffdb9111fffedd8",
+)
+# parse_msg output of the baseline parser for SAMPLE_MESSAGES, timestamps as
+# their display text and the payload text and raw hex as sha256 digests
+BASELINE_PARSED = (
+    {
+        "lgr_msg_ts": "Mon Jul 15 10:21:42 2024",
+        "xyz_raw": "383ea75c6a29081e6f737b1a42503491b4d2d4249221158b1e452808359eef9c",
+        "device_id": "TATPAJ",
+        "msg_type": "SIGFOX_UPLINK",
+        "flags": (
+            "Trumi Sample Rate: TRUMI_NEXT_EXEC_IN_10S\n"
+            "Trumi Acc Mode: TRUMI_ACC_SINGLE_SAMPLE\n"
+        ),
+        "seq_num": 31,
+        "msg_gen_ts": "Mon July 15, 2024 10:21:34 AM",
+        "cell_id": "0015055b",
+        "cell_id_ts": "Mon July 15, 2024 10:17:08 AM",
+        "actual_temp": "22.0 C",
+        "trumi_st": "TRUMI_STATE_SLEEP",
+        "trumi_st_upd_count": 4791,
+        "trumi_st_upd_ts": "Mon July 15, 2024 10:01:04 AM",
+        "trumi_st_trans_count": 1,
+        "reloc_st_trans_count": 0,
+        "stored_st_trans_count": 2,
+        "wifi_aps": "489bd5f8df60489bd5f8df61489bd5f8df62",
+        "reserved_1": 0,
+        "pld_sz": 280,
+        "pld_crc": "5a3c",
+        "buffer_link_type": "Link Ok",
+        "header_crc": "50",
+        "payload": "a69cbeaf4dfc3ccaa5a0bcf0c54c9f847f1e53abc6212ecfa3ce740c7f38f238",
+    },
+    {
+        "lgr_msg_ts": "Mon Jul  8 15:48:48 2024",
+        "xyz_raw": "566418ce49aa7aa3398a3be0f58579d25a760223d632a716c42361f2543683dd",
+        "device_id": "HEWGHP",
+        "msg_type": "SIGFOX_UPLINK",
+        "flags": (
+            "Trumi Sample Rate: TRUMI_NEXT_EXEC_IN_10S\n"
+            "Trumi Acc Mode: TRUMI_ACC_SINGLE_SAMPLE\n"
+        ),
+        "seq_num": 2,
+        "msg_gen_ts": "Mon July 08, 2024 03:48:47 PM",
+        "cell_id": "022f2bcf",
+        "cell_id_ts": "Mon July 08, 2024 03:46:47 PM",
+        "actual_temp": "29.0 C",
+        "trumi_st": "TRUMI_STATE_SLEEP",
+        "trumi_st_upd_count": 15,
+        "trumi_st_upd_ts": "Mon July 08, 2024 03:47:16 PM",
+        "trumi_st_trans_count": 0,
+        "reloc_st_trans_count": 0,
+        "stored_st_trans_count": 1,
+        "wifi_aps": "000000000000000000000000000000000000",
+        "reserved_1": 0,
+        "pld_sz": 10,
+        "pld_crc": "7c3d",
+        "buffer_link_type": "Link Ok",
+        "header_crc": "7e",
+        "payload": "9d9ff1aa5f8d962f870380b43071b88343cc02108ff13ba36e3edda7ff22a2c3",
+    },
+    {
+        "lgr_msg_ts": "Mon Jul 8 15:57:05 2024",
+        "xyz_raw": "f8ec30f6dcb7e2cea1917ca7f0a468876c59823e09782aee49ec11df51fb72a5",
+        "device_id": "HEWGHP",
+        "msg_type": "SIGFOX_UPLINK",
+        "flags": (
+            "Trumi Sample Rate: TRUMI_NEXT_EXEC_IN_500MS\n"
+            "Trumi Acc Mode: TRUMI_ACC_1600HZ\n"
+        ),
+        "seq_num": 150,
+        "msg_gen_ts": "Mon July 08, 2024 03:57:01 PM",
+        "cell_id": "022f2bcf",
+        "cell_id_ts": "Mon July 08, 2024 03:46:47 PM",
+        "actual_temp": "n/a",
+        "trumi_st": "TRUMI_STATE_MOTION_DETECTION",
+        "trumi_st_upd_count": 28431,
+        "trumi_st_upd_ts": "Mon July 08, 2024 03:48:47 PM",
+        "trumi_st_trans_count": 1,
+        "reloc_st_trans_count": 0,
+        "stored_st_trans_count": 1,
+        "wifi_aps": "ffffffffffffffffffffffffffffffffffff",
+        "reserved_1": 0,
+        "pld_sz": 933,
+        "pld_crc": "e012",
+        "buffer_link_type": "Link Ok",
+        "header_crc": "46",
+        "payload": "aedcc30f4fae057f152d931f37cf9b97bb0b2196b0f82192176348e5f7b04295",
+    },
+)
+
+
+# Corpus log lines of one device, with sequence numbers from 1
+def device_messages(serial, count):
+    return corpus.generate_messages(count, device_ids=(serial,))
+
+
+# The log lines as sent by a device that has not set its clock, with a zero
+# generation time. Boot info messages have no generation time to zero
+def without_generation_time(lines):
+    start, end = (
+        offset * 2 for offset in parse_logger_msg.HEADER_OFFSETS["msg_gen_ts"]
+    )
+    zeroed = "0" * (end - start)
+    unclocked = []
+    for line in lines:
+        if dedup.message_key(line) is None:
+            unclocked.append(line)
+            continue
+        msg_start = line.index(dedup.MSG_MARKER) + len(dedup.MSG_MARKER)
+        unclocked.append(line[: msg_start + start] + zeroed + line[msg_start + end :])
+    return unclocked
+
+
+# Parse and save log lines as ingest does, returns the rows saved
+def save_messages(lines):
+    return ingest.save_parsed_msgs(ingest.parse_messages(lines))
+
+
+# Rows of `device` with the given sequence numbers, blank header text and an
+# empty payload row each
+def create_rows(device, seq_nums, **fields):
+    rows = TestSerialData.objects.bulk_create(
+        TestSerialData(
+            device_serial=device,
+            lgr_msg_ts="Mon Jul 08 15:57:05 2024",
+            seq_num=seq_num,
+            cell_id="",
+            trumi_st_upd_count=0,
+            wifi_aps="",
+            pld_crc="",
+            header_crc="",
+            **fields,
+        )
+        for seq_num in seq_nums
+    )
+    TestSerialPayload.objects.bulk_create(
+        TestSerialPayload(serial_data=row, data_msg="", payload="", xyz_raw="")
+        for row in rows
+    )
+    return rows
+
+
+def counter_total(name):
+    return sum(
+        value
+        for (counter, _), value in metrics.metrics.counters.items()
+        if counter == name
+    )
+
+
+class ParserTests(SimpleTestCase):
+    # parse_msg gives what the baseline parser did, with the timestamps as
+    # epoch seconds
+    def test_parse_msg_matches_baseline(self):
+        for message, expected in zip(SAMPLE_MESSAGES, BASELINE_PARSED):
+            with self.subTest(message=message[:40]):
+                parsed = parse_logger_msg.parser.parse_msg(message)
+                for field in ("msg_gen_ts", "cell_id_ts", "trumi_st_upd_ts"):
+                    parsed[field] = parse_logger_msg.format_timestamp(parsed[field])
+                for field in ("payload", "xyz_raw"):
+                    parsed[field] = hashlib.sha256(parsed[field].encode()).hexdigest()
+                self.assertEqual({field: parsed[field] for field in expected}, expected)
+
+    # A value cut short at the end of a payload is read as the baseline did,
+    # one byte of it as a signed byte
+    def test_truncated_payload(self):
+        msg_data = SAMPLE_MESSAGES[0].split(" : Msg: ")[1]
+        payload_end = parse_logger_msg.PAYLOAD_POS + 30
+        parsed = parse_logger_msg.parser.parse_msg(
+            SAMPLE_MESSAGES[0][: -len(msg_data)] + msg_data[:payload_end]
+        )
+        self.assertEqual(
+            parsed["payload"].splitlines()[2:],
+            [
+                "[1] X: -58 Y: 24 Z: 957, Mon July 15, 2024 10:17:04 AM,",
+                "[2] X: -60 Y: 0 Z: 0, Mon July 15, 2024 10:17:14 AM,",
+                "",
+            ],
+        )
+
+        link_lost = parse_logger_msg.parser.parse_xyz_payload(
+            msg_data[: parse_logger_msg.PAYLOAD_POS + 22], "link_lost_mode"
+        )
+        self.assertEqual(link_lost.xyz.tolist(), [[24, 957, -86]])
+        link_lost = parse_logger_msg.parser.parse_xyz_payload(
+            msg_data[: parse_logger_msg.PAYLOAD_POS + 10], "link_lost_mode"
+        )
+        self.assertEqual(link_lost.state.tolist(), [-58])
+
+    # The library's FIFO loop decodes as the loop over Rice_Uncompress does,
+    # also a payload cut inside its last FIFO
+    def test_native_fifo_decompression(self):
+        parser = parse_logger_msg.parser
+        dll = parse_logger_msg.load_rice_library()
+        self.assertTrue(hasattr(dll, "Rice_UncompressFifos"))
+
+        payloads = []
+        for message in corpus.generate_messages(200):
+            parsed = parser.parse_msg(message, decode_payload=False)
+            if parsed["payload_type"] == "decompress_payload":
+                payloads.append(parsed["data_msg"][parse_logger_msg.PAYLOAD_POS :])
+        payloads.append(payloads[0][:-10])
+
+        for payload in payloads:
+            native = parser._decompress_payload(payload)
+            payload_data = bytes.fromhex(payload)
+            output_buffer = np.zeros(
+                (len(payload_data) // 5) * parse_logger_msg.RICE_FIFO_FRAME_SIZE,
+                dtype=np.uint8,
+            )
+            fifo_count, fifo_error = parser._decompress_fifos(
+                dll, payload_data, output_buffer
+            )
+            self.assertEqual(
+                native["decomp_payload"].tobytes(),
+                output_buffer[
+                    : fifo_count * parse_logger_msg.RICE_FIFO_FRAME_SIZE
+                ].tobytes(),
+            )
+            self.assertEqual(bool(native["fifo_error"]), fifo_error)
+        self.assertTrue(native["fifo_error"])
+
+    def test_library_without_fifo_loop_logged_once(self):
+        library = mock.NonCallableMock(spec=["Rice_Uncompress", "Rice_Compress"])
+        parse_logger_msg.load_rice_library.cache_clear()
+        try:
+            with mock.patch("ctypes.CDLL", return_value=library), mock.patch(
+                "builtins.print"
+            ) as print_:
+                parse_logger_msg.load_rice_library()
+                parse_logger_msg.load_rice_library()
+        finally:
+            parse_logger_msg.load_rice_library.cache_clear()
+        print_.assert_called_once()
+        self.assertIn("Rice_UncompressFifos", print_.call_args.args[0])
+
+
+@skipUnless(connection.vendor == "sqlite", "Checks SQLite query plans")
+class DeviceQueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for serial in ("HEWGHP", "TATPAJ"):
+            create_rows(TestDevice.objects.create(serial=serial), range(1, 121))
+
+    def setUp(self):
+        # The page view is cached
+        cache.clear()
+
+    # Query plans of the TestSerialData selects the view runs
+    def view_query_plans(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = views.backend(request)
+            # Exports read the rows as they are streamed
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query["sql"]
+                if sql.startswith("SELECT") and "n5_lgr_backend_testserialdata" in sql:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                    plans.append(
+                        (sql, "\n".join(row[-1] for row in cursor.fetchall()))
+                    )
+
+        self.assertTrue(plans)
+        return plans
+
+    def assert_device_index_scans(self, plans):
+        for sql, plan in plans:
+            with self.subTest(sql=sql):
+                self.assertNotIn("SCAN n5_lgr_backend_testserialdata", plan)
+                if " OVER (" in sql:
+                    # The page rows are picked on the device index, then
+                    # looked up by id and only they are sorted
+                    self.assertIn("serial_data_device_created", plan)
+                    self.assertIn("USING INTEGER PRIMARY KEY", plan)
+                    continue
+                self.assertNotIn("TEMP B-TREE", plan)
+                if "ORDER BY" in sql:
+                    self.assertIn("serial_data_device_created", plan)
+
+    def test_page_uses_device_created_index(self):
+        request = RequestFactory().get("/", {"page": 2, "serial": "TATPAJ"})
+        self.assert_device_index_scans(self.view_query_plans(request))
+
+    def test_first_device_page_uses_device_created_index(self):
+        request = RequestFactory().get("/")
+        self.assert_device_index_scans(self.view_query_plans(request))
+
+    def test_export_uses_device_created_index(self):
+        request = RequestFactory().post(
+            "/", {"serials": "TATPAJ", "exportData": "Export"}
+        )
+        self.assert_device_index_scans(self.view_query_plans(request))
+
+    def test_seq_num_order_uses_device_seq_index(self):
+        queryset = TestSerialData.objects.filter(
+            device_serial__serial="TATPAJ"
+        ).order_by("seq_num")
+        plan = queryset.explain()
+        self.assertIn("serial_data_device_seq", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class SeqGapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = TestDevice.objects.create(serial="GAPDEV")
+        create_rows(
+            cls.device,
+            [
+                seq_num
+                for seq_num in range(1, 121)
+                if seq_num != 67 and not 90 <= seq_num <= 92
+            ],
+            msg_type=0,
+        )
+        cls.message_data = TestSerialData.objects.filter(device_serial=cls.device)
+
+    def page_flags(self, number):
+        page_obj = Paginator(self.message_data, 50).get_page(number)
+        return [
+            (row.seq_num, row.is_incremental)
+            for row in seq_gaps.page_rows(self.message_data, page_obj)
+        ]
+
+    def test_first_page_flags(self):
+        flags = self.page_flags(1)
+        self.assertEqual(len(flags), 50)
+        self.assertEqual(flags[0], (120, True))
+        self.assertEqual(
+            [seq_num for seq_num, incremental in flags if not incremental], [89]
+        )
+
+    def test_gap_at_page_boundary(self):
+        # Page 1 ends at 68, the row before page 2 gives 66 its gap
+        flags = self.page_flags(2)
+        self.assertEqual(flags[0], (66, False))
+        self.assertTrue(all(incremental for _, incremental in flags[1:]))
+
+    def test_missing_ranges(self):
+        self.assertEqual(
+            seq_gaps.missing_ranges(self.device.id), [(67, 67), (90, 92)]
+        )
+
+
+# Payloads are left undecoded at ingest, the export decodes them
+@override_settings(N5_LAZY_PAYLOAD_DECODE=True, N5_INGEST_STORE_SAMPLES=False)
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        save_messages(device_messages("EXPAAA", 80))
+        cls.message_data = TestSerialData.objects.filter(
+            device_serial__serial="EXPAAA"
+        )
+
+    def export(self, **headers):
+        request = RequestFactory().post(
+            "/", {"serials": "EXPAAA", "exportData": "Export"}, **headers
+        )
+        response = views.backend(request)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content)
+
+    def test_export_in_chunks(self):
+        with override_settings(N5_EXPORT_CHUNK_SIZE=7):
+            response, content = self.export()
+        self.assertNotIn("Content-Encoding", response)
+        lines = content.decode().splitlines()
+        self.assertEqual(lines[0], "| ".join(export.HEADER))
+        self.assertEqual(len(lines), self.message_data.count() + 1)
+        self.assertEqual(
+            [int(line.split("|")[0]) for line in lines[1:]],
+            list(self.message_data.values_list("seq_num", flat=True)),
+        )
+        # Decoded once, on the first export
+        self.assertFalse(
+            TestSerialPayload.objects.filter(
+                serial_data__in=self.message_data, payload_type__isnull=False
+            ).exists()
+        )
+        self.assertEqual("".join(export.export_lines(self.message_data)), content.decode())
+
+    # Not stored at ingest, the samples are packed when the payloads are decoded
+    def test_samples_stored_when_decoded(self):
+        samples = TestSerialSamples.objects.filter(device_serial__serial="EXPAAA")
+        self.assertFalse(samples.exists())
+        self.export()
+        self.assertEqual(
+            set(samples.values_list("serial_data_id", flat=True)),
+            set(
+                self.message_data.filter(
+                    content__payload__regex=r"^[1-9][0-9]* accelerometer samples"
+                ).values_list("id", flat=True)
+            ),
+        )
+
+    def test_gzip_export(self):
+        _, content = self.export()
+        response, gzipped = self.export(HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(gzipped), content)
+
+        with override_settings(N5_EXPORT_GZIP=False):
+            response, _ = self.export(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", response)
+
+
+# Saving the message `poison` fails with `error`, as a value PostgreSQL
+# cannot store fails the whole batch
+def poisoned(poison, error=DataError("value too long for type character varying")):
+    serial_data_fields = ingest.serial_data_fields
+
+    def fields(parsed_msg):
+        if parsed_msg["data_msg"] == poison.split(": ")[-1]:
+            raise error
+        return serial_data_fields(parsed_msg)
+
+    return mock.patch.object(ingest, "serial_data_fields", fields)
+
+
+class MalformedMessageTests(TestCase):
+    # Messages of one device, the third cut to an odd number of hex digits
+    def messages(self, serial):
+        lines = device_messages(serial, 10)
+        lines[2] = lines[2][:-1]
+        return lines
+
+    # Only the message that cannot be saved is lost from a batch
+    def test_unsaveable_message_rejected(self):
+        lines = self.messages("BADSAV")
+        rejected = counter_total("n5_ingest_rejected_total")
+        with poisoned(lines[5]):
+            saved = ingest.IngestWriter().write([(0, line) for line in lines])
+
+        self.assertTrue(saved)
+        self.assertEqual(
+            TestSerialData.objects.filter(device_serial__serial="BADSAV").count(),
+            len(lines) - 1,
+        )
+        self.assertEqual(counter_total("n5_ingest_rejected_total"), rejected + 1)
+
+    def test_undecodable_payload_saved_without_it(self):
+        for lazy in (True, False):
+            serial = "BADLZY" if lazy else "BADEGR"
+            with self.subTest(lazy=lazy), override_settings(
+                N5_LAZY_PAYLOAD_DECODE=lazy, N5_INGEST_STORE_SAMPLES=True
+            ):
+                errors = counter_total("n5_ingest_payload_errors_total")
+                lines = self.messages(serial)
+                saved = save_messages(lines)
+
+                self.assertEqual(saved, len(lines))
+                self.assertEqual(
+                    counter_total("n5_ingest_payload_errors_total"), errors + 1
+                )
+                bad = TestSerialPayload.objects.get(data_msg=lines[2].split(": ")[-1])
+                self.assertEqual(bad.payload, "")
+                self.assertIsNotNone(bad.payload_type)
+                self.assertFalse(hasattr(bad.serial_data, "samples"))
+
+    # A stored payload that cannot be decoded is shown with a marker on the
+    # page and in the export, and stays undecoded
+    @override_settings(N5_LAZY_PAYLOAD_DECODE=True, N5_INGEST_STORE_SAMPLES=False)
+    def test_undecodable_payload_displayed(self):
+        lines = self.messages("BADVEW")
+        save_messages(lines)
+        cache.clear()
+
+        response = views.backend(
+            RequestFactory().get("/", {"page": 1, "serial": "BADVEW"})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, UNDECODABLE_PAYLOAD, count=1)
+
+        response = views.backend(
+            RequestFactory().post("/", {"serials": "BADVEW", "exportData": "Export"})
+        )
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), len(lines) + 1)
+        self.assertEqual(content.count(UNDECODABLE_PAYLOAD), 1)
+        self.assertEqual(
+            TestSerialPayload.objects.filter(
+                serial_data__device_serial__serial="BADVEW",
+                payload_type__isnull=False,
+            ).count(),
+            1,
+        )
+
+
+# Retransmits are saved once, also from a device that has not set its clock
+class DuplicateMessageTests(TestCase):
+    def test_retransmit_without_generation_time(self):
+        lines = without_generation_time(device_messages("NOCLCK", 5))
+        saved = save_messages(lines)
+        duplicates = counter_total("n5_ingest_duplicates_total")
+        saved_again = save_messages(lines)
+
+        self.assertEqual((saved, saved_again), (5, 0))
+        self.assertEqual(counter_total("n5_ingest_duplicates_total"), duplicates + 5)
+        rows = TestSerialData.objects.filter(device_serial__serial="NOCLCK")
+        self.assertEqual(rows.count(), 5)
+        self.assertFalse(rows.filter(msg_gen_ts__isnull=False).exists())
+
+
+# Payloads are left undecoded, the summaries only need the headers
+@override_settings(N5_LAZY_PAYLOAD_DECODE=True, N5_INGEST_STORE_SAMPLES=False)
+class DeviceSummaryTests(TestCase):
+    def test_late_messages_fill_gaps(self):
+        self.check_late_messages("SUMAAA", "SUMBBB", lambda lines: lines)
+
+    # Without a generation time a lower sequence number tells a late message
+    def test_late_messages_without_generation_time(self):
+        self.check_late_messages("SUMCCC", "SUMDDD", without_generation_time)
+
+    # Messages saved with two arriving late end with the summary of the same
+    # messages saved in order
+    def check_late_messages(self, expected_serial, serial, transform):
+        in_order = transform(device_messages(expected_serial, 60))
+        late = transform(device_messages(serial, 60))
+        # Two messages with sequence numbers, neither the last
+        late_indexes = [
+            index
+            for index, line in enumerate(late[:-1])
+            if dedup.message_key(line) is not None
+        ][10:12]
+
+        save_messages(in_order)
+        save_messages(
+            [line for index, line in enumerate(late) if index not in late_indexes]
+        )
+        expected = DeviceSummary.objects.get(device__serial=expected_serial)
+        summary = DeviceSummary.objects.get(device__serial=serial)
+        self.assertEqual(summary.message_count, expected.message_count - 2)
+        self.assertEqual(summary.missing_count, expected.missing_count + 2)
+
+        save_messages([late[index] for index in late_indexes])
+        summary.refresh_from_db()
+        self.assertEqual(summary.message_count, expected.message_count)
+        self.assertEqual(summary.missing_count, expected.missing_count)
+        self.assertEqual(summary.last_seq_num, expected.last_seq_num)
+        self.assertEqual(summary.last_cell_id, expected.last_cell_id)
+        self.assertEqual(summary.last_msg_gen_ts, expected.last_msg_gen_ts)
+        self.assertEqual(
+            summary.message_count,
+            TestSerialData.objects.filter(device_serial__serial=serial).count(),
+        )
+
+
+class RetentionTests(TestCase):
+    # A device with a row saved for each of `ages`, created that long before
+    # `now` in the order saved
+    def device_rows(self, serial, now, ages):
+        save_messages(device_messages(serial, len(ages)))
+        rows = TestSerialData.objects.filter(device_serial__serial=serial)
+        row_ids = list(rows.order_by("id").values_list("id", flat=True))
+        self.assertEqual(len(row_ids), len(ages))
+        for row_id, age in zip(row_ids, ages):
+            rows.filter(id=row_id).update(create_at=now - age)
+        return TestDevice.objects.get(serial=serial)
+
+    def test_deleted_in_batches_up_to_cutoff(self):
+        now = timezone.now()
+        cutoff = now - timedelta(days=30)
+        # 12 rows before the cutoff, the last a microsecond before, one on it
+        ages = (
+            [timedelta(days=40, minutes=-index) for index in range(11)]
+            + [timedelta(days=30, microseconds=1), timedelta(days=30)]
+            + [timedelta(days=1, minutes=-index) for index in range(5)]
+        )
+        device = self.device_rows("RETAAA", now, ages)
+        summary = DeviceSummary.objects.get(device=device)
+        self.assertEqual(summary.message_count, len(ages))
+
+        with mock.patch.object(
+            retention, "remove_messages", wraps=retention.remove_messages
+        ) as remove_messages:
+            deleted = retention.delete_device_rows(device.id, before=cutoff, size=5)
+
+        self.assertEqual(deleted, 12)
+        self.assertEqual(
+            [call.args for call in remove_messages.call_args_list],
+            [(device.id, 5), (device.id, 5), (device.id, 2)],
+        )
+        rows = TestSerialData.objects.filter(device_serial=device)
+        self.assertEqual(rows.count(), 6)
+        self.assertEqual(min(rows.values_list("create_at", flat=True)), cutoff)
+        self.assertEqual(
+            TestSerialPayload.objects.filter(serial_data__device_serial=device).count(),
+            6,
+        )
+        summary.refresh_from_db()
+        self.assertEqual(summary.message_count, 6)
+
+        # Nothing left to delete
+        self.assertEqual(retention.delete_device_rows(device.id, cutoff, size=5), 0)
+
+    @override_settings(N5_RETENTION_DAYS=30, N5_RETENTION_DEVICE_DAYS={"RETCCC": None})
+    def test_retention_per_device(self):
+        now = timezone.now()
+        # Half a day off whole days, clear of the cutoffs
+        ages = [timedelta(days=40 - index, hours=-12) for index in range(20)]
+        kept = self.device_rows("RETBBB", now, ages)
+        unlimited = self.device_rows("RETCCC", now, ages)
+
+        freed = retention.apply_retention(size=3)
+        self.assertEqual(list(freed), ["RETBBB"])
+        self.assertEqual(freed["RETBBB"][0], 10)
+        self.assertEqual(TestSerialData.objects.filter(device_serial=kept).count(), 10)
+        self.assertEqual(
+            TestSerialData.objects.filter(device_serial=unlimited).count(), 20
+        )
+
+        # `days` applies to every device
+        freed = retention.apply_retention(days=35, size=3)
+        self.assertEqual(freed["RETCCC"][0], 5)
+        self.assertEqual(DeviceSummary.objects.get(device=unlimited).message_count, 15)
+
+
+class SamplesTests(TestCase):
+    # The packed samples of every message of the device match its payload
+    # decoded with parse_xyz_payload
+    def assert_samples_match_payloads(self, serial):
+        device_samples = samples.load_samples(serial)
+        rows = (
+            TestSerialData.objects.filter(
+                device_serial__serial=serial, msg_type__isnull=False
+            )
+            .exclude(msg_type=parse_logger_msg.MSG_TYPE_BOOT_INFO)
+            .select_related("content")
+        )
+        payload_types = set()
+        with_samples = set()
+        for item in rows:
+            xyz_payload = parse_logger_msg.parser.parse_xyz_payload(
+                item.content.data_msg,
+                parse_logger_msg.payload_type_for(item.trumi_st, item.buffer_link_type),
+            )
+            if not len(xyz_payload):
+                continue
+            payload_types.add(xyz_payload.payload_type)
+            with_samples.add(item.id)
+
+            message_samples = device_samples[device_samples.serial_data_id == item.id]
+            frames = xyz_payload.frame_index
+            np.testing.assert_array_equal(message_samples.xyz, xyz_payload.xyz)
+            np.testing.assert_array_equal(
+                message_samples.timestamps, xyz_payload.timestamps[frames]
+            )
+            if xyz_payload.state is None:
+                expected_state = np.full(len(frames), samples.NO_STATE)
+            else:
+                expected_state = xyz_payload.state[frames]
+            np.testing.assert_array_equal(message_samples.state, expected_state)
+
+        self.assertEqual(payload_types, {"decompress_payload", "link_lost_mode", ""})
+        self.assertEqual(set(device_samples.serial_data_id.tolist()), with_samples)
+        return device_samples
+
+    @override_settings(N5_LAZY_PAYLOAD_DECODE=True, N5_INGEST_STORE_SAMPLES=True)
+    def test_stored_at_ingest(self):
+        save_messages(device_messages("SMPAAA", 60))
+        device_samples = self.assert_samples_match_payloads("SMPAAA")
+
+        # Ordered by message time, a range keeps the samples inside it
+        timestamps = device_samples.timestamps
+        message_ids, first_indexes = np.unique(
+            device_samples.serial_data_id, return_index=True
+        )
+        message_order = message_ids[np.argsort(first_indexes)]
+        start_times = [
+            timestamps[device_samples.serial_data_id == message_id].min()
+            for message_id in message_order
+        ]
+        self.assertEqual(start_times, sorted(start_times))
+        start, end = np.percentile(timestamps, [25, 75]).astype(int).tolist()
+        in_range = samples.load_samples(
+            "SMPAAA",
+            datetime.fromtimestamp(start, dt_timezone.utc),
+            datetime.fromtimestamp(end, dt_timezone.utc),
+        )
+        keep = (timestamps >= start) & (timestamps <= end)
+        np.testing.assert_array_equal(in_range.xyz, device_samples.xyz[keep])
+        np.testing.assert_array_equal(
+            in_range.serial_data_id, device_samples.serial_data_id[keep]
+        )
+
+    # Messages saved before their samples were stored, decoded at ingest and
+    # stored undecoded
+    def test_built_by_command(self):
+        for serial, lazy in (("SMPBBB", False), ("SMPCCC", True)):
+            with override_settings(
+                N5_LAZY_PAYLOAD_DECODE=lazy, N5_INGEST_STORE_SAMPLES=False
+            ):
+                save_messages(device_messages(serial, 60))
+        TestSerialSamples.objects.all().delete()
+
+        call_command("build_samples", batch_size=7, stdout=StringIO())
+        for serial in ("SMPBBB", "SMPCCC"):
+            with self.subTest(serial=serial):
+                self.assert_samples_match_payloads(serial)
+
+
+class IngestLogsTests(TestCase):
+    def test_resume_from_committed_offset(self):
+        messages = device_messages("LOGAAA", 40)
+        expected = ingest.parse_messages(messages)
+        # Lines without a message are passed over
+        lines = (
+            messages[:5] + ["logger restarted"] + messages[5:30] + [""] + messages[30:]
+        )
+        save_parsed_msgs = ingest.save_parsed_msgs
+        saves = 0
+
+        # The fourth batch fails before it is saved, as if the process died
+        def crashing_save(parsed_msgs):
+            nonlocal saves
+            saves += 1
+            if saves == 4:
+                raise RuntimeError("killed")
+            return save_parsed_msgs(parsed_msgs)
+
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_path = Path(log_dir) / "serial.log"
+            log_path.write_text("".join(f"{line}\n" for line in lines))
+            out = StringIO()
+            with mock.patch.object(
+                ingest, "save_parsed_msgs", crashing_save
+            ), self.assertRaises(RuntimeError):
+                call_command("ingest_logs", str(log_path), batch_size=7, stdout=out)
+
+            reports = re.findall(
+                r"committed up to byte (\d+), (\d+) rows", out.getvalue()
+            )
+            self.assertEqual(len(reports), 3)
+            offset, saved = map(int, reports[-1])
+            self.assertEqual(TestSerialData.objects.count(), saved)
+            # At a line start
+            self.assertEqual(log_path.read_bytes()[offset - 1 : offset], b"\n")
+
+            out = StringIO()
+            call_command(
+                "ingest_logs", str(log_path), batch_size=7, offset=offset, stdout=out
+            )
+
+        # Nothing saved twice or skipped
+        self.assertIn(f"Saved {len(expected) - saved} rows", out.getvalue())
+        seq_nums = list(
+            TestSerialData.objects.order_by("id").values_list("seq_num", flat=True)
+        )
+        self.assertEqual(
+            seq_nums,
+            [
+                ingest.serial_data_fields(parsed_msg)["seq_num"]
+                for parsed_msg in expected
+            ],
+        )
+
+
+# Ingest looks devices up in the device cache instead of the database
+class DeviceCacheTests(TestCase):
+    def device_queries(self, queries):
+        table = TestDevice._meta.db_table
+        return [query["sql"] for query in queries if table in query["sql"]]
+
+    def test_warmed_cache_makes_no_device_queries(self):
+        lines = device_messages("CCHAAA", 10) + device_messages("CCHBBB", 10)
+        save_messages(lines[::2])
+        device_cache.invalidate()
+        device_cache.warm()
+
+        with CaptureQueriesContext(connection) as queries:
+            saved = save_messages(lines[1::2])
+        self.assertEqual(saved, 10)
+        self.assertEqual(self.device_queries(queries.captured_queries), [])
+
+    def test_least_recently_used_evicted(self):
+        cache = device_cache.__class__(max_size=2)
+        cache.get_ids(["LRUAAA", "LRUBBB"])
+        cache.get_id("LRUAAA")
+        cache.get_id("LRUCCC")
+        self.assertEqual(list(cache.device_ids), ["LRUAAA", "LRUCCC"])
+
+    def test_warm_loads_newest_devices(self):
+        devices = [
+            TestDevice.objects.create(serial=serial)
+            for serial in ("WRMAAA", "WRMBBB", "WRMCCC")
+        ]
+        cache = device_cache.__class__(max_size=2)
+        self.assertEqual(cache.warm(), 2)
+
+        with self.assertNumQueries(0):
+            device_ids = cache.get_ids(["WRMBBB", "WRMCCC"])
+        self.assertEqual(device_ids, {"WRMBBB": devices[1].id, "WRMCCC": devices[2].id})
+        self.assertNotIn("WRMAAA", cache.device_ids)
+
+    def test_purge_invalidates_device(self):
+        save_messages(device_messages("PRGDEV", 5))
+        self.assertIn("PRGDEV", device_cache.device_ids)
+        retention.purge_device("PRGDEV")
+        self.assertNotIn("PRGDEV", device_cache.device_ids)
+
+
+# The foreign key is checked when the transaction commits
+class DeletedDeviceTests(TransactionTestCase):
+    def test_stale_cached_device_created_again(self):
+        lines = device_messages("DELDEV", 20)
+        save_messages(lines[:10])
+        stale_id = device_cache.get_id("DELDEV")
+        # Deleted by another process, this one's cache still has it
+        TestDevice.objects.filter(id=stale_id).delete()
+
+        with mock.patch.object(
+            device_cache, "forget_deleted", wraps=device_cache.forget_deleted
+        ) as forget_deleted:
+            saved = save_messages(lines[10:])
+        forget_deleted.assert_called_once_with({"DELDEV"})
+
+        device = TestDevice.objects.get(serial="DELDEV")
+        self.assertNotEqual(device.id, stale_id)
+        self.assertEqual(device_cache.get_id("DELDEV"), device.id)
+        self.assertEqual(saved, 10)
+        self.assertEqual(
+            TestSerialData.objects.filter(device_serial=device).count(), 10
+        )
+
+
+# The writer thread's connection handling needs real transactions
+class SpooledIngestTests(TransactionTestCase):
+    def test_poison_message_quarantined(self):
+        lines = device_messages("SPLBAD", 10)
+        with tempfile.TemporaryDirectory() as spool_dir:
+            writer = ingest.SpooledIngestWriter(
+                spool_dir,
+                batch_size=20,
+                flush_ms=0,
+                metrics_dir=Path(spool_dir) / "metrics",
+            )
+            for line in lines:
+                writer.put(line)
+            writer.stopping.set()
+            quarantine = Path(spool_dir) / ingest.QUARANTINE_FILE
+
+            # A database that is down fails every message, the batch stays
+            # in the spool
+            with poisoned(lines[0], OperationalError("database is locked")):
+                writer.consume()
+            self.assertEqual(TestSerialData.objects.count(), 0)
+            self.assertGreater(writer.spool.backlog_bytes(), 0)
+            self.assertFalse(quarantine.exists())
+
+            rejected = counter_total("n5_ingest_rejected_total")
+            with poisoned(lines[3]):
+                writer.consume()
+            self.assertEqual(TestSerialData.objects.count(), len(lines) - 1)
+            self.assertEqual(writer.spool.backlog_bytes(), 0)
+            self.assertEqual(quarantine.read_text(), f"{lines[3]}\n")
+            self.assertEqual(counter_total("n5_ingest_rejected_total"), rejected + 1)
+            writer.spool.close()
+
+
+# The writer thread saves with its own connection
+class IngestServiceTests(TransactionTestCase):
+    topic = "n5/test"
+
+    # Publish `lines` through a stand-in broker on a free port to a running
+    # service, then stop it once it has queued them all. `while_running` is
+    # awaited with the service and the messages queued so far after publishing.
+    async def ingest(self, writer, lines, while_running=None):
+        queued = []
+        put = writer.put
+
+        def counted_put(message, *args, **kwargs):
+            put(message, *args, **kwargs)
+            queued.append(message)
+
+        broker = mqtt_broker.MQTTBroker()
+        port = await broker.start("127.0.0.1", 0)
+        with mock.patch.object(writer, "put", counted_put):
+            service = mqtt.IngestService("127.0.0.1", port, self.topic, writer=writer)
+            service_task = asyncio.create_task(service.run())
+            try:
+                await asyncio.wait_for(service.subscribed.wait(), 10)
+                for line in lines:
+                    await broker.publish(self.topic, line.encode())
+                if while_running is not None:
+                    await while_running(service, queued)
+
+                async def all_queued():
+                    while len(queued) < len(lines):
+                        await asyncio.sleep(0.01)
+
+                await asyncio.wait_for(all_queued(), 10)
+            finally:
+                service.stop()
+                await service_task
+                await broker.stop()
+
+        return service
+
+    # Sequence numbers of the device's rows, in the order saved
+    def saved_seq_nums(self, serial):
+        return list(
+            TestSerialData.objects.filter(device_serial__serial=serial)
+            .order_by("id")
+            .values_list("seq_num", flat=True)
+        )
+
+    def seq_nums(self, lines):
+        return [
+            ingest.serial_data_fields(parsed_msg)["seq_num"]
+            for parsed_msg in ingest.parse_messages(lines)
+        ]
+
+    def test_published_messages_saved(self):
+        lines = device_messages("MQTAAA", 30)
+        writer = ingest.IngestWriter(flush_ms=0, metrics_dir="")
+
+        service = asyncio.run(self.ingest(writer, lines))
+
+        self.assertIsNone(service.sock)
+        self.assertEqual(self.saved_seq_nums("MQTAAA"), self.seq_nums(lines))
+
+    # With the writer queue full the service stops reading from the broker,
+    # and reads the rest in order once the writer catches up
+    def test_reading_paused_while_writer_queue_full(self):
+        lines = device_messages("MQTBBB", 30)
+        writer = ingest.IngestWriter(flush_ms=0, queue_max=2, metrics_dir="")
+        released = threading.Event()
+        write = writer.write
+
+        def held_write(items):
+            released.wait(10)
+            return write(items)
+
+        async def while_held(service, queued):
+            async def paused():
+                while not service.paused:
+                    await asyncio.sleep(0.01)
+
+            try:
+                await asyncio.wait_for(paused(), 10)
+                # Nothing more is read while paused
+                read = len(queued) + len(service.pending)
+                await asyncio.sleep(0.2)
+                self.assertEqual(len(queued) + len(service.pending), read)
+                self.assertLess(read, len(lines))
+                self.assertEqual(len(service.pending), 1)
+            finally:
+                released.set()
+
+        with mock.patch.object(writer, "write", held_write):
+            service = asyncio.run(self.ingest(writer, lines, while_held))
+
+        self.assertFalse(service.paused)
+        self.assertEqual(self.saved_seq_nums("MQTBBB"), self.seq_nums(lines))
+
+
+# The workers are forked from the test process, settings overridden and mocks
+# made before the pool's first batch reach them
+@override_settings(N5_LAZY_PAYLOAD_DECODE=False, N5_INGEST_STORE_SAMPLES=False)
+class ParsePoolTests(TestCase):
+    # Messages of several devices, the sample messages and two malformed ones
+    def mixed_batch(self):
+        lines = corpus.generate_messages(150) + list(SAMPLE_MESSAGES)
+        lines[20] = lines[20][:-1]
+        lines[100] = "not a logger message"
+        return lines
+
+    def test_parsed_in_order_as_in_thread(self):
+        lines = self.mixed_batch()
+        pool = parse_pool.ParsePool(2)
+        self.addCleanup(pool.shutdown)
+
+        skipped = counter_total("n5_ingest_skipped_total")
+        parsed = pool.parse_messages(lines)
+        in_pool_skipped = counter_total("n5_ingest_skipped_total") - skipped
+        in_thread = ingest.parse_messages(lines)
+        in_thread_skipped = (
+            counter_total("n5_ingest_skipped_total") - skipped - in_pool_skipped
+        )
+
+        self.assertEqual(parsed, in_thread)
+        # In the order received, less the line that is not a message
+        self.assertEqual(
+            [parsed_msg["data_msg"] for parsed_msg in parsed],
+            [line.split(": ")[-1] for index, line in enumerate(lines) if index != 100],
+        )
+        # The workers' metrics are added to the writer's
+        self.assertEqual(in_pool_skipped, in_thread_skipped)
+        self.assertGreater(in_pool_skipped, 0)
+
+    def test_worker_error_reaches_writer(self):
+        lines = self.mixed_batch()
+        poison = lines[130]
+        parse_msg = parse_logger_msg.parser.parse_msg
+
+        def failing_parse(message, *args, **kwargs):
+            if message == poison:
+                raise RuntimeError("parser crashed")
+            return parse_msg(message, *args, **kwargs)
+
+        with override_settings(N5_INGEST_PARSE_WORKERS=2):
+            writer = ingest.IngestWriter(metrics_dir="")
+        self.addCleanup(writer.parse_pool.shutdown)
+        errors = counter_total("n5_ingest_errors_total")
+        with mock.patch.object(parse_logger_msg.parser, "parse_msg", failing_parse):
+            rejected = writer.save(lines)
+
+        # The batch failed in the writer, which saved the messages one at a
+        # time
+        self.assertIsNotNone(writer.parse_pool.executor)
+        self.assertEqual(counter_total("n5_ingest_errors_total"), errors + 1)
+        self.assertEqual(rejected, [poison])
+        self.assertEqual(
+            TestSerialData.objects.count(), len(ingest.parse_messages(lines)) - 1
+        )
+
+
+class MetricsTests(SimpleTestCase):
+    def recorded(self, queue_depth):
+        recorded = metrics.Metrics()
+        recorded.observe("n5_ingest_db_write_seconds", 0.003, {"msg_type": "motion"})
+        recorded.observe("n5_ingest_db_write_seconds", 0.2, {"msg_type": "motion"})
+        recorded.inc("n5_ingest_messages_total", amount=2)
+        recorded.set_gauge("n5_ingest_queue_depth", queue_depth)
+        return recorded.snapshot()
+
+    def test_merge_adds_counters_and_keeps_gauges_per_process(self):
+        first = dict(self.recorded(3), process="ingest-worker-0")
+        second = dict(self.recorded(5), process="ingest-worker-1")
+        buckets, histograms, counters, gauges = metrics.merge([first, second])
+
+        histogram = histograms["n5_ingest_db_write_seconds"][(("msg_type", "motion"),)]
+        self.assertEqual(histogram[buckets.index(0.005)], 2)
+        self.assertEqual(histogram[buckets.index(0.25)], 2)
+        self.assertEqual(sum(histogram[:-1]), 4)
+        self.assertAlmostEqual(histogram[-1], 0.406)
+        self.assertEqual(counters["n5_ingest_messages_total"], {(): 4})
+        self.assertEqual(
+            gauges["n5_ingest_queue_depth"],
+            {
+                (("process", "ingest-worker-0"),): 3,
+                (("process", "ingest-worker-1"),): 5,
+            },
+        )
+
+    def test_render_prometheus(self):
+        text = metrics.render_prometheus([dict(self.recorded(3), process="w0")])
+        lines = text.splitlines()
+
+        self.assertIn("# TYPE n5_ingest_db_write_seconds histogram", lines)
+        # Buckets are cumulative, +Inf holds every observation
+        self.assertIn(
+            'n5_ingest_db_write_seconds_bucket{msg_type="motion",le="0.001"} 0',
+            lines,
+        )
+        self.assertIn(
+            'n5_ingest_db_write_seconds_bucket{msg_type="motion",le="0.005"} 1',
+            lines,
+        )
+        self.assertIn(
+            'n5_ingest_db_write_seconds_bucket{msg_type="motion",le="+Inf"} 2',
+            lines,
+        )
+        self.assertIn('n5_ingest_db_write_seconds_count{msg_type="motion"} 2', lines)
+        self.assertIn("# TYPE n5_ingest_messages_total counter", lines)
+        self.assertIn("n5_ingest_messages_total 2", lines)
+        self.assertIn("# TYPE n5_ingest_queue_depth gauge", lines)
+        self.assertIn('n5_ingest_queue_depth{process="w0"} 3', lines)
+        self.assertTrue(text.endswith("\n"))
+
+    def test_snapshots_removed_and_expired(self):
+        with tempfile.TemporaryDirectory() as metrics_dir, override_settings(
+            N5_METRICS_DIR=metrics_dir, N5_METRICS_EXPIRE_SECONDS=60
+        ), mock.patch.object(metrics, "process_name", "ingest-worker-0"):
+            saved = metrics.Metrics()
+            saved.set_gauge("n5_ingest_queue_depth", 7)
+            saved.save(force=True)
+            dead = Path(metrics_dir) / "process-1.json"
+            dead.write_text(json.dumps(self.recorded(9)))
+            os.utime(dead, (0, 0))
+
+            with mock.patch.object(metrics, "process_name", "web"):
+                _, _, _, gauges = metrics.merge(metrics.collect())
+            queue_depths = gauges["n5_ingest_queue_depth"]
+            self.assertEqual(queue_depths[(("process", "ingest-worker-0"),)], 7)
+            self.assertNotIn((("process", "process-1"),), queue_depths)
+            self.assertFalse(dead.exists())
+
+            saved.remove()
+            self.assertEqual(list(Path(metrics_dir).iterdir()), [])
+
+    def test_export_restricted_to_allowed_ips(self):
+        for address, status in (
+            ("127.0.0.1", 200),
+            ("10.1.2.3", 200),
+            ("192.0.2.1", 403),
+            ("unknown", 403),
+        ):
+            request = RequestFactory().get("/metrics", REMOTE_ADDR=address)
+            with self.subTest(address=address), override_settings(
+                N5_METRICS_ALLOWED_IPS=["127.0.0.1", "10.0.0.0/8"], N5_METRICS_DIR=None
+            ):
+                self.assertEqual(views.metrics_export(request).status_code, status)
+
+
+@skipUnless(connection.vendor == "postgresql", "COPY is PostgreSQL only")
+class PgCopyTests(TestCase):
+    def test_text_format_escapes(self):
+        device = TestDevice.objects.create(serial="CPYESC")
+        item = TestSerialData(
+            device_serial=device,
+            lgr_msg_ts="tab\there",
+            seq_num=1,
+            msg_gen_ts=None,
+            cell_id="back\\slash",
+            trumi_st_upd_count=0,
+            wifi_aps="\\N",
+            pld_crc="",
+            header_crc="",
+        )
+        content = TestSerialPayload(
+            serial_data=item,
+            data_msg="new\nline\r\n",
+            payload="\t\\N\n",
+            xyz_raw="",
+            payload_type=None,
+        )
+        pg_copy.copy_rows(TestSerialData, [item])
+        pg_copy.copy_rows(TestSerialPayload, [content])
+
+        saved = TestSerialData.objects.select_related("content").get(id=item.id)
+        self.assertEqual(saved.lgr_msg_ts, "tab\there")
+        self.assertEqual(saved.cell_id, "back\\slash")
+        # The text of the NULL marker is not NULL
+        self.assertEqual(saved.wifi_aps, "\\N")
+        self.assertIsNone(saved.msg_gen_ts)
+        self.assertIsNone(saved.actual_temp)
+        self.assertEqual(saved.content.data_msg, "new\nline\r\n")
+        self.assertEqual(saved.content.payload, "\t\\N\n")
+        self.assertEqual(saved.content.xyz_raw, "")
+        self.assertIsNone(saved.content.payload_type)
+
+    def test_reserve_ids(self):
+        device = TestDevice.objects.create(serial="CPYIDS")
+        create_rows(device, [1])
+        items = [
+            TestSerialData(device_serial=device, seq_num=seq_num)
+            for seq_num in range(2, 7)
+        ]
+        with self.assertNumQueries(0):
+            pg_copy.reserve_ids(TestSerialData, [])
+        pg_copy.reserve_ids(TestSerialData, items)
+
+        ids = [item.pk for item in items]
+        self.assertEqual(len(set(ids)), len(ids))
+        first_id = TestSerialData.objects.get(device_serial=device).id
+        self.assertGreater(min(ids), first_id)
+        # Taken from the sequence, rows saved later do not get them
+        next_id = create_rows(device, [7])[0].id
+        self.assertGreater(next_id, max(ids))
@@ -4,4 +4,5 @@ from . import views
 urlpatterns = [
     # path("", views.backend, name="backend"),
     path("", views.maintenance, name="maintenance"),
+    path("metrics", views.metrics_export, name="metrics"),
 ]
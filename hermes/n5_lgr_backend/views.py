@@ -1,15 +1,48 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.core.paginator import Paginator
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from django.views.decorators.cache import cache_page
-from .models import TestDevice, TestSerialData
+from .lib import export, metrics, retention, seq_gaps
+from .models import DeviceSummary, TestDevice, TestSerialData
+import ipaddress
 import re
 
 
+# Clients the export can be sent gzipped to
+ACCEPTS_GZIP = re.compile(r"\bgzip\b")
+
+
 def maintenance(request):
     return render(request, "n5_lgr_backend/maintenance.html")
 
 
+# Ingest metrics of every process in Prometheus text format, for the scrapers
+# in N5_METRICS_ALLOWED_IPS only
+def metrics_export(request):
+    if not metrics_allowed(request.META.get("REMOTE_ADDR")):
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        metrics.render_prometheus(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def metrics_allowed(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+
+    return any(
+        address in ipaddress.ip_network(allowed, strict=False)
+        for allowed in getattr(settings, "N5_METRICS_ALLOWED_IPS", ())
+    )
+
+
 @cache_page(60 * 15)
 def backend(request):
     serials = TestDevice.objects.all()
@@ -21,12 +54,11 @@ def backend(request):
         export_data = request.POST.get("exportData")
 
         if delete_records:
-            try:
-                record = TestDevice.objects.get(serial=current_serial)
-            except TestDevice.DoesNotExist:
+            # Deleted in batches, without loading the device's rows. The
+            # ingest workers' device caches still have it, their next save
+            # fails on the foreign key and creates it again.
+            if retention.purge_device(current_serial) is None:
                 print("Device does not exist")
-            else:
-                record.delete()
 
             current_serial = serials.first()
             message_data = TestSerialData.objects.filter(
@@ -39,63 +71,18 @@ def backend(request):
             )
 
         if export_data:
-            csv_data = (
-                "seq_num| "
-                "msg_gen_ts| "
-                "msg type| "
-                "cell_id| "
-                "cell_id_ts| "
-                "actual_temp| "
-                "trumi_st| "
-                "flags| "
-                "trumi_st_upd_count| "
-                "trumi_st_upd_ts| "
-                "trumi_st_trans_count| "
-                "reloc_st_trans_count| "
-                "stored_st_trans_count| "
-                "wifi_aps| "
-                "pld_sz| "
-                "pld_crc| "
-                "buffer_link_type| "
-                "header_crc| "
-                "xyz_decomp\n"
-            )
-            for item in message_data:
-                payload_data = item.payload
-                # Check if 'samples' is in payload data and then look for decomrpessed xyz data
-                if "samples" in payload_data:
-                    decomp_payload = payload_data.split("samples")
-                    # Remove preceding [x]...
-                    payload_data = re.sub(r"\[\d+\] ", "", decomp_payload[1])
-                    payload_data = payload_data.replace("\n", "")
-
-                flags = item.flags.replace("\n", ",")
-
-                csv_data += (
-                    f"{item.seq_num}| "
-                    f"{item.msg_gen_ts}| "
-                    f"{item.msg_type}| "
-                    f"{item.cell_id}| "
-                    f"{item.cell_id_ts}| "
-                    f"{item.actual_temp}| "
-                    f"{item.trumi_st}| "
-                    f"{flags}| "
-                    f"{item.trumi_st_upd_count}| "
-                    f"{item.trumi_st_upd_ts}| "
-                    f"{item.trumi_st_trans_count}| "
-                    f"{item.reloc_st_trans_count}| "
-                    f"{item.stored_st_trans_count}| "
-                    f"{item.wifi_aps}| "
-                    f"{item.pld_sz}| "
-                    f"{item.pld_crc}| "
-                    f"{item.buffer_link_type}| "
-                    f"{item.header_crc}| "
-                    f"{payload_data}\n"
-                )
-
             export_filename = f"{current_serial}_logger_data.csv"
-            # Create a response with the CSV data as a file attachment
-            response = HttpResponse(csv_data, content_type="text/csv")
+            # Streamed as the rows are read, gzipped for clients accepting it
+            content = export.export_lines(message_data)
+            gzipped = export.gzip_enabled() and ACCEPTS_GZIP.search(
+                request.headers.get("Accept-Encoding", "")
+            )
+            if gzipped:
+                content = compress_sequence(line.encode() for line in content)
+            response = StreamingHttpResponse(content, content_type="text/csv")
+            if gzipped:
+                response["Content-Encoding"] = "gzip"
+            patch_vary_headers(response, ("Accept-Encoding",))
             response["Content-Disposition"] = (
                 f'attachment; filename="{export_filename}"'
             )
@@ -122,27 +109,27 @@ def backend(request):
             device_serial=current_serial
         ).order_by("-create_at")
 
-    # Check for message gaps
-    prev_seq_num = None
-    for data in message_data:
-        data.is_incremental = prev_seq_num is None or prev_seq_num - data.seq_num == 1
-        prev_seq_num = data.seq_num
-
-    # Most recent message item is always incremental
-    if message_data:
-        message_data[0].is_incremental = True
-
     # Define how many records per page you want to display
     records_per_page = 50
     paginator = Paginator(message_data, records_per_page)
+    # The device's row count comes from its summary instead of a COUNT(*)
+    summary = DeviceSummary.objects.filter(device__serial=str(current_serial)).first()
+    if summary is not None:
+        paginator.count = summary.message_count
 
     page_number = request.GET.get("page")
     page_obj = paginator.get_page(page_number)
+    # Only the rows on the page are read, checked for message gaps and have
+    # their payloads loaded, and decoded if stored undecoded. The most recent
+    # message is always incremental.
+    page_obj.object_list = seq_gaps.page_rows(message_data, page_obj)
+    TestSerialData.decode_payloads(page_obj)
 
     context = {
         "message_data": message_data,
         "serials": serials,
         "current_serial": current_serial,
+        "summary": summary,
         "page_obj": page_obj,
     }
 